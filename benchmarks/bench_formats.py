@@ -0,0 +1,42 @@
+"""
+Benchmarks of writing and reading meshes in the output
+formats of the mesh tools, with the size of the files
+"""
+import os
+import tempfile
+
+from napari_matous.meshdata import MeshData
+from napari_matous.meshwriter import FORMATS, read_mesh_data, write_mesh
+
+from .bench_meshdata import grid_mesh
+
+
+class MeshFormatSuite:
+    """
+    Write time, read time and file size of a mesh in every
+    output format
+    """
+    params = [[100_000, 1_000_000], list(FORMATS.values())]
+    param_names = ['triangles', 'suffix']
+    timeout = 300
+
+    def setup(self, n_triangles, suffix):
+        self.mesh = MeshData(*grid_mesh(n_triangles))
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'mesh' + suffix)
+        self.written = os.path.join(self.directory.name, 'written' + suffix)
+        write_mesh(self.mesh, self.path)
+
+    def teardown(self, n_triangles, suffix):
+        self.directory.cleanup()
+
+    def time_write(self, n_triangles, suffix):
+        write_mesh(self.mesh, self.written)
+
+    def time_read(self, n_triangles, suffix):
+        read_mesh_data(self.path)
+
+    def track_file_size(self, n_triangles, suffix):
+        return os.path.getsize(self.path)
+
+    track_file_size.unit = 'bytes'
@@ -0,0 +1,105 @@
+"""
+Benchmarks for the gamer tool
+"""
+import os
+import tempfile
+
+import meshio
+import numpy as np
+import pygamer
+
+from napari_matous import gamer
+
+
+def sphere_mesh(subdivisions):
+    """Triangulated UV sphere with roughly 2 * subdivisions ** 2 triangles"""
+    theta, phi = np.meshgrid(np.linspace(0.1, np.pi - 0.1, subdivisions),
+                             np.linspace(0, 2 * np.pi, subdivisions, endpoint=False), indexing='ij')
+    verts = np.stack([np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)],
+                     axis=-1).reshape(-1, 3)
+    index = np.arange(subdivisions * subdivisions).reshape(subdivisions, subdivisions)
+    a, b = index[:-1], np.roll(index, -1, axis=1)[:-1]
+    c, d = index[1:], np.roll(index, -1, axis=1)[1:]
+    faces = np.concatenate([np.stack([a, b, c], -1).reshape(-1, 3),
+                            np.stack([b, d, c], -1).reshape(-1, 3)])
+    return verts, faces
+
+
+class ReadMeshSuite:
+    """
+    Reading a non .obj mesh into pygamer in memory compared
+    with the previous round trip through an .obj file
+    """
+    params = [100, 300, 1000]
+    param_names = ['subdivisions']
+    timeout = 300
+
+    def setup(self, subdivisions):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mesh.ply')
+        verts, faces = sphere_mesh(subdivisions)
+        meshio.write_points_cells(self.path, verts, [('triangle', faces)])
+
+    def teardown(self, subdivisions):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def time_obj_round_trip(self, subdivisions):
+        obj_path = os.path.join(self.directory, 'input_mesh.obj')
+        meshio.read(self.path).write(obj_path)
+        pygamer.readOBJ(obj_path)
+
+    def time_in_memory(self, subdivisions):
+        gamer.read_mesh(self.path)
+
+
+class PreparedMeshSuite:
+    """
+    Setup cost of a gamer run with a cold and a warm
+    prepared mesh cache
+    """
+    params = [100, 300]
+    param_names = ['subdivisions']
+    timeout = 300
+
+    def setup(self, subdivisions):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mesh.ply')
+        verts, faces = sphere_mesh(subdivisions)
+        meshio.write_points_cells(self.path, verts, [('triangle', faces)])
+        gamer.prepared_mesh(self.path)
+
+    def teardown(self, subdivisions):
+        gamer.clear_prepared_meshes()
+        os.remove(self.path)
+        os.rmdir(self.directory)
+
+    def time_cold(self, subdivisions):
+        gamer.clear_prepared_meshes()
+        gamer.prepared_mesh(self.path)
+
+    def time_warm(self, subdivisions):
+        gamer.prepared_mesh(self.path)
+
+
+class GamerOpsSuite:
+    """
+    Time and peak memory of the coarse, scale and smooth
+    methods, each run on a freshly prepared mesh
+    """
+    params = ([100, 300], ['coarse', 'scale', 'smooth'])
+    param_names = ['subdivisions', 'method']
+    timeout = 300
+    # The methods change the mesh in place, so every sample gets a new one
+    number = 1
+    warmup_time = 0
+
+    def setup(self, subdivisions, method):
+        self.mesh = gamer.prepare_mesh(gamer.surface_mesh_from_arrays(*sphere_mesh(subdivisions)))
+
+    def time_method(self, subdivisions, method):
+        gamer.OPERATIONS[method](self.mesh)
+
+    def peakmem_method(self, subdivisions, method):
+        gamer.OPERATIONS[method](self.mesh)
@@ -0,0 +1,21 @@
+"""
+Import time of the plugin, the widgets must not pull in
+tensorflow, open3d or pygamer when napari loads them
+"""
+
+
+class ImportSuite:
+    """
+    Fresh interpreter import time of the package and of
+    each widget module
+    """
+    params = ['napari_matous',
+              'napari_matous.segment',
+              'napari_matous.stardistsegment',
+              'napari_matous.meshfilter',
+              'napari_matous.tiff2mesh',
+              'napari_matous.gamer']
+    param_names = ['module']
+
+    def timeraw_import(self, module):
+        return f"import {module}"
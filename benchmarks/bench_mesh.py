@@ -0,0 +1,40 @@
+"""
+Benchmarks for chunked marching cubes meshing
+"""
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.measure import marching_cubes
+
+from napari_matous.chunkedmesh import chunked_marching_cubes
+
+
+def blob_volume(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return ndi.gaussian_filter(rng.random((size, size, size), dtype=np.float32), 3) > 0.5
+
+
+class ChunkedMarchingCubesSuite:
+    """
+    Scaling of chunked marching cubes with the number of
+    workers compared with a single marching cubes call
+    """
+    params = ([128, 256], [1, 2, 4, 8])
+    param_names = ['size', 'workers']
+    timeout = 600
+
+    def setup(self, size, workers):
+        self.volume = blob_volume(size)
+
+    def time_single_shot(self, size, workers):
+        marching_cubes(self.volume, 0.5, spacing=(4, 1, 1))
+
+    def time_chunked(self, size, workers):
+        chunked_marching_cubes(self.volume, 0.5, spacing=(4, 1, 1), chunk_size=64,
+                               workers=workers)
+
+    def peakmem_single_shot(self, size, workers):
+        marching_cubes(self.volume, 0.5, spacing=(4, 1, 1))
+
+    def peakmem_chunked(self, size, workers):
+        chunked_marching_cubes(self.volume, 0.5, spacing=(4, 1, 1), chunk_size=64,
+                               workers=workers)
@@ -0,0 +1,74 @@
+"""
+Benchmarks for handing meshes to napari through MeshData
+compared with the previous round trip through open3d
+"""
+import numpy as np
+
+from napari_matous.meshdata import MeshData
+
+# Vertex and face dtypes returned by the mesh producers of the plugin,
+# marching cubes returns float64 vertices once a spacing is given
+PRODUCERS = {'marching_cubes': (np.float64, np.int32),
+             'chunked_marching_cubes': (np.float64, np.int64)}
+
+
+def grid_mesh(n_triangles, vertex_dtype=np.float64, face_dtype=np.int32):
+    """Flat grid mesh, by default in the dtypes of marching cubes with a spacing"""
+    side = int(np.sqrt(n_triangles / 2)) + 1
+    y, x = np.mgrid[:side, :side].astype(vertex_dtype)
+    verts = np.stack([np.zeros_like(x), y, x], axis=-1).reshape(-1, 3)
+    index = np.arange(side * side, dtype=face_dtype).reshape(side, side)
+    a, b = index[:-1, :-1].ravel(), index[:-1, 1:].ravel()
+    c, d = index[1:, :-1].ravel(), index[1:, 1:].ravel()
+    faces = np.concatenate([np.stack([a, b, c], 1), np.stack([b, d, c], 1)])
+    return verts, faces
+
+
+def open3d_round_trip(verts, faces):
+    """The conversion 'create_mesh' made before MeshData"""
+    import open3d
+
+    mesh = open3d.geometry.TriangleMesh()
+    mesh.vertices = open3d.utility.Vector3dVector(np.array(verts))
+    mesh.triangles = open3d.utility.Vector3iVector(np.array(faces).astype(np.int64))
+    return np.asarray(mesh.vertices), np.asarray(mesh.triangles)
+
+
+class SurfaceHandOffSuite:
+    """
+    Time, memory and size of the arrays handed to a napari
+    surface layer for a 10M triangle mesh, starting from the
+    arrays each mesh producer returns
+    """
+    params = ([1_000_000, 10_000_000], list(PRODUCERS))
+    param_names = ['triangles', 'producer']
+    timeout = 300
+
+    def setup(self, n_triangles, producer):
+        self.verts, self.faces = grid_mesh(n_triangles, *PRODUCERS[producer])
+
+    def time_open3d_round_trip(self, n_triangles, producer):
+        open3d_round_trip(self.verts, self.faces)
+
+    def time_meshdata(self, n_triangles, producer):
+        MeshData(self.verts, self.faces).layer_data
+
+    def peakmem_open3d_round_trip(self, n_triangles, producer):
+        open3d_round_trip(self.verts, self.faces)
+
+    def peakmem_meshdata(self, n_triangles, producer):
+        MeshData(self.verts, self.faces).layer_data
+
+    def track_layer_bytes_open3d_round_trip(self, n_triangles, producer):
+        return sum(array.nbytes for array in open3d_round_trip(self.verts, self.faces))
+
+    def track_layer_bytes_meshdata(self, n_triangles, producer):
+        return MeshData(self.verts, self.faces).nbytes
+
+    def track_copies_meshdata(self, n_triangles, producer):
+        verts, faces = MeshData(self.verts, self.faces).layer_data
+        return int(not np.shares_memory(verts, self.verts)) + int(not np.shares_memory(faces, self.faces))
+
+    track_layer_bytes_open3d_round_trip.unit = 'bytes'
+    track_layer_bytes_meshdata.unit = 'bytes'
+    track_copies_meshdata.unit = 'copies'
@@ -0,0 +1,57 @@
+"""
+Benchmarks for the open3d filters of the mesh filter tool
+"""
+import functools
+import os
+import shutil
+import tempfile
+
+from napari_matous.meshdata import MeshData
+from napari_matous.meshfilter import FILTERS, filter_mesh
+from napari_matous.meshwriter import open_ply, write_ply
+from napari_matous.partitionedfilter import FILTER_RINGS, filter_partitioned, open3d_filter
+
+from .bench_meshdata import grid_mesh
+
+
+class FilterSuite:
+    """
+    Time and peak memory of every open3d filter in one
+    piece and in partitions, from memory and from a
+    memory-mapped PLY file
+    """
+    params = ([100_000, 1_000_000], list(FILTERS))
+    param_names = ['triangles', 'filter']
+    timeout = 300
+
+    def setup(self, n_triangles, filter_choice):
+        self.mesh = MeshData(*grid_mesh(n_triangles))
+        self.open3d_mesh = self.mesh.to_open3d()
+        method = FILTERS[filter_choice]
+        self.function = functools.partial(open3d_filter, method=method)
+        self.rings = FILTER_RINGS[method]
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'mesh.ply')
+        write_ply(self.path, self.mesh)
+
+    def teardown(self, n_triangles, filter_choice):
+        shutil.rmtree(self.directory)
+
+    def time_filter(self, n_triangles, filter_choice):
+        filter_mesh(self.open3d_mesh, filter_choice)
+
+    def time_partitioned(self, n_triangles, filter_choice):
+        filter_partitioned(self.mesh.vertices, self.mesh.faces, self.function, self.rings,
+                           partition_size=n_triangles // 8)
+
+    def peakmem_filter(self, n_triangles, filter_choice):
+        filter_mesh(self.open3d_mesh, filter_choice)
+
+    def peakmem_partitioned(self, n_triangles, filter_choice):
+        filter_partitioned(self.mesh.vertices, self.mesh.faces, self.function, self.rings,
+                           partition_size=n_triangles // 8)
+
+    def peakmem_partitioned_ply(self, n_triangles, filter_choice):
+        vertices, faces = open_ply(self.path)
+        filter_partitioned(vertices, faces, self.function, self.rings,
+                           partition_size=n_triangles // 8)
@@ -0,0 +1,37 @@
+"""
+Benchmarks for the Otsu segmentation tool
+"""
+import numpy as np
+from scipy import ndimage as ndi
+
+from napari_matous.segment import otsu_threshold, segment
+
+
+def blob_image(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    return ndi.gaussian_filter(rng.random(shape, dtype=np.float32), 4)
+
+
+class OtsuSegmentSuite:
+    """
+    Time and peak memory of the Otsu threshold and of the
+    chunked threshold and closing for 2D and 3D images
+    """
+    params = [(1024, 4096), (64, 256, 256), (128, 512, 512)]
+    param_names = ['shape']
+    timeout = 300
+
+    def setup(self, shape):
+        self.image = blob_image(shape)
+
+    def time_otsu_threshold(self, shape):
+        otsu_threshold(self.image)
+
+    def time_segment(self, shape):
+        segment(self.image)
+
+    def peakmem_otsu_threshold(self, shape):
+        otsu_threshold(self.image)
+
+    def peakmem_segment(self, shape):
+        segment(self.image)
@@ -0,0 +1,75 @@
+"""
+Benchmarks for the stardist segmentation tool
+"""
+import time
+
+import numpy as np
+from scipy import ndimage as ndi
+
+from napari_matous import stardistsegment
+
+
+class ModelCacheSuite:
+    """
+    Latency of getting a model from the cache compared
+    with loading it from disk
+    """
+    params = list(stardistsegment.MODEL_NAMES.values())
+    param_names = ['model']
+    timeout = 300
+
+    def setup(self, name):
+        stardistsegment.evict_model()
+        start = time.perf_counter()
+        stardistsegment.get_model(name)
+        self.first_call = time.perf_counter() - start
+
+    def teardown(self, name):
+        stardistsegment.evict_model()
+
+    def time_first_call(self, name):
+        stardistsegment.evict_model(name)
+        stardistsegment.get_model(name)
+
+    def time_second_call(self, name):
+        stardistsegment.get_model(name)
+
+    def track_first_call_seconds(self, name):
+        return self.first_call
+
+    track_first_call_seconds.unit = 'seconds'
+
+
+def tiny_model():
+    """Untrained StarDist model small enough to time the prediction pipeline"""
+    from stardist.models import Config2D, StarDist2D
+
+    config = Config2D(n_rays=8, grid=(2, 2), n_channel_in=1, unet_n_depth=1,
+                      unet_n_filter_base=4, train_patch_size=(64, 64))
+    return StarDist2D(config, name=None, basedir=None)
+
+
+class PredictSuite:
+    """
+    Time and peak memory of predicting an image in one
+    call and tile by tile with a tiny model
+    """
+    params = ([512, 2048], [0, 256])
+    param_names = ['size', 'tile_size']
+    timeout = 600
+
+    def setup(self, size, tile_size):
+        self.model = tiny_model()
+        rng = np.random.default_rng(0)
+        self.image = ndi.gaussian_filter(rng.random((size, size), dtype=np.float32), 2)
+
+    def predict(self, tile_size):
+        for _ in stardistsegment.predict_tiled(self.model, self.image, lambda image: image,
+                                               tile_size, overlap=32):
+            pass
+
+    def time_predict(self, size, tile_size):
+        self.predict(tile_size)
+
+    def peakmem_predict(self, size, tile_size):
+        self.predict(tile_size)
@@ -0,0 +1,103 @@
+"""
+Benchmarks for hole filling, preview meshes and the whole tiff to mesh pipeline
+"""
+import os
+import tempfile
+
+import numpy as np
+import tifffile
+from skimage.measure import marching_cubes
+
+from napari_matous.tiff2mesh import preview_mesh, tiff_mesh, tiff_preprocessing
+
+from .bench_mesh import blob_volume
+
+
+def hollow_stack(size):
+    """Label stack of blobs with holes in every slice"""
+    volume = blob_volume(size)
+    volume[:, ::16, ::16] = False
+    return volume.astype(np.uint8)
+
+
+class FillHolesSuite:
+    """
+    Time and peak memory of filling the holes of a stack
+    slice by slice and in 3D
+    """
+    params = ([128, 256], ['slice', '3d'])
+    param_names = ['size', 'fill_mode']
+    timeout = 300
+
+    def setup(self, size, fill_mode):
+        self.stack = hollow_stack(size)
+
+    def time_tiff_preprocessing(self, size, fill_mode):
+        tiff_preprocessing(self.stack, fill_mode)
+
+    def peakmem_tiff_preprocessing(self, size, fill_mode):
+        tiff_preprocessing(self.stack, fill_mode)
+
+
+class FillWorkersSuite:
+    """
+    Time of filling the holes of a stack slice by slice on one
+    thread and in thread pools, the pool only pays off as long
+    as 'ndi.binary_fill_holes' releases the GIL
+    """
+    params = ([256, 512], [1, 2, 4, 8])
+    param_names = ['size', 'workers']
+    timeout = 300
+
+    def setup(self, size, workers):
+        if workers > (os.cpu_count() or 1):
+            raise NotImplementedError  # more threads than cores measures nothing
+        self.stack = hollow_stack(size)
+
+    def time_tiff_preprocessing(self, size, workers):
+        tiff_preprocessing(self.stack, workers=workers)
+
+
+class TiffMeshSuite:
+    """
+    Time and peak memory of reading, filling and meshing
+    a tiff stack without the result cache
+    """
+    params = ([128, 256], [0, 64])
+    param_names = ['size', 'chunk_size']
+    timeout = 600
+
+    def setup(self, size, chunk_size):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'stack.tif')
+        tifffile.imwrite(self.path, hollow_stack(size))
+
+    def teardown(self, size, chunk_size):
+        self.directory.cleanup()
+
+    def time_tiff_mesh(self, size, chunk_size):
+        tiff_mesh(self.path, chunk_size=chunk_size)
+
+    def peakmem_tiff_mesh(self, size, chunk_size):
+        tiff_mesh(self.path, chunk_size=chunk_size)
+
+
+class PreviewSuite:
+    """
+    Time of the downsampled preview mesh of a filled stack
+    next to meshing it at full resolution
+    """
+    params = ([256], [1, 2, 4], ['mean', 'max', 'step'])
+    param_names = ['size', 'factor', 'mode']
+    timeout = 300
+
+    def setup(self, size, factor, mode):
+        if factor == 1 and mode != 'mean':
+            raise NotImplementedError  # full resolution is only timed once
+        self.filled = tiff_preprocessing(hollow_stack(size))
+
+    def time_preview_mesh(self, size, factor, mode):
+        if factor == 1:
+            marching_cubes(self.filled, 0.5, spacing=(4, 1, 1))
+        else:
+            preview_mesh(self.filled, (4, 1, 1), factor, mode)
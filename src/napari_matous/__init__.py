@@ -1,13 +1,34 @@
 __version__ = "0.0.1"
-from .segment import segment_image
-from .stardistsegment import stardist_segment_image
-from .meshfilter import load_mesh
-from .tiff2mesh import tiff_2_mesh
-from .gamer import gamer_tool
+
+# Widgets are imported on first access so that loading the plugin
+# does not import heavy backends such as tensorflow, open3d or pygamer
+_WIDGETS = {
+    "segment_image": ".segment",
+    "threshold_preview": ".segment",
+    "stardist_segment_image": ".stardistsegment",
+    "load_mesh": ".meshfilter",
+    "tiff_2_mesh": ".tiff2mesh",
+    "gamer_tool": ".gamer",
+    "job_monitor": ".instrument",
+}
 __all__ = (
     "segment_image",
+    "threshold_preview",
     "stardist_segment_image",
     "load_mesh",
     "tiff_2_mesh",
-    "gamer_tool"
+    "gamer_tool",
+    "job_monitor",
 )
+
+
+def __getattr__(name):
+    if name in _WIDGETS:
+        import importlib
+
+        return getattr(importlib.import_module(_WIDGETS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(__all__))
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+from skimage.measure import marching_cubes
+
+from napari_matous.chunkedmesh import (IncrementalMesher, chunked_marching_cubes, iter_chunks,
+                                       label_meshes)
+from napari_matous.tiff2mesh import tiff_preprocessing
+
+
+def make_volume(shape=(30, 41, 37), seed=0):
+    rng = np.random.default_rng(seed)
+    return ndi.gaussian_filter(rng.random(shape), 2) > 0.5
+
+
+def triangles(verts, faces):
+    """Set of triangles as rounded vertex coordinates, independent of vertex order"""
+    coords = np.round(verts[faces], 3)
+    return {tuple(sorted(map(tuple, triangle))) for triangle in coords}
+
+
+@pytest.mark.parametrize("chunk_size", [5, 8, 64])
+def test_chunked_matches_single_shot(chunk_size):
+    volume = make_volume()
+    spacing = (4, 1, 1)
+    verts, faces, _, _ = marching_cubes(volume, spacing=spacing)
+
+    chunked_verts, chunked_faces = chunked_marching_cubes(volume, spacing=spacing,
+                                                          chunk_size=chunk_size,
+                                                          workers=2, executor='thread')
+
+    assert len(chunked_verts) == len(verts)
+    assert len(chunked_faces) == len(faces)
+    assert triangles(chunked_verts, chunked_faces) == triangles(verts, faces)
+
+
+def test_chunked_mesh_is_watertight():
+    volume = np.zeros((20, 20, 20), dtype=bool)
+    volume[3:17, 4:15, 2:18] = True
+
+    verts, faces = chunked_marching_cubes(volume, chunk_size=6, workers=2, executor='thread')
+
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    _, counts = np.unique(edges, axis=0, return_counts=True)
+    assert np.all(counts == 2)
+
+
+def test_label_meshes_match_each_object():
+    labels = np.zeros((16, 30, 30), dtype=np.uint16)
+    labels[2:8, 3:12, 4:10] = 1
+    labels[6:14, 15:27, 14:28] = 3
+
+    meshes = {label: (verts, faces) for label, verts, faces
+              in label_meshes(labels, spacing=(4, 1, 1), workers=2, executor='thread')}
+
+    assert sorted(meshes) == [1, 3]
+    for label, (verts, faces) in meshes.items():
+        expected_verts, expected_faces, _, _ = marching_cubes(np.pad(labels == label, 1), 0.5,
+                                                              spacing=(4, 1, 1))
+        expected_verts -= np.array([4, 1, 1])
+        assert triangles(verts, faces) == triangles(expected_verts, expected_faces)
+
+
+def test_incremental_mesher_matches_full_remesh():
+    labels = (make_volume() * 2).astype(np.uint16)
+    mesher = IncrementalMesher(labels, spacing=(4, 1, 1), chunk_size=8, workers=2)
+    mesher.update()
+
+    labels[10:14, 5:20, 6:9] = 3  # paint a block
+    labels[20, :, :] = 0  # erase a slice
+    remeshed = mesher.update((slice(10, 21), slice(0, 41), slice(0, 37)))
+
+    filled = tiff_preprocessing(labels)
+    verts, faces, _, _ = marching_cubes(filled, 0.5, spacing=(4, 1, 1))
+    assert 0 < remeshed < len(list(iter_chunks(labels.shape, 8)))
+    assert triangles(*mesher.mesh()) == triangles(verts, faces)
+
+
+def test_incremental_mesher_remeshes_touched_chunks():
+    labels = np.zeros((24, 24, 24), dtype=np.uint8)
+    labels[2:6, 2:6, 2:6] = 1
+    mesher = IncrementalMesher(labels, chunk_size=8, workers=2)
+    assert mesher.update() == 1
+
+    labels[16, 16, 16] = 1  # on the planes shared by eight chunks
+    assert mesher.update((slice(16, 17), slice(16, 17), slice(16, 17))) == 8
+    assert mesher.update((slice(16, 17), slice(16, 17), slice(16, 17))) == 0
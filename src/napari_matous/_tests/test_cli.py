@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tifffile
+
+from napari_matous import chunkedmesh, tiff2mesh
+from napari_matous.cli import inner_workers, main, tiff_to_mesh_file
+
+
+def test_segment_directory_resumes(tmp_path, capsys):
+    input_dir, output_dir = tmp_path / "in", tmp_path / "out"
+    input_dir.mkdir()
+    for i in range(2):
+        tifffile.imwrite(str(input_dir / f"image{i}.tif"), np.random.rand(32, 32).astype(np.float32))
+
+    assert main(["segment", str(input_dir), str(output_dir), "--workers", "1"]) == 0
+    assert sorted(path.name for path in output_dir.iterdir()) == ["image0_labels.tif",
+                                                                  "image1_labels.tif"]
+    assert "processed 2, skipped 0, failed 0" in capsys.readouterr().out
+
+    assert main(["segment", str(input_dir), str(output_dir), "--workers", "1"]) == 0
+    assert "processed 0, skipped 2, failed 0" in capsys.readouterr().out
+
+
+def test_batch_tasks_share_the_cores(tmp_path, monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 8)
+    assert inner_workers(8) == 1
+    assert inner_workers(2) == 4
+    assert inner_workers(16) == 1
+
+    stack = np.zeros((6, 20, 20), dtype=np.uint8)
+    stack[1:5, 4:16, 4:16] = 1
+    tifffile.imwrite(str(tmp_path / "stack.tif"), stack)
+    pools = []
+
+    def thread_pool(max_workers=None):
+        pools.append(max_workers)
+        return ThreadPoolExecutor(max_workers=max_workers)
+
+    def make_pool(executor, workers):
+        pools.append(workers)
+        return ThreadPoolExecutor(max_workers=workers)
+
+    monkeypatch.setattr(tiff2mesh, "ThreadPoolExecutor", thread_pool)
+    monkeypatch.setattr(chunkedmesh, "make_pool", make_pool)
+    tiff_to_mesh_file(tmp_path / "stack.tif", tmp_path / "stack_mesh.ply", chunk_size=8, workers=1)
+    tiff_to_mesh_file(tmp_path / "stack.tif", tmp_path / "labels.done", per_label=True, workers=1)
+
+    assert pools == [1, 1, 1]
+    assert (tmp_path / "stack_mesh.ply").exists()
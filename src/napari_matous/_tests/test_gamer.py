@@ -0,0 +1,90 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from napari_matous import gamer
+from napari_matous.gamer import parse_pipeline
+
+
+def test_parse_pipeline():
+    steps = parse_pipeline("coarse rate=1.6 flat_rate=2; smooth preserve_ridges=True;; Coarse")
+
+    assert steps == [("coarse", {"rate": 1.6, "flat_rate": 2}),
+                     ("smooth", {"preserve_ridges": True}),
+                     ("coarse", {})]
+
+
+def test_parse_pipeline_unknown_method():
+    with pytest.raises(ValueError):
+        parse_pipeline("coarse; sharpen")
+
+
+@pytest.mark.parametrize("text", ["coarse rate", "coarse rate=1.6.2", "smooth rings=2",
+                                  "scale scale=2 scale=3 mesh=1"])
+def test_parse_pipeline_invalid_step(text):
+    with pytest.raises(ValueError, match="gamer step"):
+        parse_pipeline("coarse; " + text)
+
+
+class FakeSurfaceMesh:
+    """Stand-in for pygamer's SurfaceMesh, optionally without a copy constructor"""
+    copyable = True
+
+    def __init__(self, other=None):
+        if other is not None and not self.copyable:
+            raise TypeError("no copy constructor")
+        self.vertices = [] if other is None else list(other.vertices)
+        self.faces = [] if other is None else list(other.faces)
+        self.oriented = other is not None and other.oriented
+
+    def insertVertex(self, index, vertex):
+        self.vertices.append(vertex)
+
+    def insertFace(self, face):
+        self.faces.append(face)
+
+    def compute_orientation(self):
+        self.oriented = True
+
+    def correctNormals(self):
+        pass
+
+    @property
+    def vertexIDs(self):
+        return [types.SimpleNamespace(data=lambda: types.SimpleNamespace()) for _ in self.vertices]
+
+    def to_ndarray(self):
+        return np.array(self.vertices, dtype=float), None, np.array(self.faces)
+
+
+@pytest.fixture
+def fake_pygamer(monkeypatch):
+    module = types.SimpleNamespace(surfacemesh=types.SimpleNamespace(
+        SurfaceMesh=FakeSurfaceMesh, Vertex=lambda x, y, z: (x, y, z)))
+    monkeypatch.setitem(sys.modules, "pygamer", module)
+    gamer.clear_prepared_meshes()
+    yield module
+    gamer.clear_prepared_meshes()
+
+
+@pytest.mark.parametrize("copyable", [True, False])
+def test_prepared_mesh_cache_hit_does_not_prepare(tmp_path, monkeypatch, fake_pygamer, copyable):
+    path = tmp_path / "mesh.ply"
+    path.write_bytes(b"mesh")
+    source = FakeSurfaceMesh()
+    source.vertices, source.faces = [(0, 0, 0), (1, 0, 0), (0, 1, 0)], [[0, 1, 2]]
+    reads, prepares = [], []
+    monkeypatch.setattr(gamer, "read_mesh", lambda path: reads.append(path) or source)
+    original_prepare = gamer.prepare_mesh
+    monkeypatch.setattr(gamer, "prepare_mesh",
+                        lambda mesh: prepares.append(mesh) or original_prepare(mesh))
+    monkeypatch.setattr(FakeSurfaceMesh, "copyable", copyable)
+
+    first = gamer.prepared_mesh(path)
+    second = gamer.prepared_mesh(path)
+
+    assert len(reads) == len(prepares) == 1
+    assert first is not source and second is not source and first is not second
+    assert second.oriented and second.faces == [[0, 1, 2]]
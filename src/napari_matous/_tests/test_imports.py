@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+import pytest
+
+# Backends that must only be imported once a tool needs them
+HEAVY_MODULES = ("tensorflow", "stardist", "csbdeep", "open3d", "pygamer", "meshio")
+
+
+@pytest.mark.parametrize("module", ["napari_matous",
+                                    "napari_matous.segment",
+                                    "napari_matous.stardistsegment",
+                                    "napari_matous.meshfilter",
+                                    "napari_matous.tiff2mesh",
+                                    "napari_matous.gamer",
+                                    "napari_matous.cli"])
+def test_import_does_not_load_backends(module):
+    code = (f"import sys, {module}; "
+            f"print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
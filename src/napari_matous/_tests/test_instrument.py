@@ -0,0 +1,106 @@
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from napari_matous import instrument
+from napari_matous.meshdata import MeshData
+
+
+def test_generator_jobs_report_sizes_and_timings(caplog):
+    @instrument.instrument('mesh job')
+    def job(volume):
+        yield 1
+        return MeshData(np.zeros((4, 3)), np.zeros((2, 3)))
+
+    with caplog.at_level(logging.INFO, logger='napari_matous.jobs'):
+        assert list(job(np.zeros((2, 3, 4)))) == [1]
+
+    event = json.loads(caplog.records[-1].getMessage())
+    assert event['stage'] == 'mesh job'
+    assert event['status'] == 'ok'
+    assert event['input'] == {'voxels': 24}
+    assert event['output'] == {'vertices': 4, 'faces': 2}
+    assert event['wall_s'] >= 0 and event['cpu_s'] >= 0
+    assert caplog.records[-1].job == event
+
+
+def test_failed_and_cancelled_jobs_are_reported():
+    events = []
+    instrument.add_listener(events.append)
+    try:
+        @instrument.instrument('failing')
+        def failing():
+            raise ValueError
+
+        with pytest.raises(ValueError):
+            failing()
+
+        @instrument.instrument('cancelled')
+        def endless():
+            while True:
+                yield
+
+        generator = endless()
+        next(generator)
+        generator.close()
+    finally:
+        instrument.remove_listener(events.append)
+
+    assert [(event['stage'], event['status']) for event in events] == \
+        [('failing', 'error: ValueError'), ('cancelled', 'cancelled')]
+
+
+def test_memory_and_cpu_are_those_of_the_stage():
+    events = []
+    instrument.add_listener(events.append)
+    try:
+        @instrument.instrument('allocate')
+        def allocate(n_bytes):
+            data = np.ones(n_bytes, dtype=np.uint8)
+            time.sleep(0.05)  # long enough to be sampled
+            return data.sum()
+
+        allocate(200 * 2 ** 20)
+        allocate(40 * 2 ** 20)
+
+        stop = threading.Event()
+        spinner = threading.Thread(target=lambda: [None for _ in iter(stop.is_set, True)])
+        spinner.start()
+        try:
+            instrument.instrument('sleep')(time.sleep)(0.2)
+        finally:
+            stop.set()
+            spinner.join()
+    finally:
+        instrument.remove_listener(events.append)
+
+    large, small, sleep = events
+    assert large['peak_rss_delta_bytes'] >= 150 * 2 ** 20
+    assert 30 * 2 ** 20 <= small['peak_rss_delta_bytes'] < 150 * 2 ** 20
+    # CPU burnt by another thread is not the sleeping stage's
+    assert sleep['cpu_s'] < 0.1
+
+
+def test_cpu_is_unknown_when_the_job_ends_on_another_thread():
+    events = []
+    instrument.add_listener(events.append)
+    try:
+        @instrument.instrument('moved')
+        def moved():
+            yield
+
+        generator = moved()
+        next(generator)
+        closer = threading.Thread(target=generator.close)
+        closer.start()
+        closer.join()
+    finally:
+        instrument.remove_listener(events.append)
+
+    event, = events
+    assert event['status'] == 'cancelled'
+    assert event['cpu_s'] is None and event['wall_s'] >= 0
@@ -0,0 +1,29 @@
+import numpy as np
+
+from napari_matous import lod
+from napari_matous.meshdata import MeshData
+
+
+def test_lod_targets():
+    assert lod.lod_targets(100, min_faces=100) == []
+    assert lod.lod_targets(1000, min_faces=10, factor=4) == [10, 40, 160, 640]
+
+
+def test_iter_lod_yields_levels_as_they_are_decimated(monkeypatch):
+    faces = np.zeros((1000, 3), dtype=np.int32)
+    mesh = MeshData(np.zeros((3, 3)), faces)
+    decimated = []
+
+    def decimate(mesh, target):
+        decimated.append(target)
+        return MeshData(mesh.vertices, faces[:target])
+
+    monkeypatch.setattr(lod, "decimate", decimate)
+
+    levels = []
+    for level in lod.iter_lod(mesh, min_faces=50, factor=4):
+        # Every level reaches the viewer before the next one is decimated
+        assert decimated[-1] == len(level)
+        levels.append(len(level))
+
+    assert levels == decimated == [50, 200, 800]
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import tifffile
+
+from napari_matous import tiff2mesh
+from napari_matous.meshcache import ResultCache, source_key
+from napari_matous.meshdata import MeshData
+
+
+def write_stack(path):
+    stack = np.zeros((8, 16, 16), dtype=np.uint8)
+    stack[2:6, 3:12, 4:13] = 1
+    tifffile.imwrite(str(path), stack)
+
+
+def test_tiff_mesh_reuses_cached_stages(tmp_path, monkeypatch):
+    write_stack(tmp_path / "stack.tif")
+    cache = ResultCache(tmp_path / "cache")
+    fills = []
+    fill = tiff2mesh.tiff_preprocessing
+    monkeypatch.setattr(tiff2mesh, "tiff_preprocessing",
+                        lambda *args, **kwargs: fills.append(1) or fill(*args, **kwargs))
+
+    first = tiff2mesh.tiff_mesh(tmp_path / "stack.tif", cache=cache)
+    again = tiff2mesh.tiff_mesh(tmp_path / "stack.tif", cache=cache)
+    rescaled = tiff2mesh.tiff_mesh(tmp_path / "stack.tif", spacing=(1, 1, 1), cache=cache)
+
+    assert len(fills) == 1
+    np.testing.assert_array_equal(again.vertices, first.vertices)
+    np.testing.assert_array_equal(again.faces, first.faces)
+    np.testing.assert_allclose(rescaled.vertices[:, 0] * 4, first.vertices[:, 0])
+
+    tiff2mesh.tiff_mesh(tmp_path / "stack.tif", fill_mode='3d', cache=cache)
+    assert len(fills) == 2
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=3000)
+    mesh = MeshData(np.zeros((50, 3)), np.zeros((50, 3)))  # ~1.7 kB entry on disk
+
+    cache.store_mesh("old", mesh)
+    cache.store_array("new", np.zeros(100))
+    cache.load_mesh("old")
+    cache.store_array("newest", np.zeros(100))
+
+    assert cache.load_mesh("old") is not None
+    assert cache.load_array("new") is None
+    assert cache.load_array("newest") is not None
+
+
+def test_cache_refuses_entries_larger_than_the_cache(tmp_path):
+    cache = ResultCache(tmp_path, max_bytes=1000)
+
+    assert not cache.store_array("large", np.zeros(1000))
+    assert not cache.store_mesh("large", MeshData(np.zeros((100, 3)), np.zeros((100, 3))))
+    assert cache.store_array("small", np.zeros(10))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["small.npy"]
+
+
+def test_source_key_follows_modification(tmp_path):
+    path = tmp_path / "stack.tif"
+    path.write_bytes(b"stack")
+    key = source_key(path)
+
+    assert source_key(path) == key
+    os.utime(path, ns=(0, 10 ** 9))
+    assert source_key(path) != key
@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from napari_matous import meshfilter
+from napari_matous.meshdata import MeshData
+from napari_matous.meshfilter import filter_parameters, iter_filter
+from napari_matous.partitionedfilter import MeshPartitions
+
+
+class RecordingMesh:
+    """Stands in for an open3d mesh, recording the filter calls"""
+    def __init__(self):
+        self.calls = []
+
+    def filter_smooth_taubin(self, **parameters):
+        self.calls.append(parameters)
+        return self
+
+
+def test_filter_parameters_only_passes_accepted_arguments():
+    assert filter_parameters("Filter Sharpen", strength=2.0) == {"strength": 2.0}
+    assert filter_parameters("Filter Smooth Simple") == {}
+    assert filter_parameters("Filter smooth Taubin", lambda_filter=0.3, mu=-0.4) == \
+        {"lambda_filter": 0.3, "mu": -0.4}
+
+
+def test_iter_filter_yields_every_n_iterations():
+    mesh = RecordingMesh()
+
+    done = [iteration for iteration, _ in iter_filter(mesh, "Filter smooth Taubin", iterations=7,
+                                                      update_every=3, mu=-0.4)]
+
+    assert done == [3, 6, 7]
+    assert [call["number_of_iterations"] for call in mesh.calls] == [3, 3, 1]
+    assert all(call["mu"] == -0.4 for call in mesh.calls)
+
+
+def test_partitioned_iterations_share_one_pool(monkeypatch):
+    pools = []
+
+    def make_pool(executor, workers):
+        pools.append(executor)
+        return ThreadPoolExecutor(workers)
+
+    monkeypatch.setattr(meshfilter, "make_pool", make_pool)
+    partitions = []
+    monkeypatch.setattr(meshfilter, "MeshPartitions",
+                        lambda *args: partitions.append(args) or MeshPartitions(*args))
+    monkeypatch.setattr(meshfilter, "open3d_filter",
+                        lambda vertices, faces, method, **parameters: vertices + 1)
+    vertices = np.zeros((4, 3), dtype=np.float32)
+    faces = np.array([[0, 1, 2], [1, 2, 3]])
+
+    results = list(iter_filter((vertices, faces), "Filter Smooth Simple", iterations=3,
+                               partition_size=2, workers=2))
+
+    assert pools == ["process"] and len(partitions) == 1
+    assert [done for done, _ in results] == [1, 2, 3]
+    np.testing.assert_array_equal(results[-1][1][0], vertices + 3)
+    assert results[-1][1][1] is faces
+
+
+def test_partitioned_surfaces_are_made_in_the_generator(monkeypatch):
+    monkeypatch.setattr(meshfilter, "make_pool", lambda executor, workers: ThreadPoolExecutor(workers))
+    monkeypatch.setattr(meshfilter, "open3d_filter",
+                        lambda vertices, faces, method, **parameters: vertices + 1)
+    monkeypatch.setattr(MeshPartitions, "surface",
+                        lambda self, vertices, max_faces, pool, workers: ("surface", max_faces))
+    vertices = np.zeros((4, 3), dtype=np.float32)
+    faces = np.array([[0, 1, 2], [1, 2, 3]])
+
+    small = list(iter_filter((vertices, faces), "Filter Smooth Simple", iterations=2,
+                             partition_size=2, workers=2, surface_faces=(2, 2)))
+    large = list(iter_filter((vertices, faces), "Filter Smooth Simple", iterations=2,
+                             partition_size=2, workers=2, surface_faces=(1, 1)))
+
+    assert isinstance(small[0][1], MeshData) and len(small[1][1]) == 2
+    assert large == [(1, ("surface", 1)), (2, ("surface", 1))]
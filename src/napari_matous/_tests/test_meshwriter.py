@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from napari_matous.meshdata import MeshData
+from napari_matous.meshwriter import FORMATS, output_file, read_mesh_data, write_mesh
+
+
+@pytest.mark.parametrize("suffix", list(FORMATS.values()))
+def test_write_read_round_trip(tmp_path, suffix):
+    rng = np.random.default_rng(0)
+    mesh = MeshData(rng.random((50, 3)), rng.integers(0, 50, (80, 3)))
+
+    read = read_mesh_data(write_mesh(mesh, tmp_path / ("mesh" + suffix)))
+
+    # STL stores every triangle with its own vertices, so compare the triangles
+    np.testing.assert_allclose(read.vertices[read.faces], mesh.vertices[mesh.faces], rtol=1e-6)
+
+
+def test_output_file_is_named_after_input(tmp_path):
+    assert output_file(tmp_path, "/data/cell_01.tif", "_mesh", ".ply") == tmp_path / "cell_01_mesh.ply"
+
+
+def test_ply_from_other_writers_is_read_with_meshio(tmp_path):
+    import meshio
+
+    points = np.random.default_rng(1).random((4, 3))
+    cells = np.array([[0, 1, 2], [1, 2, 3]])
+    meshio.write(str(tmp_path / "mesh.ply"), meshio.Mesh(points, [("triangle", cells)]), binary=False)
+
+    read = read_mesh_data(tmp_path / "mesh.ply")
+
+    np.testing.assert_allclose(read.vertices, points, rtol=1e-6)
+    np.testing.assert_array_equal(read.faces, cells)
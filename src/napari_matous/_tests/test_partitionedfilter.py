@@ -0,0 +1,103 @@
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from scipy import ndimage as ndi
+from skimage.measure import marching_cubes
+
+from napari_matous.meshdata import MeshData
+from napari_matous.meshwriter import open_ply, write_ply
+from napari_matous.partitionedfilter import MeshPartitions, bucket_items, filter_partitioned
+
+
+def make_mesh(seed=0):
+    rng = np.random.default_rng(seed)
+    volume = ndi.gaussian_filter(rng.random((24, 30, 28)), 2) > 0.5
+    verts, faces, _, _ = marching_cubes(volume)
+    return verts, faces
+
+
+def laplacian(vertices, faces, iterations=1, strength=0.5):
+    """Uniform Laplacian smoothing, like open3d's over the vertex adjacency"""
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    n = len(vertices)
+    adjacency = np.zeros((n, n))
+    adjacency[edges[:, 0], edges[:, 1]] = adjacency[edges[:, 1], edges[:, 0]] = 1
+    degree = np.maximum(adjacency.sum(axis=1, keepdims=True), 1)
+    for _ in range(iterations):
+        vertices = vertices + strength * (adjacency @ vertices / degree - vertices)
+    return vertices
+
+
+@pytest.mark.parametrize("iterations", [1, 3])
+def test_partitioned_matches_single_pass(iterations):
+    verts, faces = make_mesh()
+    function = functools.partial(laplacian, iterations=iterations)
+    expected = function(verts, faces)
+
+    filtered = filter_partitioned(verts, faces, function, rings=iterations, partition_size=300,
+                                  workers=2, executor='thread')
+
+    np.testing.assert_allclose(filtered, expected, atol=1e-9)
+
+
+def test_partition_halo():
+    vertices = np.stack([np.arange(8.0), np.zeros(8), np.zeros(8)], axis=1)
+    faces = np.array([[0, 1, 2], [1, 2, 3], [3, 4, 5], [5, 6, 7]])
+
+    with MeshPartitions(vertices, faces, rings=1, partition_size=2) as partitions:
+        assert partitions.n_partitions == 4
+        first = partitions.part[0]
+        assert list(partitions.core(first)) == [0, 1]
+        assert list(partitions.partition_halo(first, 1)) == [0, 1]
+        assert list(partitions.partition_halo(first, 2)) == [0, 1, 2]
+        assert list(partitions.partition_halo(first, 3)) == [0, 1, 2, 3]
+        directory = partitions.directory
+    assert not os.path.exists(directory)
+
+
+def test_bucket_items_keeps_order_within_buckets(tmp_path):
+    def pairs():
+        yield np.array([2, 0, 2]), np.array([10, 11, 12])
+        yield np.array([0, 2, 1]), np.array([13, 14, 15])
+
+    starts, items = bucket_items(tmp_path / "items.bin", pairs, 3)
+
+    assert list(starts) == [0, 2, 3, 6]
+    assert list(items) == [11, 13, 15, 10, 12, 14]
+
+
+def test_partitioned_reads_memory_mapped_ply(tmp_path):
+    verts, faces = make_mesh()
+    path = tmp_path / "mesh.ply"
+    write_ply(path, MeshData(verts, faces))
+    vertices, mapped_faces = open_ply(path)
+    expected = laplacian(vertices.astype(np.float64), np.asarray(mapped_faces))
+
+    with ThreadPoolExecutor(2) as pool:
+        filtered = filter_partitioned(vertices, mapped_faces, laplacian, rings=1,
+                                      partition_size=300, workers=2, pool=pool)
+
+    assert isinstance(mapped_faces, np.memmap)
+    np.testing.assert_allclose(filtered, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_surface_covers_every_face_once():
+    verts, faces = make_mesh()
+    decimated = []
+
+    def keep(vertices, faces, target):
+        decimated.append(target)
+        return vertices.astype(np.float32), faces
+
+    with MeshPartitions(verts, faces, rings=1, partition_size=300) as partitions:
+        with ThreadPoolExecutor(2) as pool:
+            surface = partitions.surface(verts, len(faces) // 4, pool, 2, decimate=keep)
+
+    assert len(surface) == len(faces) and sum(decimated) <= len(faces) // 4
+    expected = np.sort(np.sort(verts[faces].reshape(len(faces), -1), axis=1), axis=0)
+    found = np.sort(np.sort(surface.vertices[surface.faces].reshape(len(faces), -1), axis=1), axis=0)
+    np.testing.assert_allclose(found, expected, rtol=1e-6)
@@ -0,0 +1,180 @@
+import numpy as np
+
+from napari_matous.scheduler import JobScheduler, array_key
+
+
+class Signal:
+    def __init__(self):
+        self.callbacks = []
+
+    def connect(self, callback):
+        self.callbacks.append(callback)
+
+    def emit(self, *value):
+        for callback in self.callbacks:
+            callback(*value)
+
+
+class FakeWorker:
+    """Generator worker stepped by the test instead of a thread"""
+    started = []
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.yielded, self.returned, self.finished = Signal(), Signal(), Signal()
+        self.quitting = False
+
+    def start(self):
+        FakeWorker.started.append(self)
+
+    def quit(self):
+        self.quitting = True
+
+    def step(self):
+        if self.quitting:
+            self.generator.close()
+            self.finished.emit()
+            return
+        try:
+            self.yielded.emit(next(self.generator))
+        except StopIteration as done:
+            self.returned.emit(done.value)
+            self.finished.emit()
+
+
+def fake_worker(function, progress=None):
+    return lambda *args: FakeWorker(function(*args))
+
+
+def make_scheduler(**kwargs):
+    FakeWorker.started = []
+    return JobScheduler(worker_factory=fake_worker, **kwargs)
+
+
+def double(value):
+    return 2 * value
+
+
+def test_concurrency_limit_and_queue_order():
+    scheduler = make_scheduler(max_jobs=1, memory_limit=None)
+    results = []
+
+    first = scheduler.submit('a', double, 1, returned=results.append)
+    second = scheduler.submit('b', double, 2, returned=results.append)
+
+    assert (first.state, second.state) == ('running', 'queued')
+    FakeWorker.started[0].step()
+    assert results == [2] and second.state == 'running'
+    FakeWorker.started[1].step()
+    assert results == [2, 4] and second.state == 'done'
+
+
+def test_memory_admission_runs_oversized_jobs_alone():
+    scheduler = make_scheduler(max_jobs=4, memory_limit=100)
+
+    scheduler.submit('a', double, 1, memory=60)
+    waiting = scheduler.submit('b', double, 2, memory=60)
+    assert waiting.state == 'queued'
+
+    FakeWorker.started[0].step()
+    assert waiting.state == 'running'
+    FakeWorker.started[1].step()
+
+    huge = scheduler.submit('c', double, 3, memory=1000)
+    assert huge.state == 'running'
+
+
+def test_duplicate_submissions_are_merged():
+    scheduler = make_scheduler(max_jobs=2)
+    results = []
+
+    first = scheduler.submit('same', double, 1, returned=results.append)
+    second = scheduler.submit('same', double, 1, returned=results.append)
+    FakeWorker.started[0].step()
+
+    assert first is second and len(FakeWorker.started) == 1
+    assert results == [2, 2]
+    assert scheduler.submit('same', double, 1) is not first
+
+
+def test_cancel_queued_and_running_jobs():
+    scheduler = make_scheduler(max_jobs=1)
+    finished = []
+
+    def stages():
+        yield 'first'
+        yield 'second'
+
+    running = scheduler.submit('a', stages, finished=lambda: finished.append('a'))
+    queued = scheduler.submit('b', double, 1, finished=lambda: finished.append('b'))
+    FakeWorker.started[0].step()
+
+    scheduler.cancel_all()
+    assert queued.state == 'cancelled' and finished == ['b']
+    FakeWorker.started[0].step()
+    assert running.state == 'cancelled' and finished == ['b', 'a']
+    assert len(FakeWorker.started) == 1
+
+
+def test_resubmitting_a_cancelled_job_starts_a_new_one():
+    scheduler = make_scheduler(max_jobs=2)
+
+    cancelled = scheduler.submit('a', double, 1)
+    cancelled.cancel()
+
+    assert scheduler.submit('a', double, 1) is not cancelled
+
+
+def test_array_key_follows_content():
+    data = np.random.default_rng(0).random((300, 200)).astype(np.float32)
+
+    assert array_key(data) == array_key(data.copy())
+    assert array_key(data) != array_key(data + 1)
+    assert array_key(data) != array_key(data.astype(np.float64))
+    assert array_key(data) != array_key(data.reshape(200, 300))
+
+
+def test_newer_job_of_a_slot_replaces_the_older_one():
+    scheduler = make_scheduler(max_jobs=2)
+    stopped = []
+
+    def stages():
+        yield 'first'
+        yield 'second'
+
+    older = scheduler.submit('a', stages, replace='layer')
+    joined = scheduler.submit('a', stages, replace='layer')
+    other = scheduler.submit('b', stages, replace='other layer')
+    assert joined is older and older.claim.active
+
+    newer = scheduler.submit('c', stages, replace='layer')
+    FakeWorker.started[0].step()
+    assert older.state == 'cancelled' and not older.claim.active
+    assert newer.claim.active and other.state == 'running'
+
+    session = scheduler.claim('layer', lambda: stopped.append('session'))
+    FakeWorker.started[2].step()
+    assert newer.state == 'cancelled' and session.active and stopped == []
+    scheduler.claim('layer', lambda: None)
+    assert stopped == ['session'] and not session.active
+
+
+def test_cancelled_generator_is_closed_by_its_worker():
+    scheduler = make_scheduler(max_jobs=1)
+    closed, results = [], []
+
+    def stages():
+        try:
+            yield 1
+            yield 2
+            return 3
+        finally:
+            closed.append(True)
+
+    job = scheduler.submit('a', stages, yielded=results.append, returned=results.append)
+    FakeWorker.started[0].step()
+    job.cancel()
+    assert closed == []
+
+    FakeWorker.started[0].step()
+    assert closed == [True] and results == [1] and job.state == 'cancelled'
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from skimage.filters import threshold_otsu
+from skimage.morphology import closing
+
+from napari_matous.segment import close_region, otsu_threshold, segment
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32, np.uint16])
+def test_streaming_otsu_matches_skimage(dtype):
+    image = (np.random.default_rng(0).random((120, 90)) * 1000).astype(dtype)
+    assert otsu_threshold(image) == threshold_otsu(image)
+
+
+@pytest.mark.parametrize("shape", [(130, 97), (20, 33, 41)])
+def test_chunked_segment_matches_single_pass(shape):
+    image = np.random.default_rng(1).random(shape)
+    expected = closing(image > threshold_otsu(image), np.ones((3,) * len(shape), dtype=bool))
+
+    labels = segment(image, chunk_size=16, workers=3)
+
+    assert labels.dtype == np.uint8
+    np.testing.assert_array_equal(labels, expected)
+
+
+def test_segment_with_threshold_and_closing_size():
+    image = np.random.default_rng(2).random((64, 80))
+    expected = closing(image > 0.3, np.ones((5, 5), dtype=bool))
+
+    labels = segment(image, thresh=0.3, closing_size=5, chunk_size=16)
+
+    np.testing.assert_array_equal(labels, expected)
+
+
+@pytest.mark.parametrize("closing_size", [1, 3, 6])
+def test_closed_region_matches_whole_image(closing_size):
+    image = np.random.default_rng(3).random((70, 90))
+    core = (slice(10, 41), slice(0, 25))
+
+    region = close_region(image, core, 0.4, closing_size)
+
+    np.testing.assert_array_equal(region, segment(image, 0.4, closing_size)[core])
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+import tifffile
+from scipy import ndimage as ndi
+from skimage.measure import marching_cubes
+
+from napari.layers import Labels
+
+from napari_matous.meshdata import MeshData
+from napari_matous.tiff2mesh import (DEFAULT_SPACING, TiffPageStack, iter_tiff_mesh,
+                                     merge_regions, open_stack, paint_region, preview_mesh,
+                                     tiff_mesh, tiff_preprocessing, tiff_spacing)
+
+
+def make_stack(shape=(12, 40, 40), seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.random(shape) > 0.6).astype(np.uint8)
+
+
+def test_slice_fill_matches_loop():
+    stack = make_stack()
+    expected = np.empty(stack.shape)
+    for i in range(len(stack)):
+        expected[i] = ndi.binary_fill_holes(stack[i])
+
+    filled = tiff_preprocessing(stack, workers=4)
+
+    assert filled.dtype == bool
+    np.testing.assert_array_equal(filled, expected)
+
+
+def test_3d_fill():
+    stack = np.zeros((7, 7, 7), dtype=np.uint8)
+    stack[1:6, 1:6, 1:6] = 1
+    stack[:, 3, 3] = 0  # tunnel which is only enclosed within each slice
+
+    assert tiff_preprocessing(stack)[3, 3, 3]
+    assert not tiff_preprocessing(stack, '3d')[3, 3, 3]
+
+
+def test_paint_region_of_labels_edits():
+    layer = Labels(np.zeros((10, 12, 14), dtype=np.uint8))
+    events = []
+    layer.events.paint.connect(lambda event: events.append(event.value))
+
+    layer.brush_size = 3
+    layer.paint((5, 5, 5), 1)
+    layer.data_setitem((np.array([1, 2]), np.array([3, 3]), np.array([4, 9])), 2)
+
+    regions = [paint_region(atoms, layer.data.shape) for atoms in events]
+    assert regions[0] == (slice(5, 6), slice(4, 7), slice(4, 7))
+    assert regions[1] == (slice(1, 3), slice(3, 4), slice(4, 10))
+    assert merge_regions(regions) == (slice(1, 6), slice(3, 7), slice(4, 10))
+    assert merge_regions(regions + [None]) is None
+
+
+def test_spacing_from_metadata(tmp_path):
+    stack = np.zeros((5, 8, 8), dtype=np.uint8)
+    tifffile.imwrite(tmp_path / "ome.ome.tif", stack,
+                     metadata={'axes': 'ZYX', 'PhysicalSizeZ': 2.0, 'PhysicalSizeY': 0.5,
+                               'PhysicalSizeX': 0.25})
+    tifffile.imwrite(tmp_path / "imagej.tif", stack, imagej=True, resolution=(4, 2),
+                     metadata={'spacing': 3.0, 'unit': 'um'})
+    tifffile.imwrite(tmp_path / "plain.tif", stack)
+
+    assert tiff_spacing(tmp_path / "ome.ome.tif") == (2.0, 0.5, 0.25)
+    assert tiff_spacing(tmp_path / "imagej.tif") == (3.0, 0.5, 0.25)
+    assert tiff_spacing(tmp_path / "plain.tif") == DEFAULT_SPACING
+
+
+@pytest.mark.parametrize("mode", ["mean", "max", "step"])
+def test_preview_mesh_covers_full_mesh(mode):
+    filled = np.zeros((20, 40, 40), dtype=bool)
+    filled[4:16, 8:32, 10:30] = True
+    spacing = (4, 1, 1)
+    verts, _, _, _ = marching_cubes(filled, 0.5, spacing=spacing)
+
+    preview = preview_mesh(filled, spacing, 4, mode)
+
+    assert 0 < len(preview) < len(verts)
+    step = 4 * np.asarray(spacing)
+    np.testing.assert_array_less(np.abs(preview.vertices.min(axis=0) - verts.min(axis=0)), step)
+    np.testing.assert_array_less(np.abs(preview.vertices.max(axis=0) - verts.max(axis=0)), step)
+
+
+def test_preview_yielded_before_full_mesh(tmp_path):
+    stack = np.zeros((12, 30, 30), dtype=np.uint8)
+    stack[2:10, 5:25, 5:25] = 1
+    tifffile.imwrite(tmp_path / "stack.tif", stack)
+
+    stages = list(iter_tiff_mesh(tmp_path / "stack.tif", preview_factor=2))
+
+    assert stages[0] == 'filled'
+    assert isinstance(stages[1], MeshData)
+    assert stages[2] == 'meshed'
+
+
+def test_lazy_mesh_is_chunked_and_closes_the_tiff(tmp_path):
+    stack = np.zeros((12, 30, 30), dtype=np.uint8)
+    stack[2:10, 5:25, 5:25] = 1
+    tifffile.imwrite(tmp_path / "stack.tif", stack, compression='zlib')
+
+    with open_stack(tmp_path / "stack.tif", lazy=True) as lazy_stack:
+        assert isinstance(lazy_stack, TiffPageStack)
+    assert lazy_stack._tiff.filehandle.closed
+
+    lazy = tiff_mesh(tmp_path / "stack.tif", lazy=True, workers=1)
+    full = tiff_mesh(tmp_path / "stack.tif")
+    assert lazy.vertices.shape == full.vertices.shape
+
+
+@pytest.mark.parametrize("options", [{'fill_mode': '3d'},
+                                     {'preview_factor': 2, 'preview_mode': 'step'}])
+def test_lazy_refuses_whole_stack_stages(tmp_path, options):
+    tifffile.imwrite(tmp_path / "stack.tif", np.ones((4, 8, 8), dtype=np.uint8))
+
+    with pytest.raises(ValueError, match="whole stack"):
+        next(iter_tiff_mesh(tmp_path / "stack.tif", lazy=True, **options))
+
+
+def test_live_mesh_follows_undo_and_redo(monkeypatch):
+    from napari.components import ViewerModel
+
+    from napari_matous import scheduler, tiff2mesh
+    from napari_matous._tests.test_scheduler import FakeWorker, make_scheduler
+
+    def run_jobs():
+        while FakeWorker.started:
+            worker = FakeWorker.started.pop(0)
+            while worker.generator.gi_frame is not None:
+                worker.step()
+
+    monkeypatch.setattr(scheduler, "_default", make_scheduler(max_jobs=1))
+    viewer = ViewerModel()
+    data = np.zeros((24, 24, 24), dtype=np.uint8)
+    data[4:12, 4:12, 4:12] = 1
+    layer = viewer.add_labels(data)
+    tiff2mesh.mesh_layer(viewer, layer, chunk_size=8)
+    run_jobs()
+    before = viewer.layers[layer.name + '_mesh'].data[1].shape[0]
+
+    layer.brush_size = 5
+    layer.paint((16, 16, 16), 1)
+    run_jobs()
+    painted = viewer.layers[layer.name + '_mesh'].data[1].shape[0]
+    layer.undo()
+    run_jobs()
+    assert viewer.layers[layer.name + '_mesh'].data[1].shape[0] == before != painted
+    layer.redo()
+    run_jobs()
+    assert viewer.layers[layer.name + '_mesh'].data[1].shape[0] == painted
+
+    viewer.layers.remove(layer)
+    assert 'undo' not in vars(layer)
@@ -0,0 +1,21 @@
+import numpy as np
+
+from napari_matous.tiling import count_tiles, iter_tiles
+
+
+def test_tile_cores_cover_array():
+    shape = (37, 50)
+    coverage = np.zeros(shape, dtype=int)
+    tiles = list(iter_tiles(shape, 16, 4))
+    for read, core in tiles:
+        coverage[core] += 1
+        for r, c, size in zip(read, core, shape):
+            assert r.start == max(c.start - 4, 0)
+            assert r.stop == min(c.stop + 4, size)
+    assert np.all(coverage == 1)
+    assert len(tiles) == count_tiles(shape, 16)
+
+
+def test_zero_tile_size_is_whole_array():
+    tiles = list(iter_tiles((10, 20, 30), (0, 0, 0), 2))
+    assert tiles == [((slice(0, 10), slice(0, 20), slice(0, 30)),) * 2]
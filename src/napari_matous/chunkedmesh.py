@@ -0,0 +1,371 @@
+"""
+Chunked Mesh
+
+Block-wise marching cubes which meshes a volume in
+overlapping chunks across several cores and welds the
+pieces back into a single mesh, and per-object meshing
+of label volumes, and incremental remeshing of the chunks
+touched by an edit of a label volume.
+"""
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed, wait)
+
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.measure import marching_cubes
+
+# Vertices closer than this fraction of a voxel are welded together
+WELD_TOLERANCE = 1e-4
+
+
+def iter_chunks(shape, chunk_size):
+    """
+    Splits a volume into chunks of cubes.
+
+    Neighbouring chunks share one plane of voxels so that
+    every cube of the volume belongs to exactly one chunk.
+
+    Args:
+        shape: Shape of the volume
+        chunk_size: Number of cubes along each axis of a chunk
+
+    Yields:
+        Tuples of slices of the voxels each chunk reads
+    """
+    axes = []
+    for size in shape:
+        axes.append([slice(start, min(start + chunk_size + 1, size))
+                     for start in range(0, max(size - 1, 1), chunk_size)])
+    yield from itertools.product(*axes)
+
+
+def volume_level(volume):
+    """
+    Default iso level of marching cubes, the midpoint of
+    the volume's range, computed one slab at a time.
+
+    Args:
+        volume: 3D array or memmap
+
+    Returns:
+        The iso level as a float
+    """
+    lo, hi = np.inf, -np.inf
+    for i in range(len(volume)):
+        plane = np.asarray(volume[i])
+        lo, hi = min(lo, plane.min()), max(hi, plane.max())
+    return 0.5 * (float(lo) + float(hi))
+
+
+def mesh_block(block, origin, level, spacing):
+    """
+    Runs marching cubes over one chunk and moves the vertices
+    to the chunk's position in the volume.
+
+    Args:
+        block: Voxels of the chunk
+        origin: Index of the chunk's first voxel in the volume
+        level: Iso level of the surface
+        spacing: Voxel spacing along each axis
+
+    Returns:
+        (vertices, faces) of the chunk, or None if the surface
+        does not pass through it
+    """
+    block = np.asarray(block)
+    if min(block.shape) < 2 or not block.min() <= level <= block.max():
+        return None
+    try:
+        verts, faces, _, _ = marching_cubes(block, level, spacing=spacing)
+    except (ValueError, RuntimeError):  # surface does not cross the block
+        return None
+    verts += np.asarray(origin) * np.asarray(spacing)
+    return verts, faces
+
+
+def weld_vertices(verts, faces, spacing=(1.0, 1.0, 1.0)):
+    """
+    Merges duplicate vertices, such as those created on the
+    shared planes of neighbouring chunks, and drops faces
+    which collapse as a result.
+
+    Args:
+        verts: (N, 3) vertex positions
+        faces: (M, 3) vertex indices of each triangle
+        spacing: Voxel spacing, used to scale the tolerance
+
+    Returns:
+        (vertices, faces) of the welded mesh
+    """
+    keys = np.round(verts / (np.asarray(spacing) * WELD_TOLERANCE)).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    faces = inverse.reshape(-1)[faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    return verts[first], faces[keep]
+
+
+def chunked_marching_cubes(volume, level=None, spacing=(1.0, 1.0, 1.0), chunk_size=64,
+                           workers=None, executor='process'):
+    """
+    Marching cubes over a volume split into chunks which are
+    meshed in parallel and welded into one watertight mesh.
+
+    Only a bounded number of chunks are read at a time, so
+    memory-mapped volumes are never loaded in full.
+
+    Args:
+        volume: 3D array or memmap to mesh
+        level: Iso level, defaults to the midpoint of the volume's range
+        spacing: Voxel spacing along each axis
+        chunk_size: Number of cubes along each axis of a chunk
+        workers: Number of parallel workers, defaults to the number of CPUs
+        executor: 'process' or 'thread' pool
+
+    Returns:
+        (vertices, faces) of the mesh
+    """
+    if level is None:
+        level = volume_level(volume)
+    workers = workers or os.cpu_count()
+
+    tasks = ((np.asarray(volume[read]), tuple(s.start for s in read), level, spacing)
+             for read in iter_chunks(volume.shape, chunk_size))
+    with make_pool(executor, workers) as pool:
+        pieces = [piece for piece in bounded_map(pool, mesh_block, tasks, 2 * workers)
+                  if piece is not None]
+
+    if not pieces:
+        raise RuntimeError('No surface found at the given iso value.')
+
+    offsets = np.cumsum([0] + [len(verts) for verts, _ in pieces[:-1]])
+    verts = np.concatenate([verts for verts, _ in pieces])
+    faces = np.concatenate([faces + offset for (_, faces), offset in zip(pieces, offsets)])
+    return weld_vertices(verts, faces, spacing)
+
+
+def chunk_range(start, stop, size, chunk_size):
+    """
+    Indices of the chunks along one axis that read any of
+    the voxels from 'start' to 'stop', see 'iter_chunks'.
+
+    Args:
+        start: First voxel of the range
+        stop: Voxel after the last one of the range
+        size: Size of the volume along the axis
+        chunk_size: Number of cubes along each axis of a chunk
+
+    Returns:
+        range of chunk indices
+    """
+    n_chunks = len(range(0, max(size - 1, 1), chunk_size))
+    # Chunk k reads the voxels k * chunk_size to (k + 1) * chunk_size
+    first = max(0, -((chunk_size - start) // chunk_size))
+    return range(first, min(n_chunks, (stop - 1) // chunk_size + 1))
+
+
+class IncrementalMesher:
+    """
+    Chunked mesh of the foreground of a label volume that is
+    kept up to date as the volume is edited. The holes of the
+    foreground are filled as in 'tiff_preprocessing', and an
+    update only re-runs marching cubes on the chunks whose
+    filled voxels changed.
+
+    Args:
+        labels: 3D label volume, edited in place by its owner
+        spacing: Voxel spacing along each axis
+        chunk_size: Number of cubes along each axis of a chunk
+        fill_mode: 'slice' to fill each slice in 2D or '3d' to
+        fill holes enclosed in the volume
+        workers: Number of threads, defaults to the number of CPUs
+    """
+    def __init__(self, labels, spacing=(1.0, 1.0, 1.0), chunk_size=32, fill_mode='slice',
+                 workers=None):
+        self.labels = labels
+        self.spacing = spacing
+        self.chunk_size = chunk_size
+        self.fill_mode = fill_mode
+        self.workers = workers or os.cpu_count()
+        self.filled = np.zeros(labels.shape, dtype=bool)
+        self._pieces = {}
+
+    def update(self, region=None):
+        """
+        Refills the edited slices and remeshes the chunks
+        whose filled voxels changed. Filling a hole is not
+        local to the edit, so the whole slices of the region
+        are refilled, and the whole volume in '3d' mode.
+
+        Args:
+            region: Tuple of slices of the edited voxels, None
+            when any voxel may have changed
+
+        Returns:
+            Number of chunks remeshed
+        """
+        start, stop = 0, len(self.labels)
+        if region is not None and self.fill_mode != '3d':
+            start, stop, _ = region[0].indices(len(self.labels))
+        if start >= stop:
+            return 0
+
+        foreground = np.asarray(self.labels[start:stop]) != 0
+        if self.fill_mode == '3d':
+            filled = ndi.binary_fill_holes(foreground)
+        else:
+            filled = np.empty_like(foreground)
+            for i in range(len(foreground)):
+                ndi.binary_fill_holes(foreground[i], output=filled[i])
+
+        changed = filled != self.filled[start:stop]
+        if not changed.any():
+            return 0
+        self.filled[start:stop] = filled
+
+        bounds = []
+        for axis in range(3):
+            hits = np.flatnonzero(changed.any(axis=tuple(a for a in range(3) if a != axis)))
+            offset = start if axis == 0 else 0
+            bounds.append((hits[0] + offset, hits[-1] + offset + 1))
+        touched = list(itertools.product(*(
+            chunk_range(lo, hi, size, self.chunk_size)
+            for (lo, hi), size in zip(bounds, self.filled.shape))))
+
+        tasks = ((index,) for index in touched)
+        with make_pool('thread', self.workers) as pool:
+            for index, piece in bounded_map(pool, self._mesh_chunk, tasks, 2 * self.workers):
+                if piece is None:
+                    self._pieces.pop(index, None)
+                else:
+                    self._pieces[index] = piece
+        return len(touched)
+
+    def mesh(self):
+        """
+        Mesh of the chunks, the vertices on the planes shared
+        by neighbouring chunks are not welded.
+
+        Returns:
+            (vertices, faces) of the mesh, empty arrays when the
+            volume has no surface
+        """
+        pieces = [self._pieces[index] for index in sorted(self._pieces)]
+        if not pieces:
+            return np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int32)
+        offsets = np.cumsum([0] + [len(verts) for verts, _ in pieces[:-1]])
+        verts = np.concatenate([verts for verts, _ in pieces])
+        faces = np.concatenate([faces + offset for (_, faces), offset in zip(pieces, offsets)])
+        return verts, faces
+
+    def _mesh_chunk(self, index):
+        origin = tuple(i * self.chunk_size for i in index)
+        read = tuple(slice(o, o + self.chunk_size + 1) for o in origin)
+        return index, mesh_block(self.filled[read], origin, 0.5, self.spacing)
+
+
+def mesh_label(label, mask, origin, spacing, fill_mode='slice'):
+    """
+    Fills the holes of one object's mask and meshes it.
+
+    Args:
+        label: Label id of the object
+        mask: Boolean mask of the object's padded bounding box
+        origin: Index of the mask's first voxel in the volume
+        spacing: Voxel spacing along each axis
+        fill_mode: 'slice' to fill each slice in 2D or '3d' to
+        fill holes enclosed in the volume
+
+    Returns:
+        (label, vertices, faces) of the object, vertices and faces
+        are None if the object could not be meshed
+    """
+    if fill_mode == '3d':
+        mask = ndi.binary_fill_holes(mask)
+    else:
+        for i in range(len(mask)):
+            mask[i] = ndi.binary_fill_holes(mask[i])
+    piece = mesh_block(mask, origin, 0.5, spacing)
+    if piece is None:
+        return label, None, None
+    return (label,) + piece
+
+
+def label_meshes(labels, spacing=(1.0, 1.0, 1.0), fill_mode='slice', workers=None,
+                 executor='process'):
+    """
+    Generator which builds one mesh per object of a label volume.
+
+    Objects are found with 'ndi.find_objects' and each is
+    meshed only inside its bounding box, padded by one voxel
+    so that surfaces touching the box are closed.
+
+    Args:
+        labels: 3D integer label volume
+        spacing: Voxel spacing along each axis
+        fill_mode: 'slice' or '3d' hole filling of each object
+        workers: Number of parallel workers, defaults to the number of CPUs
+        executor: 'process' or 'thread' pool
+
+    Yields:
+        (label, vertices, faces) for every object that has a surface
+    """
+    def tasks():
+        for label, box in enumerate(ndi.find_objects(labels), start=1):
+            if box is None:
+                continue
+            mask = np.pad(np.asarray(labels[box]) == label, 1)
+            origin = tuple(s.start - 1 for s in box)
+            yield label, mask, origin, spacing, fill_mode
+
+    workers = workers or os.cpu_count()
+    with make_pool(executor, workers) as pool:
+        for label, verts, faces in bounded_map(pool, mesh_label, tasks(), 2 * workers):
+            if verts is not None:
+                yield label, verts, faces
+
+
+def make_pool(executor, workers):
+    """
+    Creates the worker pool used for meshing.
+
+    Args:
+        executor: 'process' or 'thread' pool
+        workers: Number of parallel workers
+
+    Returns:
+        A concurrent.futures executor
+    """
+    if executor == 'process':
+        # spawn avoids forking a process that is running Qt threads
+        return ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context('spawn'))
+    return ThreadPoolExecutor(max_workers=workers)
+
+
+def bounded_map(pool, function, tasks, max_pending):
+    """
+    Maps a function over argument tuples in a pool while only
+    keeping a few tasks in flight, so that the inputs of every
+    task are never held in memory at once.
+
+    Args:
+        pool: Executor to run the tasks in
+        function: Function to call
+        tasks: Iterable of argument tuples
+        max_pending: Largest number of tasks submitted at once
+
+    Yields:
+        Results in the order the tasks finish
+    """
+    pending = set()
+    for args in tasks:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(pool.submit(function, *args))
+    for future in as_completed(pending):
+        yield future.result()
@@ -0,0 +1,346 @@
+"""
+Command Line Interface
+
+Runs the plugin's tools over whole directories without
+a napari viewer or Qt, so that they can be used on
+compute nodes. Files are processed in a process pool,
+finished outputs are skipped when a run is resumed and
+a throughput summary is printed at the end.
+"""
+import argparse
+import functools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+TIFF_SUFFIXES = ('.tif', '.tiff')
+MESH_SUFFIXES = ('.obj', '.ply', '.stl', '.off', '.vtk', '.vtu')
+MESH_FORMATS = ('ply', 'npz', 'vtu', 'stl', 'obj')
+FILTER_CHOICES = {'sharpen': "Filter Sharpen",
+                  'laplacian': "Filter Smooth Laplacian",
+                  'simple': "Filter Smooth Simple",
+                  'taubin': "Filter smooth Taubin"}
+
+
+def partial_path(output_path):
+    """
+    Path an output is written to before it is complete, so
+    that interrupted runs never leave a file that looks
+    finished.
+
+    Args:
+        output_path: Final path of the output
+
+    Returns:
+        Temporary path with the same suffix
+    """
+    return output_path.with_name(output_path.stem + '.partial' + output_path.suffix)
+
+
+def inner_workers(workers):
+    """
+    Number of threads or processes each task of a batch may
+    use, so that the tasks running side by side share the
+    cores instead of each starting a pool of every core.
+
+    Args:
+        workers: Number of tasks running at once
+
+    Returns:
+        Workers per task, at least 1
+    """
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def tiff_to_mesh_file(input_path, output_path, fill_mode='slice', chunk_size=0, lazy=False,
+                      per_label=False, suffix='.ply', workers=1):
+    """
+    Fills and meshes a tiff stack and writes the mesh.
+
+    Args:
+        input_path: Path to the tiff stack
+        output_path: Path of the mesh, or of the marker file
+        written once every label has been meshed
+        fill_mode: 'slice' or '3d' hole filling
+        chunk_size: Chunk size of marching cubes, 0 meshes in one pass
+        lazy: Memory-map the tiff and keep the filled stack on disk
+        per_label: Write one mesh per label id
+        suffix: Suffix of the per label meshes
+        workers: Number of threads and processes used for the stack
+    """
+    from .chunkedmesh import label_meshes
+    from .meshdata import MeshData
+    from .meshwriter import output_file, write_mesh
+    from .tiff2mesh import open_stack, tiff_mesh, tiff_spacing
+
+    if per_label:
+        with open_stack(input_path, lazy) as stack:
+            for label, verts, faces in label_meshes(stack, spacing=tiff_spacing(input_path),
+                                                    fill_mode=fill_mode, workers=workers):
+                label_path = output_file(output_path.parent, input_path, '_label_' + str(label),
+                                         suffix)
+                write_mesh(MeshData(verts, faces), partial_path(label_path))
+                os.replace(partial_path(label_path), label_path)
+        output_path.touch()
+        return
+
+    mesh = tiff_mesh(input_path, fill_mode, chunk_size=chunk_size, lazy=lazy, workers=workers)
+    write_mesh(mesh, partial_path(output_path))
+    os.replace(partial_path(output_path), output_path)
+
+
+def filter_mesh_file(input_path, output_path, filter_choice):
+    """
+    Applies an open3d filter to a mesh file and writes it.
+
+    Args:
+        input_path: Path to the mesh
+        output_path: Path of the filtered mesh
+        filter_choice: Name of the filter as shown in the widget
+    """
+    import open3d
+
+    from .meshdata import MeshData
+    from .meshfilter import filter_mesh
+    from .meshwriter import write_mesh
+
+    mesh = filter_mesh(open3d.io.read_triangle_mesh(str(input_path)), filter_choice)
+    write_mesh(MeshData.from_open3d(mesh), partial_path(output_path))
+    os.replace(partial_path(output_path), output_path)
+
+
+def gamer_mesh_file(input_path, output_path, pipeline):
+    """
+    Runs a gamer pipeline on a mesh file and writes it.
+
+    Args:
+        input_path: Path to the mesh
+        output_path: Path of the processed mesh
+        pipeline: Pipeline description, e.g. 'coarse; smooth'
+    """
+    from .gamer import parse_pipeline, prepare_mesh, read_mesh, run_pipeline
+    from .meshdata import MeshData
+    from .meshwriter import write_mesh
+
+    mesh = prepare_mesh(read_mesh(input_path))
+    for _ in run_pipeline(mesh, parse_pipeline(pipeline)):
+        pass
+    write_mesh(MeshData.from_pygamer(mesh), partial_path(output_path))
+    os.replace(partial_path(output_path), output_path)
+
+
+def segment_image_file(input_path, output_path, rgb=False, workers=1):
+    """
+    Otsu segments an image and writes the labels as a tiff.
+
+    Args:
+        input_path: Path to the image
+        output_path: Path of the label tiff
+        rgb: Whether the image has a trailing colour axis
+        workers: Number of threads segmenting the image
+    """
+    import tifffile
+    from skimage.color import rgb2gray
+
+    from .segment import segment
+
+    image = tifffile.imread(str(input_path))
+    if rgb:
+        image = rgb2gray(image)
+    tifffile.imwrite(str(partial_path(output_path)), segment(image, workers=workers))
+    os.replace(partial_path(output_path), output_path)
+
+
+def stardist_image_file(input_path, output_path, model_name, rgb=False, tile_size=0,
+                        overlap=64):
+    """
+    Segments every plane of an image with a pre-trained
+    StarDist model and writes the labels as a tiff.
+
+    Args:
+        input_path: Path to the image
+        output_path: Path of the label tiff
+        model_name: Name of the pre-trained model
+        rgb: Whether the image has a trailing colour axis
+        tile_size: Size of the tiles in pixels, 0 segments whole planes
+        overlap: Pixels shared between neighbouring tiles
+    """
+    import tifffile
+
+    from .stardistsegment import get_model, segment_stack, to_gray, to_rgb
+
+    convert = to_rgb if model_name == '2D_versatile_he' else to_gray
+    image = tifffile.imread(str(input_path))
+    stack = segment_stack(get_model(model_name), image, rgb, convert, tile_size, overlap)
+    for labels in stack:
+        pass
+    tifffile.imwrite(str(partial_path(output_path)), labels)
+    os.replace(partial_path(output_path), output_path)
+
+
+def find_inputs(input_dir, suffixes):
+    """
+    Lists the files of a directory with one of the suffixes.
+
+    Args:
+        input_dir: Directory to search
+        suffixes: Accepted lower case suffixes
+
+    Returns:
+        Sorted list of paths
+    """
+    return sorted(path for path in Path(input_dir).iterdir()
+                  if path.suffix.lower() in suffixes and '.partial' not in path.suffixes)
+
+
+def run_batch(task, jobs, workers, **kwargs):
+    """
+    Runs a task over (input, output) pairs in a process pool,
+    skipping pairs whose output already exists.
+
+    Args:
+        task: Function taking an input path, an output path and kwargs
+        jobs: List of (input path, output path) pairs
+        workers: Number of worker processes
+        **kwargs: Options passed to every task
+
+    Returns:
+        Dictionary summarising the run
+    """
+    pending = [(source, target) for source, target in jobs if not target.exists()]
+    summary = {'processed': 0, 'skipped': len(jobs) - len(pending), 'failed': 0,
+               'bytes': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(task, source, target, **kwargs): source for source, target in pending}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                summary['failed'] += 1
+                print(f"failed {source}: {error}", file=sys.stderr)
+            else:
+                summary['processed'] += 1
+                summary['bytes'] += source.stat().st_size
+                print(f"done {source}")
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def format_summary(summary):
+    """
+    Formats a run summary as a single line.
+
+    Args:
+        summary: Dictionary returned by 'run_batch'
+
+    Returns:
+        Summary line with the throughput of the run
+    """
+    seconds = max(summary['seconds'], 1e-9)
+    return (f"processed {summary['processed']}, skipped {summary['skipped']}, "
+            f"failed {summary['failed']} in {summary['seconds']:.1f} s "
+            f"({summary['processed'] / seconds:.2f} files/s, "
+            f"{summary['bytes'] / seconds / 1e6:.1f} MB/s)")
+
+
+def build_parser():
+    """
+    Builds the argument parser of the command line interface.
+
+    Returns:
+        argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog='napari-matous', description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def add_command(name, help_text):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('input_dir', type=Path)
+        command.add_argument('output_dir', type=Path)
+        command.add_argument('--workers', type=int, default=os.cpu_count(),
+                             help='number of worker processes')
+        return command
+
+    def add_format(command):
+        command.add_argument('--format', choices=MESH_FORMATS, default='ply',
+                             help='file format of the written meshes')
+
+    command = add_command('tiff2mesh', 'mesh every tiff stack of a directory')
+    add_format(command)
+    command.add_argument('--fill-mode', choices=['slice', '3d'], default='slice')
+    command.add_argument('--chunk-size', type=int, default=0)
+    command.add_argument('--lazy', action='store_true', help='memory-map the tiff stacks')
+    command.add_argument('--per-label', action='store_true', help='write one mesh per label')
+
+    command = add_command('filter', 'apply an open3d filter to every mesh of a directory')
+    command.add_argument('--filter', dest='filter_choice', required=True,
+                         choices=['sharpen', 'laplacian', 'simple', 'taubin'])
+    add_format(command)
+
+    command = add_command('gamer', 'run a gamer pipeline on every mesh of a directory')
+    command.add_argument('--pipeline', default='coarse; smooth; coarse; smooth')
+    add_format(command)
+
+    command = add_command('segment', 'otsu segment every tiff image of a directory')
+    command.add_argument('--rgb', action='store_true')
+
+    command = add_command('stardist', 'stardist segment every tiff image of a directory')
+    command.add_argument('--model', default='2D_versatile_fluo',
+                         choices=['2D_versatile_fluo', '2D_versatile_he'])
+    command.add_argument('--rgb', action='store_true')
+    command.add_argument('--tile-size', type=int, default=0)
+    command.add_argument('--tile-overlap', type=int, default=64)
+    return parser
+
+
+def main(argv=None):
+    """
+    Entry point of the 'napari-matous' console script.
+
+    Args:
+        argv: Command line arguments, defaults to sys.argv
+
+    Returns:
+        Exit code, 1 if any file failed
+    """
+    args = build_parser().parse_args(argv)
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+
+    def outputs(suffixes, ending):
+        return [(path, args.output_dir / (path.stem + ending))
+                for path in find_inputs(args.input_dir, suffixes)]
+
+    suffix = '.' + getattr(args, 'format', '')
+    if args.command == 'tiff2mesh':
+        ending = '_labels.done' if args.per_label else '_mesh' + suffix
+        # Each file is meshed with its share of the cores, not a pool of every core
+        task = functools.partial(tiff_to_mesh_file, workers=inner_workers(args.workers))
+        summary = run_batch(task, outputs(TIFF_SUFFIXES, ending), args.workers,
+                            fill_mode=args.fill_mode, chunk_size=args.chunk_size, lazy=args.lazy,
+                            per_label=args.per_label, suffix=suffix)
+    elif args.command == 'filter':
+        summary = run_batch(filter_mesh_file,
+                            outputs(MESH_SUFFIXES, '_' + args.filter_choice + suffix), args.workers,
+                            filter_choice=FILTER_CHOICES[args.filter_choice])
+    elif args.command == 'gamer':
+        summary = run_batch(gamer_mesh_file, outputs(MESH_SUFFIXES, '_gamer' + suffix), args.workers,
+                            pipeline=args.pipeline)
+    elif args.command == 'segment':
+        task = functools.partial(segment_image_file, workers=inner_workers(args.workers))
+        summary = run_batch(task, outputs(TIFF_SUFFIXES, '_labels.tif'), args.workers,
+                            rgb=args.rgb)
+    else:
+        summary = run_batch(stardist_image_file, outputs(TIFF_SUFFIXES, '_stardist.tif'),
+                            args.workers, model_name=args.model, rgb=args.rgb,
+                            tile_size=args.tile_size, overlap=args.tile_overlap)
+
+    print(format_summary(summary))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,14 +4,287 @@ gamer
 Provides the gamer tools coarse,
 scale and smooth to be applied to meshes.
 """
-import pygamer
 import napari
-import meshio
+import ast
+import inspect
 import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 from magicgui import magic_factory
 from pathlib import Path
 from typing_extensions import Annotated
-from napari.qt.threading import thread_worker
+from napari.utils.notifications import show_info
+
+from .instrument import instrument
+from .lod import show_surface
+from .meshdata import MeshData
+from .meshwriter import FORMATS, output_file, save_mesh
+from .scheduler import default_scheduler, file_key, file_size
+
+
+def surface_mesh_from_arrays(vertices, faces):
+    """
+    Builds a pygamer 'SurfaceMesh' directly from vertex
+    and triangle arrays, without going through a file.
+
+    Args:
+        vertices: (N, 3) vertex positions
+        faces: (M, 3) vertex indices of each triangle
+
+    Returns:
+        A pygamer SurfaceMesh of the arrays
+    """
+    import pygamer
+
+    mesh = pygamer.surfacemesh.SurfaceMesh()
+    for i, (x, y, z) in enumerate(vertices.tolist()):
+        mesh.insertVertex(i, pygamer.surfacemesh.Vertex(x, y, z))
+    for face in faces.tolist():
+        mesh.insertFace(face)
+    return mesh
+
+
+def read_mesh(path):
+    """
+    Reads a mesh file into a pygamer 'SurfaceMesh'.
+
+    .obj files are read by pygamer, other formats are
+    read with meshio and their triangles copied straight
+    into pygamer. Meshes without triangle cells are
+    converted through an .obj in a unique temporary
+    directory, so concurrent runs never share a file.
+
+    Args:
+        path: Path to the mesh file
+
+    Returns:
+        A pygamer SurfaceMesh of the mesh
+    """
+    import meshio
+    import pygamer
+
+    if str(path).endswith('.obj'):
+        return pygamer.readOBJ(str(path))
+    temp_mesh = meshio.read(str(path))
+    triangles = temp_mesh.cells_dict.get('triangle')
+    if triangles is not None:
+        return surface_mesh_from_arrays(temp_mesh.points, triangles)
+    with tempfile.TemporaryDirectory() as directory:
+        obj_path = os.path.join(directory, 'input_mesh.obj')
+        temp_mesh.write(obj_path)
+        return pygamer.readOBJ(obj_path)
+
+
+# Number of prepared meshes kept in memory
+PREPARED_CACHE_SIZE = 4
+
+_prepared = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def prepare_mesh(mesh):
+    """
+    Orients a mesh, corrects its normals and selects every
+    vertex, the setup every gamer method needs.
+
+    Args:
+        mesh: pygamer SurfaceMesh, changed in place
+
+    Returns:
+        The prepared mesh
+    """
+    mesh.compute_orientation()
+    mesh.correctNormals()
+    for v in mesh.vertexIDs:
+        v.data().selected = True
+    return mesh
+
+
+def copy_mesh(mesh):
+    """
+    Copies a prepared pygamer SurfaceMesh so that gamer
+    methods can change the copy in place.
+
+    The mesh is copied with the SurfaceMesh copy constructor.
+    Builds of pygamer without it rebuild the mesh from its
+    arrays, whose faces already have the corrected winding,
+    so only the orientation and the selection are restored.
+
+    Args:
+        mesh: Prepared pygamer SurfaceMesh
+
+    Returns:
+        An independent prepared SurfaceMesh
+    """
+    import pygamer
+
+    try:
+        return pygamer.surfacemesh.SurfaceMesh(mesh)
+    except TypeError:
+        vertices, _, faces = mesh.to_ndarray()
+        copied = surface_mesh_from_arrays(vertices, faces)
+        copied.compute_orientation()
+        for v in copied.vertexIDs:
+            v.data().selected = True
+        return copied
+
+
+def prepared_mesh(path):
+    """
+    Returns a prepared copy of the mesh at a path.
+
+    The mesh is only read and prepared again when the file
+    has changed, keyed by its path and modification time,
+    so repeated gamer runs only pay for the method itself.
+
+    Args:
+        path: Path to the mesh file
+
+    Returns:
+        A prepared pygamer SurfaceMesh the caller may change
+    """
+    key = str(Path(path).resolve())
+    mtime = os.stat(key).st_mtime_ns
+    with _prepared_lock:
+        cached = _prepared.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, prepare_mesh(read_mesh(path)))
+            _prepared[key] = cached
+        _prepared.move_to_end(key)
+        while len(_prepared) > PREPARED_CACHE_SIZE:
+            _prepared.popitem(last=False)
+        return copy_mesh(cached[1])
+
+
+def clear_prepared_meshes():
+    """
+    Drops every cached prepared mesh.
+    """
+    with _prepared_lock:
+        _prepared.clear()
+
+
+def coarse(mesh, rate=1.0, flat_rate=1.0, dense_weight=1.0):
+    """
+    Applies the coarse gamer method to a mesh in place.
+
+    Args:
+        mesh: Prepared pygamer SurfaceMesh.
+        rate: Threshold value for coarsening.
+        flat_rate: Priority of decimating flat regions.
+        dense_weight: Priority of decimating dense regions.
+
+    Returns:
+        The coarsened mesh.
+    """
+    mesh.coarse(rate=rate, flatRate=flat_rate, denseWeight=dense_weight)
+    return mesh
+
+
+def scale(mesh, scale=1.0):
+    """
+    Applies the scale gamer method to a mesh in place.
+
+    Args:
+        mesh: Prepared pygamer SurfaceMesh.
+        scale: Scale factor.
+
+    Returns:
+        The scaled mesh.
+    """
+    mesh.scale(scale)
+    mesh.fillHoles()
+    return mesh
+
+
+def smooth(mesh, max_iterations=6, preserve_ridges=False, ring=2):
+    """
+    Applies the smooth gamer method to a mesh in place.
+
+    Args:
+        mesh: Prepared pygamer SurfaceMesh.
+        max_iterations: Maximum number of smoothing iterations.
+        preserve_ridges: Prevent flipping of edges along ridges.
+        ring: Number of LST rings to consider.
+
+    Returns:
+        The smoothed mesh.
+    """
+    mesh.smooth(max_iter=max_iterations, preserve_ridges=preserve_ridges, rings=ring)
+    return mesh
+
+
+# Gamer methods available to pipelines
+OPERATIONS = {"coarse": coarse, "scale": scale, "smooth": smooth}
+
+
+def parse_pipeline(text):
+    """
+    Parses a pipeline description into its steps.
+
+    Steps are separated by ';' and made of a method name
+    followed by optional 'parameter=value' pairs, e.g.
+    'coarse rate=1.6; smooth max_iterations=10; coarse; smooth'
+
+    Args:
+        text: Pipeline description
+
+    Returns:
+        List of (method name, parameters) tuples
+
+    Raises:
+        ValueError: If a step names an unknown method or parameter,
+        or a parameter is not a 'parameter=value' pair of a literal
+    """
+    steps = []
+    for step in text.split(';'):
+        words = step.split()
+        if not words:
+            continue
+        name = words[0].lower()
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown gamer method '{words[0]}', choose from {list(OPERATIONS)}")
+        parameters = {}
+        for word in words[1:]:
+            key, equals, value = word.partition('=')
+            try:
+                parameters[key] = ast.literal_eval(value) if equals else None
+            except (ValueError, SyntaxError):
+                equals = ''
+            if not equals:
+                raise ValueError(f"Invalid parameter '{word}' in gamer step '{step.strip()}', "
+                                 "expected parameter=value")
+        # The mesh is the first argument, the parameters must match the rest
+        try:
+            inspect.signature(OPERATIONS[name]).bind(None, **parameters)
+        except TypeError as error:
+            raise ValueError(f"Invalid gamer step '{step.strip()}': {error}") from None
+        steps.append((name, parameters))
+    return steps
+
+
+def run_pipeline(mesh, steps):
+    """
+    Generator which applies gamer methods one after another
+    to the same in-memory mesh.
+
+    Args:
+        mesh: Prepared pygamer SurfaceMesh, changed in place
+        steps: List of (method name, parameters) tuples
+
+    Yields:
+        (method name, seconds taken) after every step
+
+    Returns:
+        The processed mesh
+    """
+    for name, parameters in steps:
+        start = time.perf_counter()
+        OPERATIONS[name](mesh, **parameters)
+        yield name, time.perf_counter() - start
+    return mesh
 
 
 @magic_factory(call_button="Confirm Choices")
@@ -20,7 +293,9 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
                output_mesh_path: Annotated[Path, {"mode": "d"}],
                method_choice: Annotated[str, {"choices": ["Coarse",
                                                           "Scale",
-                                                          "Smooth"]}]):
+                                                          "Smooth",
+                                                          "Pipeline"]}],
+               output_format: Annotated[str, {"choices": list(FORMATS)}] = "PLY (binary)"):
     """
 
     Tool that takes a mesh and provides three gamer
@@ -34,36 +309,38 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
         viewer: Layers of the napari viewer.
         input_mesh_path: Path to the input mesh.
         output_mesh_path: Path to the output directory.
-        method_choice: Gamer method to be used (coarse, scale, mesh).
+        method_choice: Gamer method to be used (coarse, scale, mesh),
+        or a pipeline of several methods.
+        output_format: File format of the saved mesh.
 
     Returns:
         Mesh that has had a gamer method applied to it.
     """
-    def read_mesh_file():
+    def submit(key, function, *args, **callbacks):
         """
-        Reads a users' mesh file and returns a pygamer
-        'SurfaceMesh' to be used to apply the gamer
-        methods to.
+        Queues a gamer job on the shared scheduler, identical
+        jobs on an unchanged mesh are merged into one.
 
-        If the user input a non .obj file then it
-        will be read into a meshio mesh, then create
-        a new file "input_mesh.obj" which will then be
-        read into pygamer using the 'readOBJ' function
+        Args:
+            key: Method name and parameters of the job.
+            function: Job function taking the mesh path and args.
+            *args: Parameters of the job.
+            **callbacks: Callbacks passed to the scheduler.
 
         Returns:
-            A pygamer SurfaceMesh object of the users inputted mesh.
+            The scheduled job.
         """
-        if str(input_mesh_path).endswith('.obj'):
-            return pygamer.readOBJ(str(input_mesh_path))
-        temp_mesh = meshio.read(str(input_mesh_path))
-        temp_mesh.write("input_mesh.obj")
-        return pygamer.readOBJ('input_mesh.obj')
+        # pygamer holds the mesh, its prepared copy and the output arrays
+        return default_scheduler().submit(('gamer', file_key(input_mesh_path)) + key, function,
+                                          input_mesh_path, *args,
+                                          memory=4 * file_size(input_mesh_path), **callbacks)
 
     def output_mesh(method_output):
         """
         Outputs the processed mesh to the napari viewer
-        as well as saves it as an .obj file if the user
-        has selected an output directory.
+        as well as saves it, named after the input mesh,
+        in a background thread if the user has selected
+        an output directory.
 
         Args:
             method_output: The processed mesh that has been outputted
@@ -71,28 +348,25 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
 
         Returns:
             A surface layer of the processed mesh to the napari
-            viewer and or a .obj file representation of the processed
-            mesh.
+            viewer and or a file of the processed mesh in the chosen
+            format.
         """
         mesh = method_output[0]
         method_name = method_output[1]
-        vertices, edges, faces = mesh.to_ndarray()
-        viewer.add_surface((vertices, faces), name=str(input_mesh_path.name)+method_name)
+        data = MeshData.from_pygamer(mesh)
+        show_surface(viewer, data, str(input_mesh_path.name)+method_name)
         if str(output_mesh_path) != '.':
-            file = open(str(output_mesh_path) + '/output_mesh.obj', 'w+')
-            pygamer.writeOBJ(file.name, mesh)
-            file.close()
-        if os.path.exists('input_mesh.obj'):
-            os.remove('input_mesh.obj')
+            save_mesh(data, output_file(output_mesh_path, input_mesh_path, method_name,
+                                        FORMATS[output_format]))
 
-    @thread_worker
-    def gamer_coarse(mesh, rate, flat_rate, dense_weight):
+    @instrument('gamer coarse')
+    def gamer_coarse(path, rate, flat_rate, dense_weight):
         """
         Function that applies the coarse gamer function to
         the user inputted mesh.
 
         Args:
-            mesh: User inputted mesh.
+            path: Path to the user inputted mesh.
             rate: Threshold value for coarsening.
             flat_rate: Priority of decimating flat regions.
             dense_weight: Priority of decimating dense regions.
@@ -100,34 +374,31 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
         Returns:
             Mesh which has had the coarse function applied to it.
         """
-        mesh.coarse(rate=rate, flatRate=flat_rate, denseWeight=dense_weight)
-        return mesh, "_coarse"
+        return coarse(prepared_mesh(path), rate, flat_rate, dense_weight), "_coarse"
 
-    @thread_worker
-    def gamer_scale(mesh, scale):
+    @instrument('gamer scale')
+    def gamer_scale(path, scale_factor):
         """
         Function that applies the scale gamer function to
         the user inputted mesh.
 
         Args:
-            mesh: User inputted mesh.
-            scale: Scale factor.
+            path: Path to the user inputted mesh.
+            scale_factor: Scale factor.
 
         Returns:
             Mesh which has had the coarse function applied to it.
         """
-        mesh.scale(scale)
-        mesh.fillHoles()
-        return mesh, "_scale"
+        return scale(prepared_mesh(path), scale_factor), "_scale"
 
-    @thread_worker
-    def gamer_smooth(mesh, max_iter, preserve_ridges, ring):
+    @instrument('gamer smooth')
+    def gamer_smooth(path, max_iter, preserve_ridges, ring):
         """
         Function that applies the smooth gamer function to the
         user inputted mesh.
 
         Args:
-            mesh: User inputted mesh.
+            path: Path to the user inputted mesh.
             max_iter: Maximum number of smoothing iterations.
             preserve_ridges: Prevent flipping of edges along ridges.
             ring: Number of LST rings to consider.
@@ -135,8 +406,36 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
         Returns:
             Mesh which has had the smooth function applied to it.
         """
-        mesh.smooth(max_iter=max_iter, preserve_ridges=preserve_ridges, rings=ring)
-        return mesh, "_smooth"
+        return smooth(prepared_mesh(path), max_iter, preserve_ridges, ring), "_smooth"
+
+    @instrument('gamer pipeline')
+    def gamer_pipeline(path, steps):
+        """
+        Function that applies a chain of gamer functions
+        to one copy of the user inputted mesh, it can be
+        cancelled between the steps.
+
+        Args:
+            path: Path to the user inputted mesh.
+            steps: List of (method name, parameters) tuples.
+
+        Yields:
+            Method name and seconds taken by every step.
+
+        Returns:
+            Mesh which has had every step applied to it.
+        """
+        return (yield from run_pipeline(prepared_mesh(path), steps)), "_pipeline"
+
+    def report_step(step):
+        """
+        Shows how long a pipeline step took.
+
+        Args:
+            step: Method name and seconds taken by the step.
+        """
+        name, seconds = step
+        show_info(f"gamer {name} took {seconds:.2f} s")
 
     @magic_factory
     def coarse_gui(rate: float = 1,
@@ -156,14 +455,8 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
             A surface layer to the napari viewer containing the processed
             mesh and optionally a file containing the processed mesh.
         """
-        mesh = read_mesh_file()
-        mesh.compute_orientation()
-        mesh.correctNormals()
-        for v in mesh.vertexIDs:
-            v.data().selected = True
-        coarse_worker = gamer_coarse(mesh, rate, flat_rate, dense_weight)
-        coarse_worker.returned.connect(output_mesh)
-        coarse_worker.start()
+        submit(('coarse', rate, flat_rate, dense_weight), gamer_coarse,
+               rate, flat_rate, dense_weight, returned=output_mesh)
 
     @magic_factory
     def scale_gui(scale: float = 1.0):
@@ -178,14 +471,7 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
             A surface layer to the napari viewer containing the processed
             mesh and optionally a file containing the processed mesh.
         """
-        mesh = read_mesh_file()
-        mesh.compute_orientation()
-        mesh.correctNormals()
-        for v in mesh.vertexIDs:
-            v.data().selected = True
-        scale_worker = gamer_scale(mesh, scale)
-        scale_worker.returned.connect(output_mesh)
-        scale_worker.start()
+        submit(('scale', scale), gamer_scale, scale, returned=output_mesh)
 
     @magic_factory
     def smooth_gui(max_iterations: int = 6,
@@ -204,14 +490,27 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
             A surface layer to the napari viewer containing the processed
             mesh and optionally a file containing the processed mesh.
         """
-        mesh = read_mesh_file()
-        mesh.compute_orientation()
-        mesh.correctNormals()
-        for v in mesh.vertexIDs:
-            v.data().selected = True
-        smooth_worker = gamer_smooth(mesh, max_iterations, preserve_ridges, ring)
-        smooth_worker.returned.connect(output_mesh)
-        smooth_worker.start()
+        submit(('smooth', max_iterations, preserve_ridges, ring), gamer_smooth,
+               max_iterations, preserve_ridges, ring, returned=output_mesh)
+
+    @magic_factory
+    def pipeline_gui(steps: str = "coarse; smooth; coarse; smooth"):
+        """
+            The GUI of the pipeline which gets the gamer
+            methods to apply in order and their parameters,
+            e.g. 'coarse rate=1.6; smooth max_iterations=10'.
+        Args:
+            steps: Methods separated by ';' each followed by
+            optional parameter=value pairs.
+
+        Returns:
+            A surface layer to the napari viewer containing the processed
+            mesh and optionally a file containing the processed mesh, the
+            mesh is read and written once for the whole pipeline.
+        """
+        parsed = parse_pipeline(steps)
+        submit(('pipeline', repr(parsed)), gamer_pipeline, parsed, progress={'total': len(parsed)},
+               yielded=report_step, returned=output_mesh)
 
     if method_choice == 'Coarse':
         coarse_gui().show()
@@ -219,3 +518,5 @@ def gamer_tool(viewer: "napari.viewer.Viewer",
         scale_gui().show()
     elif method_choice == 'Smooth':
         smooth_gui().show()
+    elif method_choice == 'Pipeline':
+        pipeline_gui().show()
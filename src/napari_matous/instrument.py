@@ -0,0 +1,313 @@
+"""
+Instrumentation
+
+Records the wall time, CPU time, memory growth and the
+sizes of the inputs and outputs of every job the tools
+run in a thread worker. Each finished job is emitted as
+a structured log event on the 'napari_matous.jobs'
+logger and kept in a short history shown by the job
+monitor dock widget.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .meshdata import MeshData
+
+logger = logging.getLogger('napari_matous.jobs')
+
+# Number of finished jobs kept for the job monitor
+HISTORY_SIZE = 1000
+
+# Seconds between two samples of the memory of a running job
+RSS_INTERVAL = 0.01
+
+EVENTS = deque(maxlen=HISTORY_SIZE)
+_listeners = []
+_lock = threading.Lock()
+
+
+def children_cpu_time():
+    """
+    CPU time of the finished child processes that were
+    waited for, such as the workers of a closed process pool.
+
+    Returns:
+        Seconds of user and system time, 0 where the platform
+        does not report it
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class RssSampler:
+    """
+    Samples the resident set size of this process and of its
+    child processes in a background thread while a job runs,
+    keeping the largest values seen.
+
+    ru_maxrss is the peak over the whole life of the process,
+    so it cannot tell the memory of one job apart from the
+    largest job before it. The samples are taken from psutil,
+    when it is not installed nothing is recorded.
+
+    Args:
+        interval: Seconds between two samples
+    """
+    def __init__(self, interval=RSS_INTERVAL):
+        self.interval = interval
+        self.start_rss = self.peak_rss = self.peak_children_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+        try:
+            import psutil
+        except ImportError:
+            self._process = None
+        else:
+            self._process = psutil.Process()
+
+    def sample(self):
+        """
+        Takes one sample of the memory of the process and its children.
+        """
+        import psutil
+
+        rss = self._process.memory_info().rss
+        children = 0
+        for child in self._process.children(recursive=True):
+            try:
+                children += child.memory_info().rss
+            except psutil.Error:  # the child ended in between
+                pass
+        self.peak_rss = max(self.peak_rss or 0, rss)
+        self.peak_children_rss = max(self.peak_children_rss or 0, children)
+
+    def start(self):
+        """
+        Records the memory before the job and starts sampling.
+        """
+        if self._process is None:
+            return
+        self.start_rss = self._process.memory_info().rss
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling, with a last sample of the memory after the job.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+
+def describe(value):
+    """
+    Sizes of the data a job takes or returns.
+
+    Args:
+        value: Array, mesh, layer, path, or a tuple or list of them
+
+    Returns:
+        Dictionary of voxel, vertex, face and byte counts
+    """
+    if isinstance(value, MeshData):
+        return {'vertices': len(value.vertices), 'faces': len(value.faces)}
+    if hasattr(value, 'triangles') and hasattr(value, 'vertices'):  # open3d mesh
+        return {'vertices': len(value.vertices), 'faces': len(value.triangles)}
+    if hasattr(value, 'nVertices') and hasattr(value, 'nFaces'):  # pygamer mesh
+        return {'vertices': int(value.nVertices), 'faces': int(value.nFaces)}
+    if hasattr(value, 'shape') and hasattr(value, 'dtype'):
+        return {'voxels': int(np.prod(value.shape))}
+    if hasattr(value, 'data') and hasattr(value, 'name'):  # napari layer
+        return describe(value.data)
+    if isinstance(value, Path) and value.is_file():
+        return {'bytes': value.stat().st_size}
+    if isinstance(value, (tuple, list)):
+        sizes = {}
+        for item in value:
+            for key, count in describe(item).items():
+                sizes[key] = sizes.get(key, 0) + count
+        return sizes
+    return {}
+
+
+def add_listener(listener):
+    """
+    Calls a function with every finished job event.
+
+    Args:
+        listener: Function taking the event dictionary
+    """
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    """
+    Stops calling a function added with 'add_listener'.
+
+    Args:
+        listener: The function
+    """
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def emit(event):
+    """
+    Logs a finished job event and passes it to the listeners.
+
+    Args:
+        event: Dictionary describing the job
+    """
+    with _lock:
+        EVENTS.append(event)
+    logger.info(json.dumps(event), extra={'job': event})
+    for listener in list(_listeners):
+        listener(event)
+
+
+@contextmanager
+def measure(stage, inputs=None):
+    """
+    Measures the code run in the block as one job.
+
+    The CPU time is that of the thread running the block and
+    of the child processes it waited for, threads started by
+    the block are not counted. It is None when the block ends
+    on another thread than it started on, as a generator run
+    by one worker and closed by another can. The memory is the growth of the
+    resident set size over the block, shared with any other
+    job running at the same time.
+
+    Args:
+        stage: Name of the job
+        inputs: Data the job takes, see 'describe'
+
+    Yields:
+        The event dictionary, the sizes of the outputs can
+        be added with event['output'] = describe(result)
+    """
+    event = {'stage': stage, 'input': describe(inputs), 'output': {}, 'status': 'ok',
+             'pid': os.getpid()}
+    sampler = RssSampler()
+    sampler.start()
+    thread = threading.get_ident()
+    wall, cpu = time.perf_counter(), time.thread_time() + children_cpu_time()
+    try:
+        yield event
+    except GeneratorExit:
+        event['status'] = 'cancelled'
+        raise
+    except BaseException as error:
+        event['status'] = 'error: ' + type(error).__name__
+        raise
+    finally:
+        event['wall_s'] = time.perf_counter() - wall
+        event['cpu_s'] = (time.thread_time() + children_cpu_time() - cpu
+                          if threading.get_ident() == thread else None)
+        sampler.stop()
+        event['rss_start_bytes'] = sampler.start_rss
+        event['peak_rss_delta_bytes'] = (None if sampler.start_rss is None
+                                         else sampler.peak_rss - sampler.start_rss)
+        event['peak_rss_children_bytes'] = sampler.peak_children_rss
+        emit(event)
+
+
+def instrument(stage):
+    """
+    Decorator measuring every call of a job function, for
+    plain functions and for generators run by thread
+    workers, whose returned value is described as the output.
+
+    Args:
+        stage: Name of the job
+
+    Returns:
+        The decorator
+    """
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with measure(stage, args) as event:
+                    result = yield from function(*args, **kwargs)
+                    event['output'] = describe(result)
+                return result
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with measure(stage, args) as event:
+                    result = function(*args, **kwargs)
+                    event['output'] = describe(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def job_monitor():
+    """
+    Dock widget listing the jobs finished by the tools with
+    their timings, memory growth and data sizes, with a button
+    cancelling the queued and running jobs.
+
+    Returns:
+        magicgui Container with a table of the jobs
+    """
+    from magicgui.widgets import Container, PushButton, Table
+    from superqt.utils import ensure_main_thread
+
+    from .scheduler import default_scheduler
+
+    columns = ['stage', 'status', 'wall_s', 'cpu_s', 'peak_rss_delta_mb', 'input', 'output']
+
+    def row(event):
+        peak, cpu = event['peak_rss_delta_bytes'], event['cpu_s']
+        return [event['stage'], event['status'], round(event['wall_s'], 3),
+                None if cpu is None else round(cpu, 3),
+                None if peak is None else round(peak / 2 ** 20, 1),
+                json.dumps(event['input']), json.dumps(event['output'])]
+
+    with _lock:
+        rows = [row(event) for event in EVENTS]
+    table = Table(value={'data': rows, 'columns': columns})
+    clear = PushButton(text='Clear')
+    cancel = PushButton(text='Cancel jobs')
+    container = Container(widgets=[table, clear, cancel])
+
+    @ensure_main_thread
+    def add_row(event):
+        rows.append(row(event))
+        table.value = {'data': rows, 'columns': columns}
+
+    def clear_rows():
+        with _lock:
+            EVENTS.clear()
+        rows.clear()
+        table.value = {'data': rows, 'columns': columns}
+
+    clear.changed.connect(clear_rows)
+    cancel.changed.connect(lambda: default_scheduler().cancel_all())
+    add_listener(add_row)
+    container.native.destroyed.connect(lambda: remove_listener(add_row))
+    return container
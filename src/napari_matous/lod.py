@@ -0,0 +1,124 @@
+"""
+Level of Detail
+
+Shows large surfaces in napari without stalling the
+renderer: a pyramid of meshes decimated with open3d
+quadric decimation is computed in a background job, the
+lightest level is shown first and finer levels replace
+it as each one finishes. A large mesh is never sent to the viewer whole, what
+is displayed is capped at the finest decimated level.
+Only the displayed layer is decimated, exports keep
+using the full resolution mesh.
+"""
+from .meshdata import MeshData
+from .scheduler import default_scheduler
+
+# Meshes with at most this many faces are shown directly,
+# it is also the face count of the lightest level
+LOD_MIN_FACES = 200_000
+
+# Ratio between the face counts of consecutive levels
+LOD_FACTOR = 4
+
+
+def lod_targets(n_faces, min_faces=LOD_MIN_FACES, factor=LOD_FACTOR):
+    """
+    Face counts of the decimated levels of a mesh.
+
+    Args:
+        n_faces: Number of faces of the full mesh
+        min_faces: Number of faces of the lightest level
+        factor: Ratio between the face counts of consecutive levels
+
+    Returns:
+        Increasing list of face counts, all below 'n_faces'
+    """
+    targets = []
+    target = min_faces
+    while target < n_faces:
+        targets.append(target)
+        target *= factor
+    return targets
+
+
+def decimate(mesh, target):
+    """
+    Decimates a mesh with open3d quadric decimation.
+
+    Args:
+        mesh: MeshData of the full mesh
+        target: Number of faces of the decimated mesh
+
+    Returns:
+        MeshData of the decimated mesh
+    """
+    return MeshData.from_open3d(mesh.to_open3d().simplify_quadric_decimation(
+        target_number_of_triangles=target))
+
+
+def iter_lod(mesh, min_faces=LOD_MIN_FACES, factor=LOD_FACTOR):
+    """
+    Decimated levels of a mesh from the lightest to the
+    finest, every level is yielded as soon as it is
+    decimated so the lightest one is shown first and the
+    job can be cancelled between levels. Every level is
+    decimated from the full mesh, a finer level cannot be
+    made from a coarser one.
+
+    Args:
+        mesh: MeshData of the full mesh
+        min_faces: Number of faces of the lightest level
+        factor: Ratio between the face counts of consecutive levels
+
+    Yields:
+        MeshData of every level, never the full mesh
+    """
+    for target in lod_targets(len(mesh), min_faces, factor):
+        yield decimate(mesh, target)
+
+
+def set_surface(viewer, mesh, name):
+    """
+    Replaces the data of a surface layer, adding the layer
+    when the viewer does not have it yet.
+
+    Args:
+        viewer: The napari viewer
+        mesh: MeshData to show
+        name: Name of the surface layer
+    """
+    if name in viewer.layers:
+        viewer.layers[name].data = mesh.layer_data
+    else:
+        viewer.add_surface(mesh.layer_data, name=name)
+
+
+def show_surface(viewer, mesh, name, min_faces=LOD_MIN_FACES, factor=LOD_FACTOR):
+    """
+    Shows a mesh as a surface layer, large meshes are shown
+    as their lightest level first and refined up to their
+    finest level in a background job. A job still refining
+    an older mesh of the same layer is cancelled.
+
+    Args:
+        viewer: The napari viewer
+        mesh: MeshData of the full mesh
+        name: Name of the surface layer
+        min_faces: Meshes with more faces are shown level by level
+        factor: Ratio between the face counts of consecutive levels
+    """
+    slot = ('lod', name)
+    if len(mesh) <= min_faces:
+        # Levels of an older mesh still being decimated are dropped
+        default_scheduler().claim(slot, lambda: None).release()
+        set_surface(viewer, mesh, name)
+        return
+
+    def show_level(level):
+        # Levels of a mesh that has since been replaced are dropped
+        if job.claim.active:
+            set_surface(viewer, level, name)
+
+    # Every mesh gets its own job, open3d holds a double precision copy of it
+    job = default_scheduler().submit(('lod', name, object()), iter_lod, mesh, min_faces, factor,
+                                     memory=3 * mesh.nbytes, replace=slot, yielded=show_level)
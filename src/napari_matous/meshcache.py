@@ -0,0 +1,193 @@
+"""
+Mesh Cache
+
+On-disk cache of the intermediate results of the tiff to
+mesh pipeline. Entries are addressed by a hash of the path,
+size and modification time of the input file and of the
+parameters of every stage, so re-opening an unchanged stack,
+or changing only a parameter downstream of a cached stage,
+skips the stages already computed without reading the input.
+Entries larger than the cache are not stored, and the least
+recently used entries are removed once the cache grows over
+its size limit.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from .meshdata import MeshData
+
+# Directory of the cache, defaults to ~/.cache/napari-matous
+CACHE_DIR_ENV = "NAPARI_MATOUS_CACHE_DIR"
+
+# Size limit of the cache in bytes
+CACHE_SIZE_ENV = "NAPARI_MATOUS_CACHE_SIZE"
+CACHE_SIZE = 10 * 2 ** 30
+
+
+def cache_key(*parts):
+    """
+    Key of a cache entry from the digest of its input and
+    the parameters it was computed with.
+
+    Args:
+        *parts: Values whose text representations identify the entry
+
+    Returns:
+        Hexadecimal key
+    """
+    return hashlib.blake2b(repr(parts).encode(), digest_size=20).hexdigest()
+
+
+def source_key(path):
+    """
+    Key of an input file from its path, size and modification
+    time, so that large inputs are never read to be hashed.
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        Hexadecimal key, which changes when the file is modified
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    return cache_key(str(path), stat.st_size, stat.st_mtime_ns)
+
+
+class ResultCache:
+    """
+    Directory of cached arrays and meshes, one file per entry.
+
+    The modification time of an entry is refreshed whenever it
+    is read, so the oldest files are the least recently used.
+    """
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = os.environ.get(CACHE_DIR_ENV) or Path.home() / '.cache' / 'napari-matous'
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(CACHE_SIZE_ENV, CACHE_SIZE))
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def load_array(self, key):
+        """
+        Cached array, memory-mapped read only.
+
+        Args:
+            key: Key of the entry
+
+        Returns:
+            The array, or None when it is not cached
+        """
+        path = self._touch(key + '.npy')
+        return None if path is None else np.load(path, mmap_mode='r')
+
+    def store_array(self, key, array):
+        """
+        Caches an array, unless it is larger than the cache.
+
+        Args:
+            key: Key of the entry
+            array: ndarray or memmap to store
+
+        Returns:
+            Whether the array was stored
+        """
+        if array.nbytes > self.max_bytes:
+            return False
+        self._write(self.directory / (key + '.npy'), lambda file: np.save(file, array))
+        self.evict()
+        return True
+
+    def load_mesh(self, key):
+        """
+        Cached mesh.
+
+        Args:
+            key: Key of the entry
+
+        Returns:
+            MeshData, or None when it is not cached
+        """
+        path = self._touch(key + '.npz')
+        if path is None:
+            return None
+        with np.load(path) as arrays:
+            return MeshData(arrays['vertices'], arrays['faces'])
+
+    def store_mesh(self, key, mesh):
+        """
+        Caches a mesh, unless it is larger than the cache.
+
+        Args:
+            key: Key of the entry
+            mesh: MeshData to store
+
+        Returns:
+            Whether the mesh was stored
+        """
+        if mesh.vertices.nbytes + mesh.faces.nbytes > self.max_bytes:
+            return False
+        self._write(self.directory / (key + '.npz'),
+                    lambda file: np.savez(file, vertices=mesh.vertices, faces=mesh.faces))
+        self.evict()
+        return True
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the
+        cache fits in its size limit.
+        """
+        entries = []
+        for path in self.directory.glob('*.np[yz]'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def _touch(self, name):
+        path = self.directory / name
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def _write(self, path, write):
+        # Entries appear complete or not at all, also across processes
+        handle, temporary = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                write(file)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+_default = None
+
+
+def default_cache():
+    """
+    Cache shared by the tools, created on first use.
+
+    Returns:
+        ResultCache in the default directory
+    """
+    global _default
+    if _default is None:
+        _default = ResultCache()
+    return _default
@@ -0,0 +1,95 @@
+"""
+Mesh Data
+
+Container shared by the mesh tools which keeps a
+triangle mesh as contiguous float32 vertices and
+int32 faces, the layout napari surface layers use,
+and only converts to open3d or pygamer meshes when
+a backend needs them.
+"""
+import numpy as np
+
+
+class MeshData:
+    """
+    Triangle mesh stored as a (N, 3) float32 vertex array and
+    a (M, 3) int32 face array.
+
+    Arrays which already have the right dtype and layout are
+    kept without copying, conversions to backend meshes are
+    made on first use and cached.
+    """
+    def __init__(self, vertices, faces):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32)
+        self._open3d = None
+
+    @classmethod
+    def from_open3d(cls, mesh):
+        """
+        Creates mesh data from an open3d TriangleMesh, the
+        open3d mesh is kept so that it is not rebuilt when
+        it is needed again.
+
+        Args:
+            mesh: open3d TriangleMesh
+
+        Returns:
+            MeshData of the mesh
+        """
+        data = cls(np.asarray(mesh.vertices), np.asarray(mesh.triangles))
+        data._open3d = mesh
+        return data
+
+    @classmethod
+    def from_pygamer(cls, mesh):
+        """
+        Creates mesh data from a pygamer SurfaceMesh.
+
+        Args:
+            mesh: pygamer SurfaceMesh
+
+        Returns:
+            MeshData of the mesh
+        """
+        vertices, _, faces = mesh.to_ndarray()
+        return cls(vertices, faces)
+
+    def to_open3d(self):
+        """
+        Builds an open3d TriangleMesh of the mesh, open3d
+        stores double vertices and int64 triangles so the
+        arrays are converted once and the result cached.
+
+        Returns:
+            open3d TriangleMesh
+        """
+        if self._open3d is None:
+            import open3d
+
+            mesh = open3d.geometry.TriangleMesh()
+            mesh.vertices = open3d.utility.Vector3dVector(self.vertices.astype(np.float64))
+            mesh.triangles = open3d.utility.Vector3iVector(self.faces.astype(np.int64))
+            self._open3d = mesh
+        return self._open3d
+
+    @property
+    def layer_data(self):
+        """
+        Data for a napari surface layer, the arrays are
+        passed through without copying.
+
+        Returns:
+            (vertices, faces) tuple
+        """
+        return self.vertices, self.faces
+
+    @property
+    def nbytes(self):
+        """
+        Bytes used by the vertex and face arrays.
+        """
+        return self.vertices.nbytes + self.faces.nbytes
+
+    def __len__(self):
+        return len(self.faces)
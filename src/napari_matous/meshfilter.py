@@ -5,14 +5,183 @@ Tool that allows a user to input a mesh file and
 either view it and not apply or a filter, or
 apply a filter then view it.
 """
+import functools
+import os
+from contextlib import ExitStack
+
 import napari
 import numpy as np
-import open3d as o3d
 from magicgui import magic_factory
-from napari.qt.threading import thread_worker
 from pathlib import Path
 from typing_extensions import Annotated
 
+from .instrument import instrument
+from .lod import LOD_FACTOR, LOD_MIN_FACES, show_surface
+from .chunkedmesh import make_pool
+from .meshdata import MeshData
+from .meshwriter import open_ply, read_mesh_data
+from .partitionedfilter import FILTER_RINGS, MeshPartitions, open3d_filter
+from .scheduler import default_scheduler, file_key, file_size
+
+# open3d filters offered by the tool
+FILTERS = {"Filter Sharpen": "filter_sharpen",
+           "Filter Smooth Laplacian": "filter_smooth_laplacian",
+           "Filter Smooth Simple": "filter_smooth_simple",
+           "Filter smooth Taubin": "filter_smooth_taubin"}
+
+
+# Parameters of every open3d filter besides the number of iterations
+FILTER_PARAMETERS = {"filter_sharpen": ("strength",),
+                     "filter_smooth_laplacian": ("lambda_filter",),
+                     "filter_smooth_simple": (),
+                     "filter_smooth_taubin": ("lambda_filter", "mu")}
+
+# Largest number of faces of the surface a filter run sends to the
+# viewer, larger meshes are decimated in the job
+SURFACE_FACES = LOD_MIN_FACES * LOD_FACTOR ** 2
+
+
+def filter_parameters(filter_choice, strength=1.0, lambda_filter=0.5, mu=-0.53):
+    """
+    Keyword arguments of the chosen open3d filter.
+
+    Args:
+        filter_choice: Name of the filter
+        strength: Strength of the sharpen filter
+        lambda_filter: Lambda of the Laplacian and Taubin filters
+        mu: Mu of the Taubin filter
+
+    Returns:
+        Dictionary of the parameters the filter accepts
+    """
+    values = {"strength": strength, "lambda_filter": lambda_filter, "mu": mu}
+    return {name: values[name] for name in FILTER_PARAMETERS[FILTERS[filter_choice]]}
+
+
+def filter_mesh(mesh_obj, filter_choice, iterations=1, **parameters):
+    """
+    Applies one of the open3d filters to a mesh
+
+    Args:
+        mesh_obj: Mesh object to be filtered
+        filter_choice: Name of the filter, 'None' returns the mesh unchanged
+        iterations: Number of iterations of the filter
+        **parameters: Parameters from 'filter_parameters'
+
+    Returns:
+        Filtered mesh object
+    """
+    if filter_choice == "None":
+        return mesh_obj
+    return getattr(mesh_obj, FILTERS[filter_choice])(number_of_iterations=iterations, **parameters)
+
+
+def filter_mesh_partitioned(mesh, filter_choice, partitions, pool, iterations=1, workers=None,
+                            **parameters):
+    """
+    Applies one of the open3d filters to a mesh partition by
+    partition in a process pool, for meshes whose filter
+    working set does not fit in memory.
+
+    Args:
+        mesh: (vertices, faces) arrays of the mesh to be filtered,
+        e.g. memory-mapped by 'open_ply'
+        filter_choice: Name of the filter
+        partitions: MeshPartitions of the mesh, grown for at least
+        the rings the iterations read
+        pool: Process pool the partitions are filtered in
+        iterations: Number of iterations of the filter
+        workers: Number of workers of the pool, defaults to the number of CPUs
+        **parameters: Parameters from 'filter_parameters'
+
+    Returns:
+        (vertices, faces) arrays of the filtered mesh, the faces
+        are those of the input
+    """
+    vertices, faces = mesh
+    function = functools.partial(open3d_filter, method=FILTERS[filter_choice],
+                                 number_of_iterations=iterations, **parameters)
+    filtered = partitions.filter(vertices, function, pool, workers or os.cpu_count(),
+                                 out=np.empty(vertices.shape, dtype=np.float32))
+    return filtered, faces
+
+
+def filter_surface(mesh, max_faces, partitions=None, pool=None, workers=None):
+    """
+    MeshData surface of a filtered mesh with at most
+    'max_faces' faces, made where the filter runs so that the
+    viewer only receives meshes small enough to show.
+
+    Args:
+        mesh: open3d TriangleMesh, or (vertices, faces) arrays when partitioned
+        max_faces: Largest number of faces of the surface
+        partitions: MeshPartitions of partitioned meshes, which are
+        decimated partition by partition
+        pool: Pool the partitions are decimated in
+        workers: Number of workers of the pool
+
+    Returns:
+        MeshData of the surface
+    """
+    if partitions is None:
+        if len(mesh.triangles) > max_faces:
+            mesh = mesh.simplify_quadric_decimation(target_number_of_triangles=max_faces)
+        return MeshData.from_open3d(mesh)
+    vertices, faces = mesh
+    if len(faces) <= max_faces:
+        return MeshData(vertices, faces)
+    return partitions.surface(vertices, max_faces, pool, workers)
+
+
+def iter_filter(mesh, filter_choice, iterations=1, update_every=1, partition_size=0,
+                workers=None, surface_faces=None, **parameters):
+    """
+    Filters a mesh a few iterations at a time so that the
+    intermediate meshes can be shown, open3d filters apply
+    their iterations one after the other so the final mesh
+    is the same as filtering in one call. Partitioned runs
+    index their partitions and start their process pool
+    once for all of their iterations.
+
+    Args:
+        mesh: open3d TriangleMesh, or (vertices, faces) arrays when partitioned
+        filter_choice: Name of the filter
+        iterations: Total number of iterations
+        update_every: Number of iterations between intermediate meshes
+        partition_size: Filter the arrays in partitions of this many
+        vertices, 0 filters the open3d mesh in one piece
+        workers: Number of worker processes of partitioned runs
+        surface_faces: Optional (intermediate, final) face budgets, when
+        given the meshes are yielded as MeshData surfaces from
+        'filter_surface', decimated to their budget
+        **parameters: Parameters from 'filter_parameters'
+
+    Yields:
+        Number of iterations done and the filtered mesh
+    """
+    workers = workers or os.cpu_count()
+    partitions = pool = None
+    with ExitStack() as stack:
+        if partition_size > 0:
+            rings = FILTER_RINGS[FILTERS[filter_choice]] * min(update_every, iterations)
+            partitions = stack.enter_context(MeshPartitions(*mesh, rings, partition_size))
+            pool = stack.enter_context(make_pool('process', workers))
+
+        done = 0
+        while done < iterations:
+            step = min(update_every, iterations - done)
+            if partition_size > 0:
+                mesh = filter_mesh_partitioned(mesh, filter_choice, partitions, pool, step,
+                                               workers, **parameters)
+            else:
+                mesh = filter_mesh(mesh, filter_choice, step, **parameters)
+            done += step
+            if surface_faces is None:
+                yield done, mesh
+            else:
+                yield done, filter_surface(mesh, surface_faces[done == iterations], partitions,
+                                           pool, workers)
+
 
 @magic_factory(call_button='View Mesh')
 def load_mesh(viewer: "napari.viewer.Viewer",
@@ -21,104 +190,112 @@ def load_mesh(viewer: "napari.viewer.Viewer",
                                                          "Filter Sharpen",
                                                          "Filter Smooth Laplacian",
                                                          "Filter Smooth Simple",
-                                                         "Filter smooth Taubin"]}]
+                                                         "Filter smooth Taubin"]}],
+              iterations: Annotated[int, {"min": 1, "max": 10000}] = 1,
+              strength: float = 1.0,
+              lambda_filter: float = 0.5,
+              mu: float = -0.53,
+              update_every: Annotated[int, {"min": 1, "max": 10000}] = 1,
+              partition_size: Annotated[int, {"min": 0, "max": 2 ** 30}] = 0
               ):
     """
     Function that apply a filter to
     a user inputted mesh and outputs it
-    to the napari viewer
+    to the napari viewer, the surface layer
+    is updated as the iterations run
 
     Args:
         viewer: layers of the napari viewer
         mesh_path: path to the mesh file
         filter_choice: filter to be applied to the mesh
+        iterations: number of iterations of the filter
+        strength: strength of the sharpen filter
+        lambda_filter: lambda of the Laplacian and Taubin filters
+        mu: mu of the Taubin filter
+        update_every: iterations between updates of the surface layer
+        partition_size: Filter the mesh in partitions of this many
+        vertices across all cores, 0 filters it in one piece
 
     Returns:
         Mesh with filter applied to the napari viewer
     """
-    def view_data(filtered_mesh):
-        """
-        Takes the output of the filters and adds
-        it to the napari viewer
-
-        Args:
-            filtered_mesh: The filtered mesh
+    import open3d as o3d
 
-        Returns:
-            Adds surface layer to viewer containing the filtered mesh
-        """
-        surface = (np.asarray(filtered_mesh.vertices), np.asarray(filtered_mesh.triangles))
-        viewer.add_surface(surface, name=mesh_path.name + '_mesh')
+    name = mesh_path.name + '_mesh'
 
-    @thread_worker
-    def filter_sharpen(mesh_obj):
+    def view_data(surface):
         """
-        Applies a 'sharpen' filter to a mesh
+        Takes the output of the filters and shows it
+        in the napari viewer, replacing the data of the
+        surface layer when it already exists, large
+        meshes are shown level by level
 
         Args:
-            mesh_obj: Mesh object to be filtered
+            surface: MeshData surface of the filtered mesh
 
         Returns:
-            Filtered mesh object
+            Surface layer of the viewer containing the filtered mesh
         """
-        return o3d.geometry.TriangleMesh.filter_sharpen(mesh_obj)
+        show_surface(viewer, surface, name)
 
-    @thread_worker
-    def filter_smooth_laplacian(mesh_obj):
+    def view_iteration(result):
         """
-        Applies a 'smooth laplacian' filter to a mesh
+        Shows an intermediate mesh of the filter, large
+        meshes arrive decimated to their lightest level so no
+        levels are built, the last mesh is shown by 'view_data'
+        once the job returns
 
         Args:
-            mesh_obj: Mesh object to be filtered
-
-        Returns:
-            Filtered mesh object
+            result: Number of iterations done and the surface
         """
-        return o3d.geometry.TriangleMesh.filter_smooth_laplacian(mesh_obj)
+        done, surface = result
+        if done < iterations:
+            show_surface(viewer, surface, name)
 
-    @thread_worker
-    def filter_smooth_simple(mesh_obj):
+    @instrument('load_mesh ' + filter_choice)
+    def apply_filter(path):
         """
-        Applies a 'smooth simple' filter to a mesh
+        Reads a mesh and applies the chosen filter to it,
+        yielding the mesh every 'update_every' iterations
 
         Args:
-            mesh_obj: Mesh object to be filtered
+            path: path to the mesh file
 
-        Returns:
-            Filtered mesh object
-        """
-        return o3d.geometry.TriangleMesh.filter_smooth_simple(mesh_obj)
-
-    @thread_worker
-    def filter_smooth_taubin(mesh_obj):
-        """
-        Applies a 'smooth taubin' filter to a mesh
-
-        Args:
-            mesh_obj: Mesh object to be filtered
+        Yields:
+            Number of iterations done and the surface of the
+            filtered mesh, made in the job
 
         Returns:
-            Filtered mesh object
+            MeshData surface of the fully filtered mesh
         """
-        return o3d.geometry.TriangleMesh.filter_smooth_taubin(mesh_obj)
-
-    mesh = o3d.io.read_triangle_mesh(str(mesh_path))  # Reads mesh from file path
+        if partition_size > 0:
+            # Binary PLY files are memory-mapped and read partition by partition
+            mesh = open_ply(path)
+            if mesh is None:
+                mesh = read_mesh_data(path).layer_data
+        else:
+            mesh = o3d.io.read_triangle_mesh(str(path))
+        parameters = filter_parameters(filter_choice, strength, lambda_filter, mu)
+        for done, surface in iter_filter(mesh, filter_choice, iterations, update_every,
+                                         partition_size,
+                                         surface_faces=(LOD_MIN_FACES, SURFACE_FACES),
+                                         **parameters):
+            yield done, surface
+        return surface
 
     if filter_choice == "None":
-        view_data(mesh)
-    elif filter_choice == "Filter Sharpen":
-        worker = filter_sharpen(mesh)
-        worker.returned.connect(view_data)
-        worker.start()
-    elif filter_choice == "Filter Smooth Laplacian":
-        worker = filter_smooth_laplacian(mesh)
-        worker.returned.connect(view_data)
-        worker.start()
-    elif filter_choice == "Filter Smooth Simple":
-        worker = filter_smooth_simple(mesh)
-        worker.returned.connect(view_data)
-        worker.start()
-    else:
-        worker = filter_smooth_taubin(mesh)
-        worker.returned.connect(view_data)
-        worker.start()
+        # Reads mesh from file path
+        view_data(MeshData.from_open3d(o3d.io.read_triangle_mesh(str(mesh_path))))
+        return
+
+    # Identical runs are merged, a run with other parameters on the
+    # same mesh cancels the one still running
+    key = ('load_mesh', file_key(mesh_path), filter_choice, iterations, strength, lambda_filter,
+           mu, update_every, partition_size)
+    # open3d holds the mesh and its filtered copy in double precision, partitioned
+    # runs hold the filtered vertices and the partitions in flight
+    memory = (1 if partition_size > 0 else 4) * file_size(mesh_path)
+    default_scheduler().submit(key, apply_filter, mesh_path, memory=memory,
+                               progress={'total': -(-iterations // update_every)},
+                               replace=('load_mesh', name), yielded=view_iteration,
+                               returned=view_data)
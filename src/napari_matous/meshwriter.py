@@ -0,0 +1,245 @@
+"""
+Mesh Writer
+
+Writes and reads MeshData in the formats offered by the
+mesh tools: binary PLY, compressed NPZ and the binary
+formats of meshio, with text OBJ kept for compatibility.
+Meshes can be saved from a background thread so that
+the viewer is not blocked while large files are written.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .meshdata import MeshData
+
+# Output formats offered by the tools and their suffixes
+FORMATS = {"PLY (binary)": ".ply",
+           "NPZ (compressed)": ".npz",
+           "VTU (binary)": ".vtu",
+           "STL (binary)": ".stl",
+           "OBJ (text)": ".obj"}
+
+# Faces written to a PLY file at once
+PLY_CHUNK = 2 ** 20
+
+# Header of the PLY files written by 'write_ply', formatted with the element counts
+PLY_HEADER = ("ply\n"
+              "format binary_little_endian 1.0\n"
+              "element vertex {}\n"
+              "property float x\n"
+              "property float y\n"
+              "property float z\n"
+              "element face {}\n"
+              "property list uchar int vertex_indices\n"
+              "end_header\n")
+
+PLY_FACE = np.dtype([('count', 'u1'), ('indices', '<i4', (3,))])
+
+# numpy types of the PLY property types
+PLY_TYPES = {"char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+             "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+             "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+             "float": "f4", "float32": "f4", "double": "f8", "float64": "f8"}
+
+# Longest header line read by 'open_ply'
+PLY_LINE = 256
+
+
+def output_file(directory, input_path, tag, suffix):
+    """
+    Path of an output named after the input it was made from.
+
+    Args:
+        directory: Output directory
+        input_path: Path of the input file
+        tag: Text added to the input's name, e.g. '_mesh'
+        suffix: Suffix of the output format
+
+    Returns:
+        Path of the output file
+    """
+    return Path(directory) / (Path(input_path).stem + tag + suffix)
+
+
+def write_ply(path, mesh):
+    """
+    Writes a mesh as a binary little endian PLY file with
+    float vertices and int faces.
+
+    Args:
+        path: Path of the PLY file
+        mesh: MeshData to write
+    """
+    header = PLY_HEADER.format(len(mesh.vertices), len(mesh.faces))
+    with open(path, 'wb') as file:
+        file.write(header.encode('ascii'))
+        file.write(mesh.vertices.astype('<f4', copy=False).tobytes())
+        for start in range(0, len(mesh.faces), PLY_CHUNK):
+            faces = mesh.faces[start:start + PLY_CHUNK]
+            records = np.empty(len(faces), dtype=PLY_FACE)
+            records['count'] = 3
+            records['indices'] = faces
+            file.write(records.tobytes())
+
+
+def read_ply(path):
+    """
+    Reads a PLY file laid out as 'write_ply' writes it.
+
+    Args:
+        path: Path of the PLY file
+
+    Returns:
+        MeshData of the mesh, or None when the file has another layout
+    """
+    with open(path, 'rb') as file:
+        lines = [file.readline() for _ in range(PLY_HEADER.count('\n'))]
+        header = b''.join(lines).decode('ascii', errors='replace')
+        try:
+            n_vertices = int(lines[2].split()[-1])
+            n_faces = int(lines[6].split()[-1])
+        except (IndexError, ValueError):
+            return None
+        if header != PLY_HEADER.format(n_vertices, n_faces):
+            return None
+        vertices = np.fromfile(file, dtype='<f4', count=3 * n_vertices).reshape(-1, 3)
+        faces = np.fromfile(file, dtype=PLY_FACE, count=n_faces)
+    return MeshData(vertices, faces['indices'])
+
+
+def open_ply(path):
+    """
+    Memory-maps the vertices and triangles of a binary little
+    endian PLY file, so that meshes larger than memory can be
+    read piece by piece. The vertex properties must start with
+    x, y and z of one type and every face must be a triangle,
+    as in the files of 'write_ply' and open3d.
+
+    Args:
+        path: Path of the PLY file
+
+    Returns:
+        (N, 3) vertex and (M, 3) face arrays viewing the file,
+        or None when the file has another layout
+    """
+    elements = []
+    with open(path, 'rb') as file:
+        while True:
+            words = file.readline(PLY_LINE).decode('ascii', errors='replace').split()
+            if not words or words[0] == 'end_header':
+                break
+            if words[0] == 'format' and words[1:2] != ['binary_little_endian']:
+                return None
+            if words[0] == 'element':
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == 'property' and elements:
+                elements[-1][2].append(words[1:])
+        offset = file.tell()
+    if not words or [element[0] for element in elements] != ['vertex', 'face']:
+        return None
+    (_, n_vertices, vertex_properties), (_, n_faces, face_properties) = elements
+    try:
+        vertex = np.dtype([(name, '<' + PLY_TYPES[kind]) for kind, name in vertex_properties])
+        (_, count, index, _), = face_properties
+        face = np.dtype([('count', '<' + PLY_TYPES[count]),
+                         ('indices', '<' + PLY_TYPES[index], (3,))])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if vertex.names[:3] != ('x', 'y', 'z') or len({vertex[axis] for axis in 'xyz'}) != 1:
+        return None
+    # Faces with other than three vertices would change the size of the file
+    if os.path.getsize(path) != offset + n_vertices * vertex.itemsize + n_faces * face.itemsize:
+        return None
+    records = np.memmap(path, dtype=vertex, mode='r', offset=offset, shape=(n_vertices,))
+    vertices = np.lib.stride_tricks.as_strided(records['x'], shape=(n_vertices, 3),
+                                               strides=(vertex.itemsize, vertex['x'].itemsize),
+                                               writeable=False)
+    faces = np.memmap(path, dtype=face, mode='r', offset=offset + n_vertices * vertex.itemsize,
+                      shape=(n_faces,))['indices']
+    return vertices, faces
+
+
+def write_mesh(mesh, path):
+    """
+    Writes a mesh in the format given by the suffix of the path.
+
+    Args:
+        mesh: MeshData to write
+        path: Path of the output, '.ply' and '.npz' are written
+        directly and other suffixes with meshio
+
+    Returns:
+        Path of the written file
+    """
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == '.ply':
+        write_ply(path, mesh)
+    elif suffix == '.npz':
+        with open(path, 'wb') as file:
+            np.savez_compressed(file, vertices=mesh.vertices, faces=mesh.faces)
+    else:
+        import meshio
+
+        binary = {} if suffix == '.obj' else {'binary': True}
+        meshio.write(str(path), meshio.Mesh(mesh.vertices, [("triangle", mesh.faces)]), **binary)
+    return path
+
+
+def read_mesh_data(path):
+    """
+    Reads a mesh written by 'write_mesh', PLY files from
+    other writers are read with meshio.
+
+    Args:
+        path: Path of the mesh file
+
+    Returns:
+        MeshData of the mesh
+    """
+    path = Path(path)
+    if path.suffix.lower() == '.npz':
+        with np.load(path) as arrays:
+            return MeshData(arrays['vertices'], arrays['faces'])
+    if path.suffix.lower() == '.ply':
+        mesh = read_ply(path)
+        if mesh is not None:
+            return mesh
+
+    import meshio
+
+    mesh = meshio.read(str(path))
+    return MeshData(mesh.points, mesh.cells_dict["triangle"])
+
+
+def save_mesh(mesh, path):
+    """
+    Writes a mesh in a background thread and reports the
+    file once it is written. The file is written under a
+    temporary name so that an unfinished file is never
+    mistaken for the output.
+
+    Args:
+        mesh: MeshData to write
+        path: Path of the output file
+
+    Returns:
+        The started worker
+    """
+    from napari.qt.threading import thread_worker
+    from napari.utils.notifications import show_info
+
+    path = Path(path)
+    partial = path.with_name(path.stem + '.partial' + path.suffix)
+
+    def write():
+        write_mesh(mesh, partial)
+        os.replace(partial, path)
+        return path
+
+    worker = thread_worker(write)()
+    worker.returned.connect(lambda written: show_info(f"Saved {written.name}"))
+    worker.start()
+    return worker
@@ -0,0 +1,462 @@
+"""
+Partitioned Filter
+
+Filters triangle meshes too large to be filtered in one
+piece. The vertices are split into spatial partitions and
+each partition is filtered together with a halo of the
+neighbour rings its filter reads, only the filtered
+positions of the partition's own vertices are kept, so the
+reassembled mesh matches filtering the whole mesh at once.
+The mesh arrays may be memory-mapped, the partitions and
+their halos are indexed once into memory-mapped files and
+reused by every filter pass.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import nullcontext
+
+import numpy as np
+
+from .chunkedmesh import bounded_map, make_pool
+from .meshdata import MeshData
+
+# Number of vertices owned by each partition
+PARTITION_SIZE = 2 ** 20
+
+# Rows of the mesh arrays read at once when scanning them
+BLOCK_SIZE = 2 ** 20
+
+# Number of vertices sampled to place the partition bounds
+PARTITION_SAMPLE_SIZE = 2 ** 16
+
+# Search state of the vertices while growing a halo, unreached vertices are 0
+REACHED = 1
+FRONTIER = 2
+
+# Neighbour rings read by one iteration of each open3d filter,
+# Taubin makes a shrinking and an inflating pass per iteration
+FILTER_RINGS = {"filter_sharpen": 1,
+                "filter_smooth_laplacian": 1,
+                "filter_smooth_simple": 1,
+                "filter_smooth_taubin": 2}
+
+
+def open3d_mesh(vertices, faces):
+    """
+    Creates an open3d TriangleMesh from arrays.
+
+    Args:
+        vertices: (N, 3) vertex array
+        faces: (M, 3) face array
+
+    Returns:
+        open3d TriangleMesh in double precision
+    """
+    import open3d
+
+    mesh = open3d.geometry.TriangleMesh()
+    mesh.vertices = open3d.utility.Vector3dVector(np.asarray(vertices, dtype=np.float64))
+    mesh.triangles = open3d.utility.Vector3iVector(np.asarray(faces, dtype=np.int64))
+    return mesh
+
+
+def open3d_filter(vertices, faces, method, **parameters):
+    """
+    Applies an open3d filter to a mesh given as arrays.
+
+    Args:
+        vertices: (N, 3) vertex array
+        faces: (M, 3) face array
+        method: Name of the open3d TriangleMesh filter method
+        **parameters: Keyword arguments of the filter method
+
+    Returns:
+        (N, 3) float64 array of the filtered vertices
+    """
+    return np.asarray(getattr(open3d_mesh(vertices, faces), method)(**parameters).vertices)
+
+
+def open3d_decimate(vertices, faces, target):
+    """
+    Decimates a mesh given as arrays with open3d quadric
+    decimation.
+
+    Args:
+        vertices: (N, 3) vertex array
+        faces: (M, 3) face array
+        target: Number of faces of the decimated mesh
+
+    Returns:
+        (vertices, faces) float32 and int32 arrays of the decimated mesh
+    """
+    mesh = open3d_mesh(vertices, faces).simplify_quadric_decimation(
+        target_number_of_triangles=target)
+    return (np.asarray(mesh.vertices, dtype=np.float32),
+            np.asarray(mesh.triangles, dtype=np.int32))
+
+
+def iter_blocks(array, block_size=BLOCK_SIZE):
+    """
+    Reads an array, which may be memory-mapped, block by
+    block along its first axis.
+
+    Args:
+        array: Array or memmap
+        block_size: Number of rows per block
+
+    Yields:
+        (first row, block) of every block
+    """
+    for start in range(0, len(array), block_size):
+        yield start, np.asarray(array[start:start + block_size])
+
+
+def open_array(path, dtype, shape):
+    """
+    Creates a zeroed array backed by a file, empty arrays
+    are kept in memory as they cannot be memory-mapped.
+
+    Args:
+        path: Path of the file
+        dtype: Data type of the array
+        shape: Shape of the array
+
+    Returns:
+        Writable memmap, or ndarray when the array is empty
+    """
+    if not np.prod(shape):
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+
+
+def bucket_items(path, pairs, n_buckets):
+    """
+    Sorts items into buckets with a counting sort written
+    to a memory-mapped file, items keep their order within
+    a bucket.
+
+    Args:
+        path: Path of the file holding the sorted items
+        pairs: Function returning an iterator of (bucket ids, items)
+        blocks, it is called once to count and once to sort
+        n_buckets: Number of buckets
+
+    Returns:
+        (starts, items), bucket b holds items[starts[b]:starts[b + 1]]
+    """
+    counts = np.zeros(n_buckets, dtype=np.int64)
+    for buckets, _ in pairs():
+        counts += np.bincount(buckets, minlength=n_buckets)
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    items = open_array(path, np.int64, (int(starts[-1]),))
+    cursor = starts[:-1].copy()
+    for buckets, block_items in pairs():
+        order = np.argsort(buckets, kind='stable')
+        buckets, block_items = buckets[order], block_items[order]
+        block_counts = np.bincount(buckets, minlength=n_buckets)
+        first = np.cumsum(block_counts) - block_counts
+        items[cursor[buckets] + np.arange(len(buckets)) - first[buckets]] = block_items
+        cursor += block_counts
+    return starts, items
+
+
+class MeshPartitions:
+    """
+    Spatial partitions of a mesh and the faces every
+    partition is filtered with, found once and reused by
+    every filter pass over the mesh.
+
+    Every vertex gets the id of its slab in one pass, the
+    vertices and the faces are bucketed by partition with a
+    counting sort, and the halo of a partition is grown from
+    the buckets of the partitions it reaches, using one byte
+    of search state per vertex. The indices
+    are memory-mapped from a temporary directory which is
+    removed by 'close'.
+
+    Args:
+        vertices: (N, 3) vertex array or memmap
+        faces: (M, 3) face array or memmap
+        rings: Neighbour rings read by every filter pass
+        partition_size: Number of vertices owned by each partition
+    """
+    def __init__(self, vertices, faces, rings, partition_size=PARTITION_SIZE):
+        self.faces = faces
+        self.directory = tempfile.mkdtemp(prefix='napari_matous_partitions_')
+        self.n_partitions = max(1, -(-len(vertices) // partition_size))
+
+        # Slabs along the longest axis bounded by quantiles of a strided sample
+        sample = np.asarray(vertices[::max(1, len(vertices) // PARTITION_SAMPLE_SIZE)])
+        axis = int(np.argmax(np.ptp(sample, axis=0))) if len(sample) else 0
+        bounds = (np.quantile(sample[:, axis], np.linspace(0, 1, self.n_partitions + 1)[1:-1])
+                  if len(sample) else np.empty(0))
+        self.part = open_array(self._path('part'), np.int32, (len(vertices),))
+        for start, block in iter_blocks(vertices):
+            self.part[start:start + len(block)] = np.searchsorted(bounds, block[:, axis],
+                                                                  side='right')
+
+        self.core_starts, self.cores = bucket_items(self._path('cores'), self._vertex_pairs,
+                                                    self.n_partitions)
+        self.bucket_starts, self.buckets = bucket_items(self._path('buckets'), self._face_pairs,
+                                                        self.n_partitions)
+        self.halo_starts, self.halos = self._grow_halos(rings)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + '.bin')
+
+    def _vertex_pairs(self):
+        for start, block in iter_blocks(self.part):
+            yield block, np.arange(start, start + len(block), dtype=np.int64)
+
+    def _face_pairs(self):
+        # Every face is listed once in each partition one of its vertices belongs to
+        for start, block in iter_blocks(self.faces):
+            parts = np.asarray(self.part[block.ravel()]).reshape(block.shape)
+            keep = np.ones(parts.shape, dtype=bool)
+            keep[:, 1] = parts[:, 1] != parts[:, 0]
+            keep[:, 2] = (parts[:, 2] != parts[:, 0]) & (parts[:, 2] != parts[:, 1])
+            ids = np.repeat(np.arange(start, start + len(block), dtype=np.int64), 3)
+            yield parts[keep], ids[keep.ravel()]
+
+    def core(self, index):
+        """
+        Sorted indices of the vertices a partition owns.
+
+        Args:
+            index: Index of the partition
+
+        Returns:
+            Array of indices
+        """
+        return np.asarray(self.cores[self.core_starts[index]:self.core_starts[index + 1]])
+
+    def bucket(self, index):
+        """
+        Sorted indices of the faces using a vertex of a partition.
+
+        Args:
+            index: Index of the partition
+
+        Returns:
+            Array of indices
+        """
+        return np.asarray(self.buckets[self.bucket_starts[index]:self.bucket_starts[index + 1]])
+
+    def halo(self, index):
+        """
+        Sorted indices of the faces a partition is filtered with.
+
+        Args:
+            index: Index of the partition
+
+        Returns:
+            Array of indices
+        """
+        return np.asarray(self.halos[self.halo_starts[index]:self.halo_starts[index + 1]])
+
+    def faces_using(self, vertices, state):
+        """
+        Faces using at least one of the vertices, only the
+        buckets of the partitions the vertices belong to are
+        read.
+
+        Args:
+            vertices: Vertex indices, marked FRONTIER in 'state'
+            state: uint8 array with the search state of every vertex
+
+        Returns:
+            Indices of the faces, a face may be listed more than once
+        """
+        if not len(vertices):
+            return np.empty(0, dtype=np.int64)
+        reached = np.flatnonzero(np.bincount(np.asarray(self.part[vertices]),
+                                             minlength=self.n_partitions))
+        candidates = np.concatenate([self.bucket(index) for index in reached])
+        used = (state[np.asarray(self.faces[candidates])] == FRONTIER).any(axis=1)
+        return candidates[used]
+
+    def partition_halo(self, index, rings, state=None):
+        """
+        Faces a partition has to be filtered with so that a
+        filter reading 'rings' rings of neighbours leaves the
+        partition's vertices exactly as in a single pass.
+
+        Every vertex within 'rings' - 1 rings of the partition
+        keeps all of its faces, so that the values it passes
+        inwards at every iteration are exact. The rings are
+        searched outwards from the partition, each step only
+        reading the faces of the newly reached vertices.
+
+        Args:
+            index: Index of the partition
+            rings: Neighbour rings read by the filter
+            state: Optional zeroed uint8 array of one value per vertex,
+            reused between partitions and zeroed again on return
+
+        Returns:
+            Sorted indices of the faces of the partition and its halo
+        """
+        state = np.zeros(len(self.part), dtype=np.uint8) if state is None else state
+        frontier = self.core(index)
+        reached = [frontier]
+        found = []
+        for ring in range(rings):
+            state[frontier] = FRONTIER
+            face_ids = self.faces_using(frontier, state)
+            found.append(face_ids)
+            state[frontier] = REACHED
+            if ring + 1 < rings:
+                vertices = np.asarray(self.faces[face_ids]).ravel()
+                frontier = np.unique(vertices[state[vertices] == 0])
+                reached.append(frontier)
+        for vertices in reached:
+            state[vertices] = 0
+        return np.unique(np.concatenate(found))
+
+    def _grow_halos(self, rings):
+        state = np.zeros(len(self.part), dtype=np.uint8)
+        starts = [0]
+        with open(self._path('halos'), 'wb') as file:
+            for index in range(self.n_partitions):
+                halo = self.partition_halo(index, rings, state).astype(np.int64)
+                halo.tofile(file)
+                starts.append(starts[-1] + len(halo))
+        if not starts[-1]:
+            return np.array(starts), np.empty(0, dtype=np.int64)
+        return np.array(starts), np.memmap(self._path('halos'), dtype=np.int64, mode='r',
+                                           shape=(starts[-1],))
+
+    def filter(self, vertices, function, pool, workers, out=None):
+        """
+        Filters the mesh partition by partition in a pool,
+        only the submeshes of the partitions in flight are
+        held in memory.
+
+        Args:
+            vertices: (N, 3) vertex array or memmap of the current positions
+            function: Filter taking (vertices, faces) and returning the
+            filtered vertices, reading at most the rings of the partitions
+            pool: Executor the partitions are filtered in
+            workers: Number of workers of the pool
+            out: Optional (N, 3) array the filtered vertices are written to
+
+        Returns:
+            (N, 3) array of the filtered vertices
+        """
+        if out is None:
+            out = np.empty(vertices.shape, dtype=np.float64)
+
+        def tasks():
+            for index in range(self.n_partitions):
+                core = self.core(index)
+                if not len(core):
+                    continue
+                sub_faces = np.asarray(self.faces[self.halo(index)])
+                used = np.union1d(core, sub_faces.ravel())
+                yield (function, np.asarray(vertices[used]), np.searchsorted(used, sub_faces),
+                       np.searchsorted(used, core), core)
+
+        for indices, filtered in bounded_map(pool, filter_partition, tasks(), 2 * workers):
+            out[indices] = filtered
+        return out
+
+    def surface(self, vertices, max_faces, pool, workers, decimate=open3d_decimate):
+        """
+        Decimated surface of the mesh made partition by
+        partition in a pool, so the whole mesh is never held
+        in memory. A partition owns the faces whose first
+        vertex it owns and decimates them to its share of
+        'max_faces'. The pieces are decimated independently,
+        small gaps may show along their seams.
+
+        Args:
+            vertices: (N, 3) vertex array or memmap of the current positions
+            max_faces: Number of faces of the whole surface
+            pool: Executor the partitions are decimated in
+            workers: Number of workers of the pool
+            decimate: Function taking (vertices, faces, target) arrays and
+            returning the decimated (vertices, faces), picklable when run
+            in processes
+
+        Returns:
+            MeshData of the surface
+        """
+        n_faces = len(self.faces)
+
+        def tasks():
+            for index in range(self.n_partitions):
+                sub_faces = np.asarray(self.faces[self.bucket(index)])
+                own = sub_faces[np.asarray(self.part[sub_faces[:, 0]]) == index]
+                if not len(own):
+                    continue
+                used, local = np.unique(own, return_inverse=True)
+                target = max(1, int(max_faces * len(own) / n_faces))
+                yield np.asarray(vertices[used]), local.reshape(own.shape), target
+
+        pieces = [(np.empty((0, 3), dtype=np.float32), np.empty((0, 3), dtype=np.int32))]
+        offset = 0
+        for piece_vertices, piece_faces in bounded_map(pool, decimate, tasks(), 2 * workers):
+            pieces.append((piece_vertices, piece_faces + offset))
+            offset += len(piece_vertices)
+        return MeshData(np.concatenate([piece[0] for piece in pieces]),
+                        np.concatenate([piece[1] for piece in pieces]))
+
+    def close(self):
+        """
+        Removes the index files of the partitions.
+        """
+        self.part = self.cores = self.buckets = self.halos = None
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def filter_partition(function, vertices, faces, core, indices):
+    """
+    Filters the submesh of one partition and returns the
+    filtered positions of the vertices it owns.
+
+    Args:
+        function: Filter taking and returning vertex arrays
+        vertices: Vertices of the submesh
+        faces: Faces of the submesh, indexing 'vertices'
+        core: Indices into 'vertices' of the partition's own vertices
+        indices: Indices of the partition's own vertices in the whole mesh
+
+    Returns:
+        (indices, filtered vertices of the partition)
+    """
+    return indices, np.asarray(function(vertices, faces))[core]
+
+
+def filter_partitioned(vertices, faces, function, rings, partition_size=PARTITION_SIZE,
+                       workers=None, executor='thread', out=None, pool=None):
+    """
+    Filters a mesh partition by partition in a pool, the
+    partitions are only used for this one pass.
+
+    Args:
+        vertices: (N, 3) vertex array or memmap
+        faces: (M, 3) face array or memmap
+        function: Filter taking (vertices, faces) and returning the
+        filtered vertices, picklable when run in processes
+        rings: Neighbour rings read by the whole filter
+        partition_size: Number of vertices owned by each partition
+        workers: Number of parallel workers, defaults to the number of CPUs
+        executor: 'process' or 'thread' pool
+        out: Optional (N, 3) array the filtered vertices are written to
+        pool: Optional executor shared by several passes, a pool of
+        'executor' is created for this pass otherwise
+
+    Returns:
+        (N, 3) array of the filtered vertices
+    """
+    workers = workers or os.cpu_count()
+    with MeshPartitions(vertices, faces, rings, partition_size) as partitions:
+        with nullcontext(pool) if pool is not None else make_pool(executor, workers) as pool:
+            return partitions.filter(vertices, function, pool, workers, out)
@@ -0,0 +1,410 @@
+"""
+Job Scheduler
+
+Runs the long jobs of the tools in thread workers through
+one shared queue. Only a limited number of jobs run at
+once and a job is only started when its estimated memory
+fits next to the jobs already running. Identical
+submissions are merged into one job, a newer job for the
+same slot, such as a surface layer, replaces the older
+one, and jobs can be cancelled while queued or at their
+next yield.
+"""
+import contextlib
+import functools
+import hashlib
+import inspect
+import os
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+# Number of jobs running at once
+MAX_JOBS_ENV = "NAPARI_MATOUS_MAX_JOBS"
+MAX_JOBS = 2
+
+# Bytes the running jobs may use together, defaults to a
+# share of the physical memory
+JOB_MEMORY_ENV = "NAPARI_MATOUS_JOB_MEMORY"
+MEMORY_SHARE = 0.5
+
+# Largest number of elements of an array hashed by 'array_key'
+DIGEST_SAMPLE_SIZE = 2 ** 16
+
+
+def physical_memory():
+    """
+    Physical memory of the machine.
+
+    Returns:
+        Bytes of memory, or None when it cannot be read
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def file_size(path):
+    """
+    Size of an input file, used for memory estimates.
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        Bytes of the file, 0 when it cannot be read
+    """
+    try:
+        return Path(path).stat().st_size
+    except OSError:
+        return 0
+
+
+def file_key(path):
+    """
+    Identity of an input file for merging submissions,
+    which changes when the file is modified.
+
+    Args:
+        path: Path of the file
+
+    Returns:
+        (resolved path, modification time) tuple
+    """
+    path = Path(path).resolve()
+    try:
+        return str(path), path.stat().st_mtime_ns
+    except OSError:
+        return str(path), None
+
+
+def array_key(data):
+    """
+    Identity of an array for merging submissions, from its
+    shape, dtype and a digest of a strided sample of its
+    values, so the same data merges however it is wrapped.
+
+    Args:
+        data: ndarray, or any array supporting basic slicing
+
+    Returns:
+        (shape, dtype, digest) tuple
+    """
+    shape = tuple(data.shape)
+    per_axis = max(1, int(DIGEST_SAMPLE_SIZE ** (1 / max(1, len(shape)))))
+    sample = data[tuple(slice(None, None, max(1, size // per_axis)) for size in shape)]
+    digest = hashlib.blake2b(np.ascontiguousarray(sample).tobytes(), digest_size=16)
+    return shape, str(data.dtype), digest.hexdigest()
+
+
+def as_generator(function):
+    """
+    Turns a function into a generator function so that
+    every job runs in a cancellable generator worker.
+
+    Args:
+        function: Plain or generator function
+
+    Returns:
+        Generator function with the same result
+    """
+    if inspect.isgeneratorfunction(function):
+        return function
+
+    @functools.wraps(function)
+    def generator(*args, **kwargs):
+        return function(*args, **kwargs)
+        yield  # Unreachable, makes this function a generator
+
+    return generator
+
+
+def closing_generator(job, function):
+    """
+    Generator function of a job that stops the job's
+    generator at its first yield after the job is cancelled
+    and closes it there, in the worker thread. napari's
+    workers stop an aborted generator without closing it,
+    so its cleanup would only run once it is collected, on
+    whichever thread collects it.
+
+    Args:
+        job: Job the generator runs for
+        function: Plain or generator function of the job
+
+    Returns:
+        Generator function with the same values and result
+    """
+    generator_function = as_generator(function)
+
+    @functools.wraps(generator_function)
+    def generator(*args, **kwargs):
+        with contextlib.closing(generator_function(*args, **kwargs)) as values:
+            while True:
+                try:
+                    value = next(values)
+                except StopIteration as done:
+                    return done.value
+                if job.state == 'cancelled':
+                    return None
+                yield value
+
+    return generator
+
+
+class Claim:
+    """
+    Hold of a slot, such as a surface layer, by a job or any
+    other work that is replaced when newer work claims the
+    same slot.
+    """
+    def __init__(self, scheduler, slot, cancel):
+        self.scheduler = scheduler
+        self.slot = slot
+        self._cancel = cancel
+
+    @property
+    def active(self):
+        """
+        Whether no newer claim has replaced this one.
+        """
+        return self.scheduler._slots.get(self.slot) is self
+
+    def cancel(self):
+        """
+        Cancels the work holding the claim.
+        """
+        self._cancel()
+
+    def release(self):
+        """
+        Gives up the slot, unless a newer claim holds it.
+        """
+        if self.active:
+            del self.scheduler._slots[self.slot]
+
+
+class Job:
+    """
+    One submitted job with the callbacks of everyone who
+    submitted it.
+
+    States go from 'queued' to 'running' and end as 'done'
+    or 'cancelled'.
+    """
+    def __init__(self, scheduler, key, function, args, memory, progress):
+        self.scheduler = scheduler
+        self.key = key
+        self.function = function
+        self.args = args
+        self.memory = memory
+        self.progress = progress
+        self.state = 'queued'
+        self.worker = None
+        self.claim = None
+        self._callbacks = {'yielded': [], 'returned': [], 'finished': []}
+
+    def connect(self, yielded=None, returned=None, finished=None):
+        """
+        Adds callbacks run on the main thread for every value
+        the job yields, for its result and once it finishes.
+
+        Args:
+            yielded: Function taking every yielded value
+            returned: Function taking the returned value
+            finished: Function run when the job ends, even if cancelled
+        """
+        for name, callback in (('yielded', yielded), ('returned', returned),
+                               ('finished', finished)):
+            if callback is not None:
+                self._callbacks[name].append(callback)
+
+    def cancel(self):
+        """
+        Cancels the job, a queued job never starts and a
+        running job stops at its next yield.
+        """
+        self.scheduler.cancel(self)
+
+    def _emit(self, name, *value):
+        for callback in list(self._callbacks[name]):
+            callback(*value)
+
+
+class JobScheduler:
+    """
+    Queue of jobs started in submission order within a limit
+    on the number of running jobs and on their estimated
+    memory. A job larger than the memory limit still runs,
+    alone, so that it is never stuck in the queue.
+
+    The scheduler is used from the main thread, the workers
+    report back through their Qt signals.
+
+    Args:
+        max_jobs: Number of jobs running at once
+        memory_limit: Bytes the running jobs may use together
+        worker_factory: Function creating a generator worker from a
+        generator function and progress options, defaults to
+        napari's thread_worker
+    """
+    def __init__(self, max_jobs=None, memory_limit=None, worker_factory=None):
+        if max_jobs is None:
+            max_jobs = int(os.environ.get(MAX_JOBS_ENV, MAX_JOBS))
+        if memory_limit is None and os.environ.get(JOB_MEMORY_ENV):
+            memory_limit = int(os.environ[JOB_MEMORY_ENV])
+        if memory_limit is None and physical_memory() is not None:
+            memory_limit = int(physical_memory() * MEMORY_SHARE)
+        self.max_jobs = max(1, max_jobs)
+        self.memory_limit = memory_limit
+        self.worker_factory = worker_factory
+        self._queue = deque()
+        self._running = []
+        self._jobs = {}
+        self._slots = {}
+
+    def submit(self, key, function, *args, memory=0, progress=None, replace=None, yielded=None,
+               returned=None, finished=None):
+        """
+        Submits a job, or joins the queued or running job
+        submitted with the same key.
+
+        Args:
+            key: Hashable identity of the input and parameters
+            function: Function or generator function of the job
+            *args: Arguments of the function
+            memory: Estimated peak bytes of the job
+            progress: Progress bar options of the worker, e.g. {'total': n}
+            replace: Optional hashable slot, e.g. the name of the layer
+            the job fills, a new job cancels the older work of its slot
+            yielded: Function taking every yielded value
+            returned: Function taking the returned value
+            finished: Function run when the job ends
+
+        Returns:
+            The Job
+        """
+        job = self._jobs.get(key)
+        if job is None:
+            job = Job(self, key, function, args, memory, progress)
+            self._jobs[key] = job
+            self._queue.append(job)
+            if replace is not None:
+                job.claim = self.claim(replace, job.cancel)
+        job.connect(yielded, returned, finished)
+        self._schedule()
+        return job
+
+    def claim(self, slot, cancel):
+        """
+        Makes work the current holder of a slot, cancelling the
+        work that held it before.
+
+        Args:
+            slot: Hashable slot, e.g. the name of a surface layer
+            cancel: Function cancelling the new work once it is replaced
+
+        Returns:
+            The Claim, whose 'active' tells if it still holds the slot
+        """
+        previous = self._slots.get(slot)
+        claim = Claim(self, slot, cancel)
+        self._slots[slot] = claim
+        if previous is not None:
+            previous.cancel()
+        return claim
+
+    def cancel(self, job):
+        """
+        Cancels a job, see 'Job.cancel'.
+
+        Args:
+            job: Job to cancel
+        """
+        if job.state == 'queued':
+            self._queue.remove(job)
+            self._forget(job, 'cancelled')
+            job._emit('finished')
+        elif job.state == 'running':
+            # A new submission of the same job starts afresh, the worker
+            # closes the generator at its next yield
+            self._forget(job, 'cancelled')
+
+    def cancel_all(self):
+        """
+        Cancels every queued and running job.
+        """
+        for job in list(self._queue) + list(self._running):
+            self.cancel(job)
+
+    @property
+    def jobs(self):
+        """
+        Running jobs followed by the queued jobs.
+        """
+        return list(self._running) + list(self._queue)
+
+    def _memory_in_use(self):
+        return sum(job.memory for job in self._running)
+
+    def _admits(self, job):
+        if len(self._running) >= self.max_jobs:
+            return False
+        if not self._running or self.memory_limit is None:
+            return True
+        return self._memory_in_use() + job.memory <= self.memory_limit
+
+    def _schedule(self):
+        # Jobs start in submission order so a large job is not overtaken forever
+        while self._queue and self._admits(self._queue[0]):
+            self._start(self._queue.popleft())
+
+    def _start(self, job):
+        worker_factory = self.worker_factory
+        if worker_factory is None:
+            from napari.qt.threading import thread_worker as worker_factory
+
+        job.state = 'running'
+        self._running.append(job)
+        job.worker = worker_factory(closing_generator(job, job.function),
+                                    progress=job.progress)(*job.args)
+        job.worker.yielded.connect(functools.partial(self._deliver, job, 'yielded'))
+        job.worker.returned.connect(functools.partial(self._deliver, job, 'returned'))
+        job.worker.finished.connect(functools.partial(self._finish, job))
+        job.worker.start()
+
+    def _deliver(self, job, name, value):
+        # Values reaching the main thread after the job was cancelled are dropped
+        if job.state != 'cancelled':
+            job._emit(name, value)
+
+    def _finish(self, job):
+        self._running.remove(job)
+        self._forget(job, 'cancelled' if job.state == 'cancelled' else 'done')
+        job._emit('finished')
+        self._schedule()
+
+    def _forget(self, job, state):
+        job.state = state
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        if job.claim is not None:
+            job.claim.release()
+
+
+_default = None
+
+
+def default_scheduler():
+    """
+    Scheduler shared by the tools, created on first use.
+
+    Returns:
+        JobScheduler configured from the environment
+    """
+    global _default
+    if _default is None:
+        _default = JobScheduler()
+    return _default
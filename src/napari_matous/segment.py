@@ -1,23 +1,350 @@
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import napari
+import numpy as np
 from skimage.filters import threshold_otsu, try_all_threshold
-from skimage.morphology import closing, square
+from skimage.morphology import closing
 from skimage.color import rgb2gray
 from napari.layers import Labels
 from magicgui import magic_factory
 from napari.layers import Image
 
+from .scheduler import array_key, default_scheduler
+from .tiling import iter_tiles
+
+# Number of elements along each axis of the chunks that are
+# thresholded and closed in parallel
+CHUNK_SIZE = 512
+
+# Number of elements histogrammed at once when computing the threshold
+HISTOGRAM_CHUNK = 2 ** 24
+
+
+def iter_slabs(image, size=HISTOGRAM_CHUNK):
+    """
+    Yields slabs of an image along its first axis, each
+    holding roughly 'size' elements.
+
+    Args:
+        image: ndarray or memmap
+        size: Approximate number of elements per slab
+
+    Yields:
+        ndarray slabs of the image
+    """
+    row = max(1, image.size // max(len(image), 1))
+    step = max(1, size // row)
+    for start in range(0, len(image), step):
+        yield np.asarray(image[start:start + step])
+
+
+def streaming_histogram(image, nbins=256):
+    """
+    Histogram of an image computed slab by slab, with the
+    same bins as 'skimage.exposure.histogram': one bin per
+    value for integer images and 'nbins' bins between the
+    minimum and maximum otherwise.
+
+    Args:
+        image: ndarray or memmap
+        nbins: Number of bins for floating point images
+
+    Returns:
+        (counts, bin_centers)
+    """
+    lo, hi = None, None
+    for slab in iter_slabs(image):
+        lo = slab.min() if lo is None else min(lo, slab.min())
+        hi = slab.max() if hi is None else max(hi, slab.max())
+
+    if np.issubdtype(image.dtype, np.integer):
+        lo, hi = int(lo), int(hi)
+        counts = np.zeros(hi - lo + 1, dtype=np.int64)
+        for slab in iter_slabs(image):
+            counts += np.bincount((slab.ravel().astype(np.int64) - lo), minlength=len(counts))
+        return counts, np.arange(lo, hi + 1)
+
+    counts = np.zeros(nbins, dtype=np.int64)
+    edges = np.histogram_bin_edges([lo, hi], bins=nbins, range=(lo, hi))
+    for slab in iter_slabs(image):
+        counts += np.histogram(slab, bins=edges)[0]
+    return counts, (edges[:-1] + edges[1:]) / 2.0
+
+
+def otsu_threshold(image, hist=None):
+    """
+    Otsu threshold of an image from a streaming histogram,
+    matching 'threshold_otsu' without holding a flattened
+    copy of the image.
+
+    Args:
+        image: Greyscale ndarray or memmap
+        hist: Optional (counts, bin_centers) already computed
+        with 'streaming_histogram'
 
-def segment(image):
-    thresh = threshold_otsu(image)
-    bw = closing(image > thresh, square(3))
+    Returns:
+        The threshold
+    """
+    counts, bin_centers = streaming_histogram(image) if hist is None else hist
+    if len(bin_centers) == 1 or np.count_nonzero(counts) == 1:
+        return bin_centers[np.argmax(counts)]
+    return threshold_otsu(hist=(counts, bin_centers))
+
+
+def threshold_and_close(image, thresh, closing_size=3):
+    """
+    Thresholds an image and closes gaps in the foreground
+    with a cube footprint of the given size.
+
+    Args:
+        image: Greyscale image of any number of dimensions
+        thresh: Threshold, values above it are foreground
+        closing_size: Width of the closing footprint, 1 disables closing
+
+    Returns:
+        Boolean foreground mask
+    """
+    bw = np.asarray(image) > thresh
+    if closing_size > 1:
+        bw = closing(bw, np.ones((closing_size,) * bw.ndim, dtype=bool))
     return bw
 
 
+def close_region(image, core, thresh, closing_size=3):
+    """
+    Thresholds and closes one region of an image, reading
+    enough around it for the result to match that of the
+    whole image.
+
+    Args:
+        image: Greyscale image of any number of dimensions
+        core: Tuple of slices, the region to segment
+        thresh: Threshold, values above it are foreground
+        closing_size: Width of the closing footprint, 1 disables closing
+
+    Returns:
+        Boolean foreground mask of the region
+    """
+    # Same overlap as the chunks of 'segment'
+    margin = 2 * (closing_size // 2)
+    read = tuple(slice(max(c.start - margin, 0), min(c.stop + margin, size))
+                 for c, size in zip(core, image.shape))
+    closed = threshold_and_close(image[read], thresh, closing_size)
+    return closed[tuple(slice(c.start - r.start, c.stop - r.start) for r, c in zip(read, core))]
+
+
+def segment(image, thresh=None, closing_size=3, chunk_size=CHUNK_SIZE, workers=None):
+    """
+    Thresholds an image at its Otsu threshold and closes
+    small gaps in the foreground.
+
+    The threshold and closing are applied over overlapping
+    chunks in a thread pool, with a footprint matching the
+    number of dimensions of the image.
+
+    Args:
+        image: Greyscale image of any number of dimensions
+        thresh: Threshold to use instead of the Otsu threshold
+        closing_size: Width of the closing footprint, 1 disables closing
+        chunk_size: Number of elements along each axis of a chunk
+        workers: Number of threads, defaults to the number of CPUs
+
+    Returns:
+        uint8 label image, 1 for foreground
+    """
+    if thresh is None:
+        thresh = otsu_threshold(image)
+    bw = np.empty(image.shape, dtype=bool)
+
+    # Dilation then erosion each reach half the footprint, so
+    # twice that overlap makes the chunk cores exact
+    overlap = 2 * (closing_size // 2)
+
+    def close_chunk(tile):
+        read, core = tile
+        closed = threshold_and_close(image[read], thresh, closing_size)
+        bw[core] = closed[tuple(slice(c.start - r.start, c.stop - r.start)
+                                for r, c in zip(read, core))]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(close_chunk, iter_tiles(image.shape, chunk_size, overlap)))
+
+    return bw.view(np.uint8)
+
+
+_previews = weakref.WeakKeyDictionary()
+
+
+def grey_histogram(data, rgb):
+    """
+    Greyscale data, histogram and Otsu threshold of image data.
+
+    Args:
+        data: Image data
+        rgb: Whether the data has a trailing colour axis
+
+    Returns:
+        (grey data, (counts, bin_centers), otsu threshold)
+    """
+    grey = rgb2gray(data).astype(np.float32) if rgb else data
+    hist = streaming_histogram(grey)
+    return grey, hist, otsu_threshold(grey, hist)
+
+
+def cached_histogram(image):
+    """
+    Greyscale data, histogram and Otsu threshold of an image
+    layer if they were computed for its current data.
+
+    Args:
+        image: napari Image layer
+
+    Returns:
+        (grey data, (counts, bin_centers), otsu threshold), or
+        None if they have not been computed yet
+    """
+    cached = _previews.get(image)
+    if cached is None or cached[0] is not image.data:
+        return None
+    return cached[1:]
+
+
+def layer_histogram(image):
+    """
+    Greyscale data, histogram and Otsu threshold of an image
+    layer, computed once and cached until the layer's data
+    is replaced.
+
+    Args:
+        image: napari Image layer
+
+    Returns:
+        (grey data, (counts, bin_centers), otsu threshold)
+    """
+    cached = cached_histogram(image)
+    if cached is None:
+        cached = grey_histogram(image.data, image.rgb)
+        _previews[image] = (image.data,) + cached
+    return cached
+
+
 @magic_factory(layout='vertical', call_button='Segment')
 def segment_image(image: Image) -> Labels:
 
+    data = image.data
     if image.rgb:
-        image = rgb2gray(image.data)
+        data = rgb2gray(data)
 
-    label_image = segment(image)
+    label_image = segment(data)
 
     return Labels(label_image, name='segmentation', color={0: 'black', 1: 'white'})
+
+
+def _init_preview(widget):
+    """
+    Connects the threshold preview widget so that moving a
+    slider, choosing another image, panning, zooming or
+    changing the visible slice re-thresholds only the part
+    of the visible slice in view.
+
+    Updates are debounced so that dragging a slider only
+    computes the position it comes to rest on. The histogram
+    giving the slider range is computed in a worker, and the
+    preview starts once it is ready.
+
+    Args:
+        widget: The created threshold preview widget
+    """
+    from superqt.utils import qdebounced
+
+    def preview_layer(viewer, image, shape):
+        name = image.name + ' threshold preview'
+        if name in viewer.layers and viewer.layers[name].data.shape == shape:
+            return viewer.layers[name]
+        if name in viewer.layers:
+            viewer.layers.remove(name)
+        return viewer.add_labels(np.zeros(shape, dtype=np.uint8), name=name)
+
+    def show_range(image):
+        _, (_, bin_centers), otsu = cached_histogram(image)
+        widget.threshold.min = float(bin_centers[0])
+        widget.threshold.max = float(bin_centers[-1])
+        widget.threshold.value = float(otsu)
+
+    def update_range(image):
+        if image is None:
+            return
+        if cached_histogram(image) is not None:
+            show_range(image)
+            return
+        data = image.data
+
+        def cache(result):
+            _previews[image] = (data,) + result
+            if widget.image.value is image:
+                show_range(image)
+                update_preview()
+
+        # The greyscale copy and histogram of large images are
+        # computed in a worker, the preview waits for them
+        memory = 12 * (data.size // data.shape[-1]) if image.rgb else 0
+        default_scheduler().submit(('histogram', array_key(data), image.rgb), grey_histogram,
+                                   data, image.rgb, memory=memory, returned=cache)
+
+    @qdebounced(timeout=20)
+    def update_preview(*_):
+        image, viewer = widget.image.value, widget.viewer.value
+        if image is None or viewer is None:
+            return
+        cached = cached_histogram(image)
+        if cached is None:
+            return
+        grey = cached[0]
+        layer = preview_layer(viewer, image, grey.shape)
+        # Leading axes are fixed to the slice shown in the viewer,
+        # and only the part of it in view is thresholded
+        step = viewer.dims.current_step[-grey.ndim:]
+        index = tuple(step[:grey.ndim - 2])
+        core = tuple(slice(int(lo), int(hi) + 1) for lo, hi in zip(*image.corner_pixels[:, -2:]))
+        layer.data[index][core] = close_region(grey[index], core, widget.threshold.value,
+                                               widget.closing_size.value)
+        layer.refresh()
+
+    widget.image.changed.connect(update_range)
+    widget.image.changed.connect(update_preview)
+    widget.threshold.changed.connect(update_preview)
+    widget.closing_size.changed.connect(update_preview)
+    if widget.viewer.value is not None:
+        widget.viewer.value.dims.events.current_step.connect(update_preview)
+        widget.viewer.value.camera.events.center.connect(update_preview)
+        widget.viewer.value.camera.events.zoom.connect(update_preview)
+    update_range(widget.image.value)
+
+
+@magic_factory(layout='vertical', call_button='Apply to all slices', widget_init=_init_preview,
+               threshold={"widget_type": "FloatSlider"},
+               closing_size={"widget_type": "Slider", "min": 1, "max": 15})
+def threshold_preview(image: Image,
+                      viewer: "napari.viewer.Viewer",
+                      threshold: float = 0.5,
+                      closing_size: int = 3):
+    """
+    Interactive threshold segmentation, the visible slice is
+    updated in place as the sliders move and the whole image
+    is segmented when the button is pressed.
+
+    Args:
+        image: Image to segment
+        viewer: The napari viewer
+        threshold: Threshold, starts at the Otsu threshold
+        closing_size: Width of the closing footprint, 1 disables closing
+    """
+    grey, _, _ = layer_histogram(image)
+    name = image.name + ' threshold preview'
+    labels = segment(grey, threshold, closing_size)
+    if name in viewer.layers:
+        viewer.layers[name].data = labels
+    else:
+        viewer.add_labels(labels, name=name)
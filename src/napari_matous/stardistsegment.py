@@ -5,30 +5,350 @@ Tool that applies stardist pre-trained
 segmentation models to user inputted
 images
 """
-from csbdeep.utils import normalize
+import os
+import threading
+from functools import partial
+
+import numpy as np
 from magicgui import magic_factory
 from napari.layers import Image
-from napari.qt.threading import thread_worker
+from napari.utils.notifications import show_info
+from scipy import ndimage as ndi
 from skimage.color import rgb2gray, gray2rgb, rgba2rgb
-from stardist.models import StarDist2D
 from typing_extensions import Annotated
 
+from .instrument import instrument
+from .scheduler import array_key, default_scheduler
+from .tiling import count_tiles, iter_tiles
+
+# Pre-trained models offered by the tool
+MODEL_NAMES = {"2D versatile fluo": "2D_versatile_fluo",
+               "2D versatile he": "2D_versatile_he"}
+
+# Set to a non-empty value to load the models when the widget is created
+WARM_UP_ENV = "NAPARI_MATOUS_WARM_UP"
+
+# Percentiles used by 'csbdeep.utils.normalize'
+PERCENTILES = (3, 99.8)
+
+# Largest number of pixels sampled when estimating the
+# normalisation percentiles of a tiled image
+PERCENTILE_SAMPLE_SIZE = 2 ** 22
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(name):
+    """
+    Returns a pre-trained StarDist2D model, loading it
+    the first time it is requested.
+
+    Loaded models are kept for the lifetime of the process
+    so repeated segmentations reuse the same weights.
+
+    Args:
+        name: Name of the pre-trained model e.g. '2D_versatile_fluo'
+
+    Returns:
+        The loaded StarDist2D model
+    """
+    from stardist.models import StarDist2D
+
+    with _models_lock:
+        if name not in _models:
+            _models[name] = StarDist2D.from_pretrained(name)
+        return _models[name]
+
+
+def evict_model(name=None):
+    """
+    Drops loaded models from the cache so their memory can
+    be freed.
+
+    Args:
+        name: Name of the model to drop, None drops every model
+    """
+    with _models_lock:
+        if name is None:
+            _models.clear()
+        else:
+            _models.pop(name, None)
+
+
+def cached_models():
+    """
+    Names of the models currently held in the cache.
+
+    Returns:
+        Tuple of model names
+    """
+    with _models_lock:
+        return tuple(_models)
+
+
+def warm_up(names=tuple(MODEL_NAMES.values())):
+    """
+    Loads models in a background thread so the first
+    segmentation does not wait for them.
+
+    Args:
+        names: Names of the pre-trained models to load
+
+    Returns:
+        The started thread worker
+    """
+    from napari.qt.threading import thread_worker
+
+    @thread_worker
+    def load_models():
+        for name in names:
+            get_model(name)
+
+    worker = load_models()
+    worker.start()
+    return worker
+
+
+def _on_init(widget):
+    """
+    Warms up the model cache when the widget is created
+    if requested through the environment.
+
+    Args:
+        widget: The created stardist segmentation widget
+    """
+    if os.environ.get(WARM_UP_ENV):
+        warm_up()
+
+
+def paste_labels(labels, tile_labels, read, core, next_label):
+    """
+    Copies the objects a tile owns into the full label image.
+
+    An object is owned by the tile whose core contains the
+    centre of the object's bounding box, so objects crossing a
+    seam are only kept once. Pixels already claimed by an
+    object from a neighbouring tile are not overwritten.
+
+    Args:
+        labels: Full label image which is written in place
+        tile_labels: Labels predicted for the read region of the tile
+        read: Slices of the region the tile was predicted on
+        core: Slices of the region the tile owns
+        next_label: First free label id in 'labels'
+
+    Returns:
+        The next free label id
+    """
+    target = labels[read]
+    for label, box in enumerate(ndi.find_objects(tile_labels), start=1):
+        if box is None:
+            continue
+        centre = [r.start + (b.start + b.stop - 1) // 2 for r, b in zip(read, box)]
+        if not all(c.start <= x < c.stop for c, x in zip(core, centre)):
+            continue
+        mask = (tile_labels[box] == label) & (target[box] == 0)
+        target[box][mask] = next_label
+        next_label += 1
+    return next_label
+
+
+def predict_tiled(model, data, convert, tile_size=0, overlap=64, out=None):
+    """
+    Generator which segments an image tile by tile.
+
+    The normalisation percentiles are taken from the whole
+    image (a strided sample of it when tiling) so that every
+    tile is normalised identically. Peak memory of the model
+    is bounded by the tile size rather than the image size.
+
+    Args:
+        model: Loaded StarDist2D model
+        data: Image data, the first two axes are Y and X
+        convert: Function converting raw image data into the
+        input the model expects
+        tile_size: Size of the tile cores in pixels, 0 predicts the
+        whole image in one call
+        overlap: Pixels read around each tile, should be larger
+        than the biggest object
+        out: Optional zeroed int32 array the labels are written to
+
+    Yields:
+        The label image being filled in after every tile
+
+    Returns:
+        The finished label image
+    """
+    from csbdeep.utils import normalize, normalize_mi_ma
+
+    if tile_size <= 0:
+        labels, _ = model.predict_instances(normalize(convert(np.asarray(data)),
+                                                      *PERCENTILES))
+        if out is not None:
+            out[...] = labels
+            labels = out
+        yield labels
+        return labels
+
+    step = max(1, int(np.sqrt(data.shape[0] * data.shape[1] / PERCENTILE_SAMPLE_SIZE)))
+    sample = convert(np.asarray(data[::step, ::step]))
+    mi, ma = np.percentile(sample, PERCENTILES)
+
+    labels = np.zeros(data.shape[:2], dtype=np.int32) if out is None else out
+    next_label = 1
+    for read, core in iter_tiles(data.shape[:2], tile_size, overlap):
+        tile = normalize_mi_ma(convert(np.asarray(data[read])), mi, ma)
+        tile_labels, _ = model.predict_instances(tile)
+        next_label = paste_labels(labels, tile_labels, read, core, next_label)
+        yield labels
+    return labels
+
+
+def plane_shape(image):
+    """
+    Splits the shape of an image layer into the leading
+    (time, Z, ...) axes and the 2D plane that is segmented.
+
+    Args:
+        image: napari Image layer
+
+    Returns:
+        (leading, plane) tuples of axis sizes
+    """
+    shape = image.data.shape[:-1] if image.rgb else image.data.shape
+    return shape[:-2], shape[-2:]
+
+
+def to_gray(img, rgb):
+    """
+    Converts rgb and rgba image data to greyscale,
+    greyscale data is returned unchanged.
+
+    Args:
+        img: Image data
+        rgb: Whether the data has a trailing colour axis
+
+    Returns:
+        Greyscale image data
+    """
+    if not rgb:
+        return img
+    if img.shape[-1] == 4:  # rgba -> rgb -> grey
+        return rgb2gray(rgba2rgb(img))
+    return rgb2gray(img)  # rgb -> grey
+
+
+def to_rgb(img, rgb):
+    """
+    Converts greyscale image data to rgb, rgb
+    data is returned unchanged.
+
+    Args:
+        img: Image data
+        rgb: Whether the data has a trailing colour axis
+
+    Returns:
+        Rgb image data
+    """
+    if not rgb:
+        return gray2rgb(img)
+    return img
+
+
+def segment_stack(model, data, rgb, convert, tile_size=0, overlap=64):
+    """
+    Generator which segments every 2D plane of an image
+    into one label array, filled in plane by plane.
+
+    Args:
+        model: Loaded StarDist2D model
+        data: Image data, the last two (non-colour) axes are Y and X
+        rgb: Whether the data has a trailing colour axis
+        convert: Function taking image data and an rgb flag and
+        returning the input the model expects
+        tile_size: Size of the tiles in pixels, 0 segments each
+        plane in one call
+        overlap: Pixels shared between neighbouring tiles
 
-@magic_factory(call_button='Segment')
+    Yields:
+        The label array after every finished tile
+
+    Returns:
+        The finished label array
+    """
+    shape = data.shape[:-1] if rgb else data.shape
+    leading, plane = shape[:-2], shape[-2:]
+    labels = np.zeros(leading + plane, dtype=np.int32)
+    for index in np.ndindex(*leading):
+        tiles = predict_tiled(model, data[index], partial(convert, rgb=rgb),
+                              tile_size, overlap, out=labels[index])
+        for _ in tiles:
+            yield labels
+    return labels
+
+
+def segment_planes(model, images, convert, tile_size=0, overlap=64):
+    """
+    Generator which segments every 2D plane of every image
+    with one loaded model.
+
+    Each image gets its own label array which is filled in
+    plane by plane, so results can be shown while the rest
+    of the stack is still being segmented.
+
+    Args:
+        model: Loaded StarDist2D model
+        images: napari Image layers to segment
+        convert: Function taking image data and an rgb flag and
+        returning the input the model expects
+        tile_size: Size of the tiles in pixels, 0 segments each
+        plane in one call
+        overlap: Pixels shared between neighbouring tiles
+
+    Yields:
+        (image, labels) after every finished tile
+
+    Returns:
+        List of the label arrays, one per image
+    """
+    results = []
+    for image in images:
+        stack = segment_stack(model, image.data, image.rgb, convert, tile_size, overlap)
+        for labels in stack:
+            yield image, labels
+        results.append(labels)
+    return results
+
+
+@magic_factory(call_button='Segment', widget_init=_on_init)
 def stardist_segment_image(image: Image,
                            viewer: "napari.viewer.Viewer",
-                           model_choice: Annotated[str, {"choices": ["2D versatile fluo",
-                                                                     "2D versatile he"]}]):
+                           model_choice: Annotated[str, {"choices": list(MODEL_NAMES)}],
+                           batch_mode: Annotated[str, {"choices": ["Image",
+                                                                   "Selected layers"]}] = "Image",
+                           tile_size: Annotated[int, {"min": 0, "max": 65536, "step": 256}] = 0,
+                           tile_overlap: Annotated[int, {"min": 0, "max": 1024}] = 64):
     """
     Function that takes a user inputted image and
     applies a pre-trained segmentation model of
     their choice and outputs the segmentations as a
     napari Label and adds it to the napari Viewer
 
+    Every 2D plane of time or Z stacks is segmented, and
+    large planes can be segmented in overlapping tiles. The
+    labels layer is updated as each plane and tile finishes.
+
     Args:
         image: Image to apply the segmentation to
         viewer: The napari viewer layer
         model_choice: Pre-trained model to segment image
+        batch_mode: Segment the chosen image, or every image layer
+        selected in the layer list
+        tile_size: Size of the tiles in pixels, 0 segments the whole
+        plane at once
+        tile_overlap: Pixels shared between neighbouring tiles
 
     Returns:
         Napari Label layer containing the segmentations of the user
@@ -37,74 +357,97 @@ def stardist_segment_image(image: Image,
     def get_data(return_value):
         """
         Gets data outputted from the model and adds it
-        to the napari viewer
+        to the napari viewer, or refreshes the layer if
+        it has already been added
+
+        The layer is found by its data, the label array
+        of the job, so a submission merged into a running
+        job refreshes the layer the job already added.
 
         Args:
             return_value:
-                Outputted segmentations from the segmentation model
-        Returns:
-            Napari label layer containing the segmentations
+                Input image and its outputted segmentations
+                from the segmentation model
         """
-        data = return_value
-        viewer.add_labels(data, name='Stardist Segmentation')
+        img, data = return_value
+        # Layers are told apart by their data, several may share a name
+        for layer in viewer.layers:
+            if layer.data is data:
+                layer.refresh()
+                return
+        name = 'Stardist Segmentation'
+        if batch_mode == "Selected layers":
+            name = img.name + ' ' + name
+        viewer.add_labels(data, name=name)
 
-    @thread_worker
-    def segment_2d_versatile_fluo(img):
+    def get_results(results):
+        """
+        Shows the finished segmentations, which a submission
+        merged into the job after its last tile only gets
+        here.
+
+        Args:
+            results: Label arrays, one per segmented image
+        """
+        for img, data in zip(images, results):
+            get_data((img, data))
+
+    @instrument('stardist 2D versatile fluo')
+    def segment_2d_versatile_fluo(images):
         """
         Function which applies the stardist
         2D Versatile Fluo segmentation model to the
-        user inputted image.
+        user inputted images.
 
         Args:
-            img: Image to apply the segmentation to
+            images: Images to apply the segmentation to
 
         Returns:
-            Segmented labels of the inputted image
+            Segmented labels of the inputted images
         """
+        model = get_model(MODEL_NAMES['2D versatile fluo'])
+        return (yield from segment_planes(model, images, to_gray, tile_size, tile_overlap))
 
-        model = StarDist2D.from_pretrained('2D_versatile_fluo')
-
-        if not img.rgb:
-            labels, _ = model.predict_instances(normalize(img.data))  # gray
-            return labels
-
-        if img.data.shape[2] == 4:  # rgba -> rgb -> grey
-            img = rgb2gray(rgba2rgb(img.data))
-            labels, _ = model.predict_instances(normalize(img))
-            return labels
-
-        if img.rgb:
-            img = rgb2gray(img.data)  # rgb -> grey
-            labels, _ = model.predict_instances(normalize(img))
-            return labels
-
-    @thread_worker
-    def segment_2d_versatile_he(img):
+    @instrument('stardist 2D versatile he')
+    def segment_2d_versatile_he(images):
         """
         Function which applies the stardist
         2D Versatile He segmentation model to the
-        user inputted image.
+        user inputted images.
 
         Args:
-            img: Image to apply the segmentation to
+            images: Images to apply the segmentation to
 
         Returns:
-            Segmented labels of the inputted image
+            Segmented labels of the inputted images
         """
-        if not img.rgb:
-            img = gray2rgb(img.data)
-
-        model = StarDist2D.from_pretrained('2D_versatile_he')
-        labels, _ = model.predict_instances(normalize(img.data))
+        model = get_model(MODEL_NAMES['2D versatile he'])
+        return (yield from segment_planes(model, images, to_rgb, tile_size, tile_overlap))
 
-        return labels
+    if batch_mode == "Selected layers":
+        images = [layer for layer in viewer.layers.selection if isinstance(layer, Image)]
+    else:
+        images = [image] if image is not None else []
+    if not images:
+        show_info("No image layers to segment, choose an image or select image layers")
+        return
 
-    # Starts thread worker for each model depending on model choice
+    # Queues a job for the chosen model, progress is reported once per
+    # tile of every plane and the job can be cancelled between tiles
+    total = 0
+    memory = 0
+    for img in images:
+        leading, plane = plane_shape(img)
+        total += int(np.prod(leading)) * count_tiles(plane, tile_size)
+        # int32 labels and the normalised float32 input of every plane
+        memory += 8 * int(np.prod(leading)) * int(np.prod(plane))
     if model_choice == "2D versatile fluo":
-        worker = segment_2d_versatile_fluo(image)
-        worker.returned.connect(get_data)
-        worker.start()
+        segment_images = segment_2d_versatile_fluo
     else:
-        worker = segment_2d_versatile_he(image)
-        worker.returned.connect(get_data)
-        worker.start()
+        segment_images = segment_2d_versatile_he
+    # Running the same model on the same image data twice is merged into one job
+    key = ('stardist', model_choice, tuple(array_key(img.data) for img in images), tile_size,
+           tile_overlap)
+    default_scheduler().submit(key, segment_images, images, memory=memory,
+                               progress={'total': total}, yielded=get_data,
+                               returned=get_results)
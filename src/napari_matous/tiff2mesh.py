@@ -4,24 +4,453 @@ Tiff 2 Mesh
 Tool which converts biological tiff segmentation
 ground truth into 3D meshes using marching cubes
 algorithm and provides the option to save the mesh
-to a desired location.
+to a desired location. The voxel spacing is read from
+the tiff's OME or ImageJ metadata, and a downsampled
+preview mesh can be shown while the full resolution
+mesh is computed. A labels layer of the viewer
+can be meshed instead, its surface is then updated
+chunk by chunk as the layer is painted.
 """
-import open3d
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
 import numpy as np
+import tifffile
 import napari
-from napari.qt.threading import thread_worker
 from magicgui import magic_factory
+from napari.layers import Layer
 from scipy import ndimage as ndi
 from pathlib import Path
 from skimage.io import imread
-from skimage.measure import marching_cubes
+from skimage.measure import block_reduce, marching_cubes
 from typing_extensions import Annotated
 
+from .chunkedmesh import IncrementalMesher, chunked_marching_cubes, label_meshes
+from .instrument import instrument
+from .lod import set_surface, show_surface
+from .meshcache import cache_key, default_cache, source_key
+from .meshdata import MeshData
+from .meshwriter import FORMATS, output_file, save_mesh
+from .scheduler import default_scheduler, file_key, file_size
+
+# Chunk size of marching cubes on lazily read stacks when none is chosen,
+# meshing in one pass would load the whole filled stack
+LAZY_CHUNK_SIZE = 64
+
+# Voxel spacing of stacks without spacing metadata
+DEFAULT_SPACING = (4, 1, 1)
+
+# Ways of downsampling the filled stack for a preview mesh
+PREVIEW_MODES = {"Block mean": "mean",
+                 "Max pool": "max",
+                 "Step size": "step"}
+
+# Chunk size of live layer meshes when no chunk size is chosen
+LIVE_CHUNK_SIZE = 32
+
+
+class TiffPageStack:
+    """
+    Read only stack that decodes a tiff page only when
+    the slice is requested, used for compressed tiffs
+    which cannot be memory-mapped.
+    """
+    def __init__(self, path):
+        self._tiff = tifffile.TiffFile(str(path))
+        self._lock = threading.Lock()
+        pages = self._tiff.pages
+        self.shape = (len(pages),) + tuple(pages[0].shape)
+        self.dtype = pages[0].dtype
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        first, rest = index[0], index[1:]
+        if isinstance(first, (int, np.integer)):
+            with self._lock:
+                return self._tiff.pages[int(first)].asarray()[rest]
+        with self._lock:
+            return np.stack([self._tiff.pages[i].asarray()[rest]
+                             for i in range(*first.indices(len(self)))])
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._tiff.close()
+
+
+def read_stack(path, lazy=False):
+    """
+    Reads a tiff stack either fully into memory or lazily.
+
+    Lazily read stacks are memory-mapped when the tiff is
+    uncompressed and contiguous, otherwise pages are decoded
+    one at a time as they are used.
+
+    Args:
+        path: Path to the tiff stack
+        lazy: Whether to avoid loading the whole stack
+
+    Returns:
+        ndarray, memory-mapped ndarray or TiffPageStack of the stack
+    """
+    if not lazy:
+        return imread(str(path))
+    try:
+        return tifffile.memmap(str(path), mode='r')
+    except ValueError:
+        return TiffPageStack(path)
+
+
+@contextmanager
+def open_stack(path, lazy=False):
+    """
+    Reads a tiff stack with 'read_stack' and closes the tiff
+    file of a page stack once the block ends.
+
+    Args:
+        path: Path to the tiff stack
+        lazy: Whether to avoid loading the whole stack
+
+    Yields:
+        ndarray, memory-mapped ndarray or TiffPageStack of the stack
+    """
+    stack = read_stack(path, lazy)
+    try:
+        yield stack
+    finally:
+        if isinstance(stack, TiffPageStack):
+            stack.close()
+
+
+def tiff_spacing(path, default=DEFAULT_SPACING):
+    """
+    Voxel spacing of a tiff stack from its OME metadata, or
+    from the z spacing and the resolution tags written by
+    ImageJ.
+
+    Args:
+        path: Path to the tiff stack
+        default: Spacing used when the metadata does not give
+        the spacing along all three axes
+
+    Returns:
+        (z, y, x) spacing as a tuple of floats
+    """
+    try:
+        with tifffile.TiffFile(str(path)) as tiff:
+            if tiff.is_ome:
+                image = tifffile.xml2dict(tiff.ome_metadata)['OME']['Image']
+                if isinstance(image, list):
+                    image = image[0]
+                pixels = image['Pixels']
+                spacing = tuple(pixels.get('PhysicalSize' + axis) for axis in 'ZYX')
+            elif tiff.is_imagej:
+                tags = tiff.pages[0].tags
+                spacing = (tiff.imagej_metadata.get('spacing'),)
+                for name in ('YResolution', 'XResolution'):
+                    # Resolution tags are pixels per unit
+                    numerator, denominator = tags[name].value if name in tags else (0, 1)
+                    spacing += (denominator / numerator if numerator else None,)
+            else:
+                spacing = (None,)
+    except (OSError, KeyError, TypeError, ValueError, tifffile.TiffFileError):
+        spacing = (None,)
+    if len(spacing) != 3 or any(value is None or float(value) <= 0 for value in spacing):
+        return tuple(float(value) for value in default)
+    return tuple(float(value) for value in spacing)
+
+
+def disk_backed_mask(shape):
+    """
+    Creates a boolean array backed by an anonymous temporary
+    file, so that large masks are paged out by the OS instead
+    of being held in memory.
+
+    Args:
+        shape: Shape of the mask
+
+    Returns:
+        Writable boolean memmap
+    """
+    return np.memmap(tempfile.TemporaryFile(), dtype=bool, mode='w+', shape=shape)
+
+
+def tiff_preprocessing(stack, fill_mode='slice', workers=None, out=None):
+    """
+    Fills any holes or gaps int the
+    tiff segmentations.
+
+    Slices are filled independently in a thread pool
+    (scipy releases the GIL while filling), or the whole
+    stack is filled at once in 3D.
+
+    Args:
+        stack: Stack of images stored as ndarray
+        fill_mode: 'slice' to fill each slice in 2D or '3d' to
+        fill holes enclosed in the volume
+        workers: Number of threads, defaults to the number of CPUs
+        out: Optional boolean array the filled stack is written to
+
+    Returns:
+        Boolean ndarray of tiff images with any holes filled
+    """
+    if out is None:
+        out = np.empty(stack.shape, dtype=bool)
+
+    if fill_mode == '3d':
+        ndi.binary_fill_holes(np.asarray(stack), output=out)
+        return out
+
+    def fill_slice(i):
+        ndi.binary_fill_holes(np.asarray(stack[i]), output=out[i])
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(fill_slice, range(len(stack))))
+
+    return out
+
+
+def downsample(volume, factor, mode='mean'):
+    """
+    Shrinks a volume by a factor along every axis, one slab
+    of 'factor' slices at a time so that memory-mapped
+    volumes are never loaded in full. Blocks at the far
+    edges are padded with zeros.
+
+    Args:
+        volume: 3D array or memmap
+        factor: Number of voxels pooled along each axis
+        mode: 'mean' averages each block, 'max' keeps its maximum
+
+    Returns:
+        Downsampled ndarray, float32 for 'mean'
+    """
+    function = np.mean if mode == 'mean' else np.max
+    slabs = [block_reduce(np.asarray(volume[start:start + factor]), (factor,) * 3, function, cval=0)
+             for start in range(0, len(volume), factor)]
+    volume = np.concatenate(slabs)
+    return volume.astype(np.float32) if mode == 'mean' else volume
+
+
+def preview_mesh(filled, spacing, factor, mode='mean', level=None):
+    """
+    Coarse mesh of a filled stack, meshed from a downsampled
+    copy of the stack or with a larger marching cubes step.
+
+    Args:
+        filled: Filled stack
+        spacing: Voxel spacing of the stack
+        factor: Downsampling factor or marching cubes step size
+        mode: 'mean', 'max' or 'step', see 'PREVIEW_MODES'
+        level: Marching cubes level, defaults to the middle of the data range
+
+    Returns:
+        MeshData of the preview, or None when the downsampled
+        stack has no surface
+    """
+    spacing = np.asarray(spacing, dtype=float)
+    try:
+        if mode == 'step':
+            verts, faces, _, _ = marching_cubes(np.asarray(filled), level, spacing=tuple(spacing),
+                                                step_size=factor)
+        else:
+            verts, faces, _, _ = marching_cubes(downsample(filled, factor, mode), level,
+                                                spacing=tuple(spacing * factor))
+            # A pooled voxel sits at the centre of the block it pools
+            verts += spacing * (factor - 1) / 2
+    except (ValueError, RuntimeError):  # surface vanished when downsampling
+        return None
+    return MeshData(verts, faces)
+
+
+def iter_tiff_mesh(path, fill_mode='slice', spacing=None, level=None, chunk_size=0,
+                   lazy=False, cache=None, preview_factor=1, preview_mode='mean', workers=None):
+    """
+    Generator which reads, fills and meshes a tiff stack,
+    yielding between the stages so that a worker running
+    it can report progress and be cancelled.
+
+    With a cache, the filled stack and the mesh are looked up
+    by the path, size and modification time of the tiff and
+    the parameters of their stages, and stored once computed, so only the stages
+    downstream of a changed parameter are run again.
+
+    Args:
+        path: Path to the tiff stack
+        fill_mode: 'slice' or '3d' hole filling
+        spacing: Voxel spacing of the stack, defaults to 'tiff_spacing'
+        level: Marching cubes level, defaults to the middle of the data range
+        chunk_size: Chunk size of marching cubes, 0 meshes in one pass,
+        or in chunks of 'LAZY_CHUNK_SIZE' when lazy
+        lazy: Memory-map the tiff and keep the filled stack on disk,
+        only with 'slice' filling and previews which do not step
+        cache: Optional ResultCache
+        preview_factor: Downsampling factor of a preview mesh meshed
+        before the full resolution mesh, 1 skips the preview
+        preview_mode: Downsampling of the preview, see 'preview_mesh'
+        workers: Number of threads filling and processes meshing the
+        stack, defaults to the number of CPUs
+
+    Yields:
+        'filled' and 'meshed' as the stages finish, and the MeshData
+        of the preview in between when one is made
+
+    Returns:
+        MeshData of the stack
+
+    Raises:
+        ValueError: If lazy loading is combined with a stage which
+        needs the whole stack in memory
+    """
+    if lazy and fill_mode == '3d':
+        raise ValueError("3D hole filling needs the whole stack in memory, "
+                         "fill slice by slice with lazy loading")
+    if lazy and preview_factor > 1 and preview_mode == 'step':
+        raise ValueError("Step size previews need the whole stack in memory, "
+                         "downsample the preview with lazy loading")
+    if lazy and chunk_size == 0:
+        chunk_size = LAZY_CHUNK_SIZE
+    if spacing is None:
+        spacing = tiff_spacing(path)
+
+    if cache is not None:
+        filled_key = cache_key('filled', source_key(path), fill_mode)
+        mesh_key = cache_key('mesh', filled_key, tuple(spacing), level)
+        mesh = cache.load_mesh(mesh_key)
+        if mesh is not None:
+            yield 'filled'
+            yield 'meshed'
+            return mesh
+        filled = cache.load_array(filled_key)
+    else:
+        filled = None
+
+    if filled is None:
+        with open_stack(path, lazy) as stack:
+            out = disk_backed_mask(stack.shape) if lazy else None
+            filled = tiff_preprocessing(stack, fill_mode, workers, out=out)
+        if cache is not None:
+            cache.store_array(filled_key, filled)
+    yield 'filled'
+
+    if preview_factor > 1:
+        preview = preview_mesh(filled, spacing, preview_factor, preview_mode, level)
+        if preview is not None:
+            yield preview
+
+    if chunk_size > 0:
+        verts, faces = chunked_marching_cubes(filled, level, spacing, chunk_size, workers)
+    else:
+        verts, faces, _, _ = marching_cubes(np.asarray(filled), level, spacing=spacing)
+    mesh = MeshData(verts, faces)
+
+    if cache is not None:
+        cache.store_mesh(mesh_key, mesh)
+    yield 'meshed'
+    return mesh
+
+
+def tiff_mesh(path, fill_mode='slice', spacing=None, level=None, chunk_size=0, lazy=False,
+              cache=None, workers=None):
+    """
+    Reads, fills and meshes a tiff stack, see 'iter_tiff_mesh'.
+
+    Args:
+        path: Path to the tiff stack
+        fill_mode: 'slice' or '3d' hole filling
+        spacing: Voxel spacing of the stack, defaults to 'tiff_spacing'
+        level: Marching cubes level, defaults to the middle of the data range
+        chunk_size: Chunk size of marching cubes, 0 meshes in one pass
+        lazy: Memory-map the tiff and keep the filled stack on disk
+        cache: Optional ResultCache
+        workers: Number of threads and processes, defaults to the number of CPUs
+
+    Returns:
+        MeshData of the stack
+    """
+    stages = iter_tiff_mesh(path, fill_mode, spacing, level, chunk_size, lazy, cache,
+                            workers=workers)
+    while True:
+        try:
+            next(stages)
+        except StopIteration as done:
+            return done.value
+
+
+def merge_regions(regions):
+    """
+    Smallest region holding all of the given regions.
+
+    Args:
+        regions: Tuples of slices, None stands for the whole volume
+
+    Returns:
+        Tuple of slices, or None
+    """
+    if not regions or any(region is None for region in regions):
+        return None
+    return tuple(slice(min(axis.start for axis in axes), max(axis.stop for axis in axes))
+                 for axes in zip(*regions))
+
+
+def paint_region(atoms, shape):
+    """
+    Region of a labels layer changed by a paint event.
+
+    Args:
+        atoms: History atoms of the event, masked paint atoms
+        with a 'slice_key' or (indices, old values, new values)
+        tuples
+        shape: Shape of the layer's data
+
+    Returns:
+        Tuple of slices of the changed voxels, an empty tuple
+        when nothing changed and None when the region is unknown
+    """
+    regions = []
+    for atom in atoms:
+        if hasattr(atom, 'slice_key'):
+            regions.append(tuple(slice(*axis.indices(size)[:2])
+                                 for axis, size in zip(atom.slice_key, shape)))
+        elif isinstance(atom, tuple) and len(atom[0]) == len(shape):
+            indices = [np.asarray(axis) for axis in atom[0]]
+            if indices[0].size:
+                regions.append(tuple(slice(int(axis.min()), int(axis.max()) + 1)
+                                     for axis in indices))
+        else:
+            return None
+    return merge_regions(regions) if regions else ()
+
 
 @magic_factory(call_button='Create Mesh')
 def tiff_2_mesh(viewer: "napari.viewer.Viewer",
                 tiff_path: Path,
-                output_path: Annotated[Path, {"mode": "d"}]):
+                output_path: Annotated[Path, {"mode": "d"}],
+                fill_mode: Annotated[str, {"choices": ["slice", "3d"]}] = "slice",
+                lazy_loading: bool = False,
+                chunk_size: Annotated[int, {"min": 0, "max": 4096}] = 0,
+                mesh_mode: Annotated[str, {"choices": ["Foreground", "Per label"]}] = "Foreground",
+                output_format: Annotated[str, {"choices": list(FORMATS)}] = "PLY (binary)",
+                use_cache: bool = False,
+                preview_factor: Annotated[int, {"min": 1, "max": 16}] = 1,
+                preview_mode: Annotated[str, {"choices": list(PREVIEW_MODES)}] = "Block mean",
+                layer: Optional[Layer] = None):
     """
     Tool which takes the inputted tiff mesh
     and output directory and generates a triangle
@@ -32,80 +461,267 @@ def tiff_2_mesh(viewer: "napari.viewer.Viewer",
         output_path: Directory of the output file
         viewer: layers of the napari viewer
         tiff_path: path to the tiff stack
+        fill_mode: Fill holes slice by slice or in 3D
+        lazy_loading: Memory-map the tiff and keep the filled
+        stack on disk, for stacks larger than memory
+        chunk_size: Mesh the stack in chunks of this many voxels
+        across all cores, 0 meshes it in one pass
+        mesh_mode: Mesh all labels as one foreground surface, or
+        build a separate mesh for every label id
+        output_format: File format of the saved meshes
+        use_cache: Reuse the filled stack and mesh of earlier runs
+        on the same unchanged tiff from the on-disk cache
+        preview_factor: Show a mesh of the stack downsampled by this
+        factor while the full resolution mesh is made, 1 shows none
+        preview_mode: Downsample by block mean, max pooling, or a
+        larger marching cubes step size
+        layer: 3D labels or image layer meshed instead of the tiff,
+        its surface is updated as the layer is painted
 
     Returns:
         3D mesh representation of the tiff stack
         and optionally saves the mesh to a
         desired directory.
     """
-
-    def tiff_preprocessing(stack):
+    @instrument('tiff_2_mesh create_mesh')
+    def create_mesh(path):
         """
-        Fills any holes or gaps int the
-        tiff segmentations.
+        Fills the holes of the tiff stack and creates
+        a 3D mesh using the 'marching cubes' algorithm
+        provided by 'scikit.measure', optionally chunk
+        by chunk, reusing cached results, with the voxel
+        spacing of the tiff's metadata
 
         Args:
-            stack: Stack of images stored as ndarray
+            path: path to the tiff stack to convert into the mesh
 
-        Returns:
-            ndarray of tiff images with any holes filled
-        """
-        filled_stack = np.empty(np.array(stack).shape)
+        Yields: name of every finished stage and the preview MeshData
 
-        for i in range(len(stack)):
-            filled_stack[i] = ndi.binary_fill_holes(stack[i])
+        Returns: MeshData of the vertices and triangles
 
-        return filled_stack
+        """
+        cache = default_cache() if use_cache else None
+        return (yield from iter_tiff_mesh(path, fill_mode, chunk_size=chunk_size,
+                                          lazy=lazy_loading, cache=cache,
+                                          preview_factor=preview_factor,
+                                          preview_mode=PREVIEW_MODES[preview_mode]))
 
-    @thread_worker
-    def create_mesh(stack):
+    @instrument('tiff_2_mesh create_label_meshes')
+    def create_label_meshes(path):
         """
-        Creates a 3D mesh using the inputted stack
-        using the 'marching cubes' algorithm provided
-        by 'scikit.measure'
+        Creates one mesh per label of the inputted
+        label stack, each meshed within its bounding
+        box in a process pool.
 
         Args:
-            stack: ndarray of images to convert into the mesh
+            path: path to the tiff stack of labels to convert into meshes
 
-        Returns: vertices and triangles as a ndarray
+        Yields: label id and MeshData of every label
+        """
+        with open_stack(path, lazy_loading) as stack:  # Reads the tiff file
+            for label, verts, faces in label_meshes(stack, spacing=tiff_spacing(path),
+                                                    fill_mode=fill_mode):
+                yield label, MeshData(verts, faces)
 
+    def view_label(label_mesh):
+        """
+        Adds the mesh of one label to the napari viewer as
+        its own surface layer, and optionally saves it to
+        the output directory.
+
+        Args:
+            label_mesh: label id and MeshData of the mesh
         """
-        verts, faces, _, _ = marching_cubes(stack, spacing=(4, 1, 1))
+        label, mesh = label_mesh
+        name = tiff_path.stem + '_label_' + str(label)
+        if str(output_path) != '.':
+            save_mesh(mesh, output_file(output_path, tiff_path, '_label_' + str(label),
+                                        FORMATS[output_format]))
 
-        mesh = open3d.geometry.TriangleMesh()
+        show_surface(viewer, mesh, name)
 
-        mesh.vertices = open3d.utility.Vector3dVector(np.array(verts))
-        mesh.triangles = open3d.utility.Vector3iVector(np.array(faces).astype(np.int64))
+    def view_preview(stage):
+        """
+        Shows the preview mesh until the full resolution
+        mesh replaces it
 
-        return np.asarray(mesh.vertices), np.asarray(mesh.triangles), mesh
+        Args:
+            stage: name of a finished stage or the preview MeshData
+        """
+        if isinstance(stage, MeshData):
+            show_surface(viewer, stage, tiff_path.name + '_mesh')
 
     def view_data(mesh):
         """
         Adds the generated mesh to the napari viewer by adding a new
         napari surface layer, and optionally saves the file to a directory
-        of the users choice.
+        of the users choice in a background thread.
 
         Args:
-            mesh: generated mesh stored as vertices and triangles
-            to be added to the napari viewer
+            mesh: generated MeshData to be added to the napari viewer
 
         Returns:
             napari surface layer of mesh is added to the viewer
         """
         if str(output_path) != '.':
-            file = open(str(output_path)+'/output.obj', 'w+')
-            open3d.io.write_triangle_mesh(file.name, mesh[2])
-            file.close()
+            save_mesh(mesh, output_file(output_path, tiff_path, '_mesh', FORMATS[output_format]))
+
+        show_surface(viewer, mesh, tiff_path.name + '_mesh')
 
-        viewer.add_surface((mesh[0], mesh[1]), name=tiff_path.name + '_mesh')
+    if layer is not None:
+        mesh_layer(viewer, layer, fill_mode, chunk_size or LIVE_CHUNK_SIZE)
+        return
 
     assert str(tiff_path) != '.', "Tiff path is empty, please select valid path"
+    assert not (lazy_loading and fill_mode == '3d'), \
+        "3D hole filling needs the whole stack in memory, fill slice by slice with lazy loading"
+    assert not (lazy_loading and preview_factor > 1 and preview_mode == "Step size"), \
+        "Step size previews need the whole stack in memory, downsample with lazy loading"
+
+    # Identical runs on an unchanged file are merged into one job,
+    # which needs memory for the stack, the filled mask and the mesh
+    key = ('tiff_2_mesh', file_key(tiff_path), fill_mode, lazy_loading, chunk_size, mesh_mode)
+    memory = 3 * file_size(tiff_path)
+
+    if mesh_mode == "Per label":
+        default_scheduler().submit(key, create_label_meshes, tiff_path, memory=memory,
+                                   yielded=view_label)
+        return
+
+    # Queues the 'create_mesh' job, which reads, fills and meshes the stack
+    default_scheduler().submit(key + (use_cache, preview_factor, preview_mode), create_mesh,
+                               tiff_path, memory=memory,
+                               progress={'total': 3 if preview_factor > 1 else 2},
+                               yielded=view_preview, returned=view_data)
+
+
+def mesh_layer(viewer, layer, fill_mode='slice', chunk_size=LIVE_CHUNK_SIZE):
+    """
+    Meshes the foreground of a layer into a surface layer and
+    keeps it up to date while the layer is painted. Edits are
+    collected on the main thread and meshed one update at a
+    time, each update only remeshing the chunks it touches.
+    Undo and redo emit no paint event, they remesh the whole
+    layer.
+
+    Args:
+        viewer: The napari viewer
+        layer: 3D labels or image layer
+        fill_mode: 'slice' or '3d' hole filling
+        chunk_size: Number of cubes along each axis of a chunk
+    """
+    assert layer.ndim == 3, "Only 3D layers can be meshed"
+
+    name = layer.name + '_mesh'
+    spacing = tuple(layer.scale[-3:])
+    pending = []  # regions edited since the last update
+    mesher = None
+    job = None
+
+    @instrument('tiff_2_mesh create_layer_mesh')
+    def create_layer_mesh(data):
+        """
+        Meshes the whole layer
+
+        Args:
+            data: data of the layer
+
+        Returns: IncrementalMesher and MeshData of the layer
+        """
+        layer_mesher = IncrementalMesher(data, spacing, chunk_size, fill_mode)
+        layer_mesher.update()
+        return layer_mesher, MeshData(*layer_mesher.mesh())
+
+    @instrument('tiff_2_mesh update_layer_mesh')
+    def update_layer_mesh(layer_mesher, data, region):
+        """
+        Remeshes the chunks touched by the edited region
+
+        Args:
+            layer_mesher: IncrementalMesher of the layer
+            data: data of the layer
+            region: edited region, None for the whole layer
+
+        Returns: MeshData of the layer
+        """
+        layer_mesher.labels = data
+        layer_mesher.update(region)
+        return MeshData(*layer_mesher.mesh())
+
+    def live():
+        return claim.active
+
+    def submit(function, *args, returned):
+        nonlocal job
+        # Every update is a new job, the edits it meshes are never merged with another run
+        job = default_scheduler().submit(('tiff_2_mesh', name, object()), function, *args,
+                                         memory=2 * layer.data.nbytes, returned=returned,
+                                         finished=next_update)
+
+    def view_mesh(mesh):
+        # Meshes finished after the layer stopped being meshed are dropped,
+        # napari cannot show a surface without faces
+        if live() and len(mesh):
+            set_surface(viewer, mesh, name)
+
+    def view_layer_mesh(result):
+        nonlocal mesher
+        mesher, mesh = result
+        view_mesh(mesh)
+
+    def next_update():
+        nonlocal job
+        job = None
+        if not live() or mesher is None or not pending:
+            return
+        region = merge_regions(pending)
+        pending.clear()
+        if layer.data.shape != mesher.filled.shape:
+            submit(create_layer_mesh, layer.data, returned=view_layer_mesh)
+        else:
+            submit(update_layer_mesh, mesher, layer.data, region, returned=view_mesh)
+
+    def on_paint(event):
+        region = paint_region(event.value, layer.data.shape)
+        if region != ():
+            pending.append(region)
+        if job is None:
+            next_update()
+
+    def on_data(event=None):
+        pending.append(None)
+        if job is None:
+            next_update()
+
+    def on_removed(event):
+        if event.value is layer:
+            stop()
 
-    tiff_stack = imread(str(tiff_path))  # Reads the tiff file
+    def remesh_after(restore):
+        # Wraps the layer's undo or redo, which only refresh the layer
+        def restore_and_remesh():
+            restore()
+            on_data()
+        return restore_and_remesh
 
-    processed_stack = tiff_preprocessing(tiff_stack)  # Fills any holes or gaps in the segmentations
+    def stop():
+        claim.release()
+        if hasattr(layer.events, 'paint'):
+            layer.events.paint.disconnect(on_paint)
+        layer.events.data.disconnect(on_data)
+        viewer.layers.events.removed.disconnect(on_removed)
+        for action in history_actions:
+            vars(layer).pop(action, None)
+        if job is not None:
+            job.cancel()
 
-    # Starts thread for the 'create_mesh' function
-    worker = create_mesh(processed_stack)
-    worker.returned.connect(view_data)
-    worker.start()
+    # A newer live mesh of the same layer stops this one
+    claim = default_scheduler().claim(('mesh_layer', name), stop)
+    if hasattr(layer.events, 'paint'):
+        layer.events.paint.connect(on_paint)
+    layer.events.data.connect(on_data)
+    viewer.layers.events.removed.connect(on_removed)
+    history_actions = [action for action in ('undo', 'redo') if hasattr(layer, action)]
+    for action in history_actions:
+        setattr(layer, action, remesh_after(getattr(layer, action)))
+    submit(create_layer_mesh, layer.data, returned=view_layer_mesh)
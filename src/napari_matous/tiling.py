@@ -0,0 +1,69 @@
+"""
+Tiling
+
+Helpers for splitting large arrays into overlapping
+tiles so that they can be processed piece by piece
+and stitched back together.
+"""
+import itertools
+
+
+def iter_tiles(shape, tile_shape, overlap):
+    """
+    Splits an array shape into tiles which together cover
+    the whole array.
+
+    Every tile owns a 'core' region, the cores partition the
+    array exactly. The region to read is the core grown by
+    the overlap on every side and clipped to the array.
+
+    Args:
+        shape: Shape of the array to split
+        tile_shape: Size of the tile cores, a single int is used
+        for every axis and values <= 0 mean the whole axis
+        overlap: Number of extra elements read on each side of
+        a core, a single int or one value per axis
+
+    Yields:
+        (read, core) tuples of slices in array coordinates
+    """
+    ndim = len(shape)
+    if isinstance(tile_shape, int):
+        tile_shape = (tile_shape,) * ndim
+    if isinstance(overlap, int):
+        overlap = (overlap,) * ndim
+
+    axes = []
+    for size, tile, margin in zip(shape, tile_shape, overlap):
+        tile = size if tile <= 0 else tile
+        axis = []
+        for start in range(0, size, tile):
+            stop = min(start + tile, size)
+            axis.append((slice(max(start - margin, 0), min(stop + margin, size)),
+                         slice(start, stop)))
+        axes.append(axis)
+
+    for combination in itertools.product(*axes):
+        read = tuple(axis[0] for axis in combination)
+        core = tuple(axis[1] for axis in combination)
+        yield read, core
+
+
+def count_tiles(shape, tile_shape):
+    """
+    Number of tiles 'iter_tiles' yields for a shape.
+
+    Args:
+        shape: Shape of the array to split
+        tile_shape: Size of the tile cores
+
+    Returns:
+        Number of tiles
+    """
+    if isinstance(tile_shape, int):
+        tile_shape = (tile_shape,) * len(shape)
+    total = 1
+    for size, tile in zip(shape, tile_shape):
+        tile = size if tile <= 0 else tile
+        total *= -(-size // tile)
+    return total